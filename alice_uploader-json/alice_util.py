@@ -1,7 +1,20 @@
 import os
 import logging
 import logging.handlers
+import threading
+import json
+import contextlib
+import shutil
+import cProfile
+import pstats
+import tracemalloc
+import io
+from time import perf_counter
+import pandas as pd
 import fs
+from fs.subfs import ClosingSubFS
+from fs.wrapfs import WrapFS
+from fs.path import abspath, normpath, split
 from datetime import datetime, date, timedelta, time
 
 def configurar_log(config_email, nome_arquivo):
@@ -56,7 +69,7 @@ def obter_filesystem(config_secao, criar_diretorio=False):
     :param config_secao: seção do arquivo de configuração (config.ini)
     :param criar_diretorio: indica se o diretório apontado na configuração deve ser criado (ou recriado) ao se obter o filesystem
     
-    :return: referência ao PyFilesystem
+    :return: referência ao PyFilesystem (fechá-la também fecha a conexão ao filesystem)
     """
     filesystem_url = config_secao['url']
     diretorio = config_secao['diretorio']
@@ -64,9 +77,398 @@ def obter_filesystem(config_secao, criar_diretorio=False):
     logging.info("Conectado ao filesystem: {}".format(str(filesystem)))
     if criar_diretorio:
         filesystem.makedirs(diretorio, recreate=True)
-    filesystem = filesystem.opendir(diretorio)
+    # Opcionalmente, as listagens de diretórios são mantidas em memória (ver FilesystemCacheListagem)
+    if config_secao.get('cache_listagem', 'N') == 'S':
+        filesystem = FilesystemCacheListagem(filesystem)
+    filesystem = filesystem.opendir(diretorio, factory=ClosingSubFS)
     return filesystem
 
+class FilesystemCacheListagem(WrapFS):
+    """PyFilesystem que mantém em memória as listagens de diretórios (com os namespaces basic e details) do filesystem
+        encapsulado. Cada diretório é listado uma única vez, e as verificações de existência e tipo (exists, isdir,
+        isfile, getinfo) são respondidas a partir dessas listagens, evitando uma requisição por verificação em
+        filesystems remotos (ex.: WebDAV). As listagens afetadas são descartadas quando um caminho é gravado, movido ou
+        removido por meio deste filesystem; alterações feitas por outros processos não são percebidas.
+
+        Attributes:
+            wrap_fs: filesystem encapsulado.
+    """
+
+    NAMESPACES_CACHE = frozenset(['basic', 'details'])
+
+    def __init__(self, wrap_fs):
+        super().__init__(wrap_fs)
+        self._listagens = {}
+        # Arquivos abertos para escrita por este filesystem: seus detalhes (tamanho, datas) são sempre obtidos do filesystem encapsulado
+        self._escritos = set()
+        self._trava = threading.RLock()
+
+    def _listagem(self, path):
+        path = abspath(normpath(path))
+        with self._trava:
+            listagem = self._listagens.get(path)
+        if listagem is None:
+            listagem = {info.name: info for info in self._wrap_fs.scandir(path, namespaces=['details'])}
+            with self._trava:
+                self._listagens[path] = listagem
+        return listagem
+
+    def _info(self, path):
+        path = abspath(normpath(path))
+        if path == '/' or path in self._escritos:
+            return None
+        diretorio, nome = split(path)
+        try:
+            return self._listagem(diretorio).get(nome, False)
+        except (fs.errors.ResourceNotFound, fs.errors.DirectoryExpected):
+            return False
+
+    def _invalidar(self, *paths, ancestrais=False):
+        with self._trava:
+            for path in paths:
+                path = abspath(normpath(path))
+                diretorios = [path, split(path)[0]]
+                while ancestrais and diretorios[-1] != '/':
+                    diretorios.append(split(diretorios[-1])[0])
+                prefixo = path.rstrip('/') + '/'
+                for chave in [chave for chave in self._listagens if chave in diretorios or chave.startswith(prefixo)]:
+                    del self._listagens[chave]
+
+    def getinfo(self, path, namespaces=None):
+        if not self.NAMESPACES_CACHE.issuperset(namespaces or []):
+            return super().getinfo(path, namespaces)
+        info = self._info(path)
+        if info is None:
+            return super().getinfo(path, namespaces)
+        if info is False:
+            raise fs.errors.ResourceNotFound(path)
+        return info
+
+    def exists(self, path):
+        info = self._info(path)
+        return super().exists(path) if info is None else info is not False
+
+    def isdir(self, path):
+        info = self._info(path)
+        return super().isdir(path) if info is None else info is not False and info.is_dir
+
+    def isfile(self, path):
+        info = self._info(path)
+        return super().isfile(path) if info is None else info is not False and not info.is_dir
+
+    def getsize(self, path):
+        return self.getinfo(path, namespaces=['details']).size
+
+    def listdir(self, path):
+        return list(self._listagem(path))
+
+    def scandir(self, path, namespaces=None, page=None):
+        if page is not None or not self.NAMESPACES_CACHE.issuperset(namespaces or []):
+            return super().scandir(path, namespaces, page)
+        diretorio = abspath(normpath(path))
+        infos = []
+        for info in self._listagem(diretorio).values():
+            caminho = fs.path.join(diretorio, info.name)
+            infos.append(super().getinfo(caminho, namespaces) if caminho in self._escritos else info)
+        return iter(infos)
+
+    def openbin(self, path, mode='r', buffering=-1, **options):
+        if any(caractere in mode for caractere in 'wax+'):
+            self._registrar_escrita(path)
+        return super().openbin(path, mode, buffering, **options)
+
+    def open(self, path, mode='r', buffering=-1, encoding=None, errors=None, newline='', **options):
+        if any(caractere in mode for caractere in 'wax+'):
+            self._registrar_escrita(path)
+        return super().open(path, mode, buffering, encoding, errors, newline, **options)
+
+    def _registrar_escrita(self, path):
+        with self._trava:
+            self._escritos.add(abspath(normpath(path)))
+        self._invalidar(path)
+
+    def close(self):
+        if not self.isclosed():
+            self._wrap_fs.close()
+        super().close()
+
+
+def _metodo_alteracao(nome, posicoes):
+    """
+    Cria um método de FilesystemCacheListagem que executa uma alteração no filesystem encapsulado e descarta as
+        listagens afetadas (antes e depois da alteração)
+    :param nome: nome do método do filesystem
+    :param posicoes: posições, na lista de argumentos, dos caminhos alterados
+    """
+    def metodo(self, *args, **kwargs):
+        caminhos = [args[posicao] for posicao in posicoes if posicao < len(args)]
+        caminhos += [kwargs[chave] for chave in ('path', 'src_path', 'dst_path') if chave in kwargs]
+        self._invalidar(*caminhos, ancestrais=(nome == 'makedirs'))
+        try:
+            return getattr(super(FilesystemCacheListagem, self), nome)(*args, **kwargs)
+        finally:
+            self._invalidar(*caminhos, ancestrais=(nome == 'makedirs'))
+    metodo.__name__ = nome
+    return metodo
+
+
+for _nome, _posicoes in [('makedir', [0]), ('makedirs', [0]), ('remove', [0]), ('removedir', [0]), ('removetree', [0]),
+                         ('setinfo', [0]), ('settimes', [0]), ('touch', [0]), ('create', [0]), ('upload', [0]),
+                         ('writefile', [0]), ('writebytes', [0]), ('appendbytes', [0]), ('appendtext', [0]),
+                         ('move', [0, 1]), ('movedir', [0, 1]), ('copy', [0, 1]), ('copydir', [0, 1])]:
+    if hasattr(WrapFS, _nome):
+        setattr(FilesystemCacheListagem, _nome, _metodo_alteracao(_nome, _posicoes))
+
+
+def copiar_arquivo(fs_origem, caminho_origem, fs_destino, caminho_destino, tamanho_bloco=1024 * 1024):
+    """
+    Copia um arquivo entre dois sistemas de arquivos por meio de streams (openbin), sem travar os sistemas de arquivos
+        durante toda a transferência, como faz o fs.copy.copy_file. Assim, várias threads podem copiar arquivos
+        simultaneamente a partir da mesma origem ou para o mesmo destino
+    :param fs_origem: sistema de arquivos de origem
+    :param caminho_origem: caminho do arquivo na origem
+    :param fs_destino: sistema de arquivos de destino
+    :param caminho_destino: caminho do arquivo no destino (substituído, se existir)
+    """
+    with fs_origem.openbin(caminho_origem) as origem, fs_destino.openbin(caminho_destino, 'w') as destino:
+        shutil.copyfileobj(origem, destino, tamanho_bloco)
+
+
+class Metricas(object):
+    """Métricas estruturadas da execução: para cada etapa de cada dia, a duração, as quantidades de linhas e arquivos
+        processados e os bytes transferidos. Cada medição é acrescentada a um arquivo JSON lines e o arquivo de métricas
+        no formato texto do Prometheus (lido pelo textfile collector do node_exporter) é reescrito com a última medição
+        de cada etapa e dia da execução. Sem nenhum dos arquivos configurados, as medições são descartadas. Pode ser
+        usado por várias threads simultaneamente.
+
+        Attributes:
+            ferramenta (str): nome da ferramenta (uploader ou downloader), usado no nome das métricas do Prometheus.
+            arquivo_jsonl (str): caminho do arquivo JSON lines (opcional).
+            arquivo_prometheus (str): caminho do arquivo de métricas do Prometheus (opcional).
+            habilitado (bool): indica se há algum arquivo configurado (as etapas podem evitar cálculos só usados nas métricas).
+    """
+
+    # Valores de cada medição exportados para o Prometheus, com o sufixo do nome da métrica e sua descrição
+    VALORES_PROMETHEUS = [('duracao_segundos', 'duracao_etapa_segundos', 'Duração da etapa, em segundos'),
+                          ('linhas', 'linhas_etapa', 'Linhas processadas na etapa'),
+                          ('arquivos', 'arquivos_etapa', 'Arquivos processados na etapa'),
+                          ('bytes', 'bytes_etapa', 'Bytes transferidos na etapa'),
+                          ('sucesso', 'sucesso_etapa', '1 se a etapa foi concluída sem erro, 0 caso contrário')]
+
+    def __init__(self, ferramenta, arquivo_jsonl=None, arquivo_prometheus=None):
+        self.ferramenta = ferramenta
+        self.arquivo_jsonl = arquivo_jsonl
+        self.arquivo_prometheus = arquivo_prometheus
+        self.habilitado = bool(arquivo_jsonl or arquivo_prometheus)
+        self.trava = threading.Lock()
+        self.ultimas = {}
+        for arquivo in (arquivo_jsonl, arquivo_prometheus):
+            if arquivo and os.path.dirname(arquivo):
+                os.makedirs(os.path.dirname(arquivo), exist_ok=True)
+
+    @contextlib.contextmanager
+    def medir(self, etapa, dia=None, **rotulos):
+        """
+        Mede a duração de uma etapa. O bloco pode preencher as quantidades 'linhas', 'arquivos' e 'bytes' do dicionário
+            retornado; se o bloco termina com exceção (inclusive sys.exit), a medição é registrada com sucesso 0
+        :param etapa: nome da etapa
+        :param dia: dia da carga (date/datetime ou texto AAAAMMDD)
+        :param rotulos: rótulos adicionais da medição (ex.: tabela, arquivo)
+        :return: dicionário com as quantidades da etapa
+        """
+        valores = {'linhas': 0, 'arquivos': 0, 'bytes': 0}
+        inicio = datetime.now()
+        contador = perf_counter()
+        sucesso = False
+        try:
+            yield valores
+            sucesso = True
+        finally:
+            self.registrar(etapa, dia, perf_counter() - contador, valores, sucesso, inicio, **rotulos)
+
+    def registrar(self, etapa, dia, duracao, valores, sucesso=True, inicio=None, **rotulos):
+        """
+        Registra uma medição já realizada
+        :param etapa: nome da etapa
+        :param dia: dia da carga (date/datetime ou texto AAAAMMDD)
+        :param duracao: duração da etapa, em segundos
+        :param valores: dicionário com as quantidades 'linhas', 'arquivos' e 'bytes' (as ausentes valem 0)
+        :param sucesso: indica se a etapa foi concluída sem erro
+        :param inicio: data e hora do início da etapa (padrão: agora menos a duração)
+        :param rotulos: rótulos adicionais da medição (ex.: tabela, arquivo)
+        """
+        if not self.habilitado:
+            return
+        dia = dia.strftime('%Y%m%d') if hasattr(dia, 'strftime') else dia
+        inicio = inicio or datetime.now() - timedelta(seconds=duracao)
+        rotulos = dict((chave, str(valor)) for chave, valor in rotulos.items() if valor is not None)
+        medicao = dict({'ferramenta': self.ferramenta, 'etapa': etapa, 'dia': dia, 'inicio': inicio.isoformat(timespec='seconds'),
+                        'duracao_segundos': round(duracao, 6), 'linhas': int(valores.get('linhas', 0)),
+                        'arquivos': int(valores.get('arquivos', 0)), 'bytes': int(valores.get('bytes', 0)),
+                        'sucesso': 1 if sucesso else 0}, **rotulos)
+        with self.trava:
+            if self.arquivo_jsonl:
+                with open(self.arquivo_jsonl, 'a', encoding='utf-8') as arquivo:
+                    arquivo.write(json.dumps(medicao, ensure_ascii=False) + '\n')
+            if self.arquivo_prometheus:
+                self.ultimas[(etapa, dia) + tuple(sorted(rotulos.items()))] = medicao
+                self.gravar_prometheus()
+
+    def gravar_prometheus(self):
+        """
+        Reescreve o arquivo de métricas do Prometheus com a última medição de cada etapa e dia. O arquivo é gravado com
+            um nome temporário e renomeado, para que o coletor nunca leia um arquivo incompleto
+        """
+        linhas = []
+        for chave, nome, descricao in self.VALORES_PROMETHEUS:
+            metrica = 'alice_{}_{}'.format(self.ferramenta, nome)
+            linhas.append('# HELP {} {}'.format(metrica, descricao))
+            linhas.append('# TYPE {} gauge'.format(metrica))
+            for medicao in self.ultimas.values():
+                rotulos = dict((rotulo, valor) for rotulo, valor in medicao.items()
+                               if rotulo not in ('ferramenta', 'inicio', 'duracao_segundos', 'linhas', 'arquivos', 'bytes', 'sucesso')
+                               and valor is not None)
+                texto_rotulos = ','.join('{}="{}"'.format(rotulo, str(valor).replace('\\', '\\\\').replace('"', '\\"'))
+                                         for rotulo, valor in sorted(rotulos.items()))
+                linhas.append('{}{{{}}} {}'.format(metrica, texto_rotulos, medicao[chave]))
+        temporario = self.arquivo_prometheus + '.tmp'
+        with open(temporario, 'w', encoding='utf-8') as arquivo:
+            arquivo.write('\n'.join(linhas) + '\n')
+        os.replace(temporario, self.arquivo_prometheus)
+
+
+def obter_metricas(config_metricas, ferramenta):
+    """
+    Obtém o registro de métricas configurado na seção [metricas] do arquivo de configuração
+    :param config_metricas: seção do arquivo de configuração (ou False, se a seção não existe)
+    :param ferramenta: nome da ferramenta (uploader ou downloader)
+    :return: Metricas (sem arquivos configurados, as medições são descartadas)
+    """
+    if not config_metricas:
+        return Metricas(ferramenta)
+    return Metricas(ferramenta, config_metricas.get('arquivo_jsonl'), config_metricas.get('arquivo_prometheus'))
+
+
+class Perfilador(object):
+    """Perfil de execução de cada dia da carga (parâmetro --profile): o cProfile e o tracemalloc são ligados durante a
+        carga do dia e, ao final, são gravados na pasta do perfil o dump do cProfile (<ferramenta>_<dia>.prof, que pode
+        ser aberto com o módulo pstats ou com o snakeviz) e um resumo (<ferramenta>_<dia>_resumo.txt) com as funções
+        que mais consumiram tempo e as linhas que mais alocaram memória. O cProfile mede apenas a thread que carrega o
+        dia (as threads auxiliares de compactação, download e cópia aparecem apenas no tracemalloc, que mede o processo
+        inteiro), e apenas um dia pode ser perfilado por vez.
+
+        Attributes:
+            pasta (str): pasta em que são gravados os perfis.
+            ferramenta (str): nome da ferramenta (uploader ou downloader), usado no nome dos arquivos.
+            funcoes (int): quantidade de funções listadas no resumo.
+            alocacoes (int): quantidade de linhas com mais memória alocada listadas no resumo.
+    """
+
+    def __init__(self, pasta, ferramenta, funcoes=30, alocacoes=20):
+        self.pasta = pasta
+        self.ferramenta = ferramenta
+        self.funcoes = funcoes
+        self.alocacoes = alocacoes
+        self.trava = threading.Lock()
+        os.makedirs(pasta, exist_ok=True)
+        logging.info('Perfil de execução de cada dia gravado em {}'.format(pasta))
+
+    @contextlib.contextmanager
+    def perfilar(self, dia):
+        """
+        Perfila a carga de um dia. O perfil é gravado mesmo se a carga termina com exceção (inclusive sys.exit)
+        :param dia: dia da carga (date/datetime ou texto AAAAMMDD)
+        """
+        dia = dia.strftime('%Y%m%d') if hasattr(dia, 'strftime') else dia
+        with self.trava:
+            perfil = cProfile.Profile()
+            tracemalloc.start()
+            contador = perf_counter()
+            perfil.enable()
+            try:
+                yield
+            finally:
+                perfil.disable()
+                duracao = perf_counter() - contador
+                snapshot = tracemalloc.take_snapshot()
+                memoria_atual, memoria_pico = tracemalloc.get_traced_memory()
+                tracemalloc.stop()
+                self.gravar(dia, perfil, snapshot, duracao, memoria_atual, memoria_pico)
+
+    def gravar(self, dia, perfil, snapshot, duracao, memoria_atual, memoria_pico):
+        """
+        Grava o dump do cProfile e o resumo do perfil de um dia
+        :param dia: dia da carga (AAAAMMDD)
+        :param perfil: cProfile.Profile do dia
+        :param snapshot: snapshot do tracemalloc ao final do dia
+        :param duracao: duração da carga do dia, em segundos
+        :param memoria_atual: memória alocada (rastreada pelo tracemalloc) ao final do dia, em bytes
+        :param memoria_pico: pico de memória alocada durante o dia, em bytes
+        """
+        nome = os.path.join(self.pasta, '{}_{}'.format(self.ferramenta, dia))
+        perfil.dump_stats(nome + '.prof')
+        funcoes = io.StringIO()
+        pstats.Stats(perfil, stream=funcoes).sort_stats('cumulative').print_stats(self.funcoes)
+        filtros = [tracemalloc.Filter(False, tracemalloc.__file__), tracemalloc.Filter(False, '<frozen importlib._bootstrap>'),
+                   tracemalloc.Filter(False, '<frozen importlib._bootstrap_external>')]
+        estatisticas = snapshot.filter_traces(filtros).statistics('lineno')
+        with open(nome + '_resumo.txt', 'w', encoding='utf-8') as arquivo:
+            arquivo.write('Perfil do {} no dia {}\n'.format(self.ferramenta, dia))
+            arquivo.write('Duração: {:.3f} s\n'.format(duracao))
+            arquivo.write('Memória alocada ao final do dia: {:.1f} MB (pico: {:.1f} MB)\n\n'.format(memoria_atual / 2 ** 20, memoria_pico / 2 ** 20))
+            arquivo.write('Linhas com mais memória alocada ao final do dia:\n')
+            for estatistica in estatisticas[:self.alocacoes]:
+                arquivo.write('    {}\n'.format(estatistica))
+            arquivo.write('\nFunções com maior tempo acumulado:\n')
+            arquivo.write(funcoes.getvalue())
+        logging.info('Perfil do dia {}: {:.3f} s, pico de {:.1f} MB alocados - ver {}_resumo.txt'.format(dia, duracao, memoria_pico / 2 ** 20, nome))
+
+
+def perfilar(perfilador, dia):
+    """
+    Perfila a carga de um dia, se o parâmetro --profile foi informado
+    :param perfilador: Perfilador (ou None, sem o parâmetro --profile, caso em que nada é feito)
+    :param dia: dia da carga (date/datetime ou texto AAAAMMDD)
+    :return: gerenciador de contexto que envolve a carga do dia
+    """
+    if perfilador is None:
+        return contextlib.nullcontext()
+    return perfilador.perfilar(dia)
+
+
+def compactar_tipos(df, colunas_categoricas=(), colunas_inteiras=(), proporcao_categorias=0.5):
+    """
+    Reduz a memória ocupada por um dataframe sem alterar seus valores: as colunas texto (object) com muitos valores
+        repetidos passam a categóricas, que guardam cada texto distinto uma única vez, e as colunas inteiras (int64)
+        passam ao menor tipo inteiro que comporta seus valores. A serialização (to_json, to_csv, to_dict) do dataframe
+        compactado produz os mesmos resultados do original
+    :param df: dataframe (ou bloco) a ser compactado
+    :param colunas_categoricas: colunas candidatas a categóricas; só são convertidas as que contêm apenas textos e
+        cuja quantidade de valores distintos não passa de proporcao_categorias da quantidade de valores não nulos
+    :param colunas_inteiras: colunas candidatas à redução do tipo inteiro; só são convertidas as do tipo int64
+    :param proporcao_categorias: proporção máxima de valores distintos de uma coluna categórica
+    :return: dataframe compactado (o próprio df, se nenhuma coluna foi convertida)
+    """
+    convertidas = {}
+    for col in colunas_categoricas:
+        if col in df.columns and df[col].dtype == object:
+            valores = df[col]
+            quantidade = valores.count()
+            if quantidade > 1 and valores.nunique() <= quantidade * proporcao_categorias \
+                    and pd.api.types.infer_dtype(valores, skipna=True) == 'string':
+                convertidas[col] = valores.astype('category')
+    for col in colunas_inteiras:
+        if col in df.columns and df[col].dtype == 'int64':
+            convertidas[col] = pd.to_numeric(df[col], downcast='integer')
+    if len(convertidas) == 0:
+        return df
+    # Cópia rasa: as colunas não convertidas continuam compartilhadas com o dataframe original
+    df = df.copy(deep=False)
+    for col, valores in convertidas.items():
+        df[col] = valores
+    return df
+
+
 def tratar_datas(args):
     data_hoje = converter_data(0)
     data_ontem = converter_data(1)
@@ -0,0 +1,346 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Benchmark offline do uploader e do downloader: gera dados sintéticos (bancos SQLite e arquivos em pasta local ou em
+memória), executa as etapas de cada ferramenta sobre eles e informa, por etapa, o tempo, as linhas/s, os MB/s e o
+pico de memória (RSS) do processo.
+
+Uso (a partir da pasta benchmark):
+    python benchmark.py --licitacoes 1000 --dias 2
+    python benchmark.py --licitacoes 200000 --tamanho-anexo-kb 4 --filesystem memoria --saida resultado.jsonl
+
+"""
+
+import os
+import sys
+import json
+import time
+import argparse
+import tempfile
+import contextlib
+import configparser
+import logging
+from datetime import datetime
+
+import fs
+from fs.memoryfs import MemoryFS
+from fs.subfs import ClosingSubFS
+
+sys.path.append("..")
+sys.path.append("../uploader")
+sys.path.append("../downloader")
+import alice_util
+import upload
+import download
+import gerar_dados
+
+try:
+    import resource
+except ImportError:
+    # Windows: o pico de memória não é informado
+    resource = None
+
+_DESCRICAO = "Executa um benchmark offline, com dados sintéticos, das etapas do uploader e do downloader do Alice Nacional."
+
+ETAPAS = ['consulta', 'validacao', 'aninhamento', 'zip', 'upload', 'importacao_csv', 'copia']
+
+
+class Medicoes(object):
+    """Registro das medições de cada etapa, por dia.
+
+        Attributes:
+            registros (list): lista de dicionários com etapa, dia, segundos, linhas, bytes e pico_rss_mb.
+    """
+
+    def __init__(self):
+        self.registros = []
+
+    @contextlib.contextmanager
+    def medir(self, etapa, dia):
+        """
+        Mede o tempo de execução de uma etapa. O bloco pode preencher as chaves 'linhas' e 'bytes' do registro retornado
+        :param etapa: nome da etapa
+        :param dia: dia da carga (AAAAMMDD)
+        :return: dicionário do registro da medição
+        """
+        registro = {'etapa': etapa, 'dia': dia, 'linhas': 0, 'bytes': 0}
+        inicio = time.perf_counter()
+        yield registro
+        registro['segundos'] = time.perf_counter() - inicio
+        registro['pico_rss_mb'] = pico_memoria_mb()
+        self.registros.append(registro)
+
+    def resumir(self):
+        """
+        Agrega as medições de todos os dias por etapa
+        :return: lista de dicionários com etapa, segundos, linhas, linhas_s, mb, mb_s e pico_rss_mb, na ordem de ETAPAS
+        """
+        resumo = []
+        for etapa in ETAPAS:
+            registros = [registro for registro in self.registros if registro['etapa'] == etapa]
+            if len(registros) == 0:
+                continue
+            segundos = sum(registro['segundos'] for registro in registros)
+            linhas = sum(registro['linhas'] for registro in registros)
+            megabytes = sum(registro['bytes'] for registro in registros) / (1024 * 1024)
+            resumo.append({'etapa': etapa, 'segundos': segundos, 'linhas': linhas,
+                           'linhas_s': linhas / segundos if segundos > 0 else 0, 'mb': megabytes,
+                           'mb_s': megabytes / segundos if segundos > 0 else 0,
+                           'pico_rss_mb': max(registro['pico_rss_mb'] or 0 for registro in registros) if resource else None})
+        return resumo
+
+
+def pico_memoria_mb():
+    """
+    Obtém o pico de memória residente (RSS) do processo até o momento
+    :return: pico de memória em MB, ou None se não disponível no sistema operacional
+    """
+    if resource is None:
+        return None
+    pico = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss é informado em KB no Linux e em bytes no macOS
+    return pico / (1024 * 1024) if sys.platform == 'darwin' else pico / 1024
+
+
+def obter_configuracao_uploader(pasta, url_banco, workers):
+    """
+    Monta a configuração do uploader para os dados sintéticos
+    :param pasta: pasta de trabalho do benchmark
+    :param url_banco: URL do banco SQLite de origem
+    :param workers: quantidade de workers de compactação e de envio
+    :return: configparser.ConfigParser
+    """
+    config = configparser.ConfigParser()
+    config['origem_metadados'] = {'banco': url_banco, 'tabelas': repr(['licitacoes', 'lotes', 'itens'])}
+    for tabela, esquema in gerar_dados.ESQUEMAS_UPLOADER.items():
+        config['origem_metadados']['consulta_sql_' + tabela] = gerar_dados.CONSULTAS_UPLOADER[tabela]
+        config['origem_metadados']['esquema_' + tabela] = repr(esquema)
+    config['origem_arquivos'] = {'banco': url_banco, 'consulta_sql_arquivos': gerar_dados.CONSULTAS_UPLOADER['arquivos'],
+                                 'url': pasta, 'diretorio': 'editais', 'workers_zip': str(workers)}
+    config['destino'] = {'url': pasta, 'diretorio': 'destino', 'workers_upload': str(workers)}
+    return config
+
+
+def obter_configuracao_downloader(pasta, url_banco, workers):
+    """
+    Monta a configuração do downloader para os dados sintéticos
+    :param pasta: pasta de trabalho do benchmark
+    :param url_banco: URL do banco SQLite de destino
+    :param workers: quantidade de arquivos copiados simultaneamente
+    :return: configparser.ConfigParser
+    """
+    config = configparser.ConfigParser()
+    config['repositorio_remoto'] = {'url': pasta, 'diretorio': 'remoto'}
+    config['repositorio_local'] = {'url': pasta, 'diretorio': 'local', 'workers_copia': str(workers)}
+    config['metadados_banco'] = {'url': url_banco, 'schema': 'main', 'tabela_controle_carga': 'controle_carga',
+                                 'tabela_log': 'log', 'colunas_log': repr(gerar_dados.COLUNAS_LOG),
+                                 'tabela_alertas': 'alertas', 'colunas_alertas': repr(gerar_dados.COLUNAS_ALERTAS),
+                                 'tabela_licitacoes': 'licitacoes', 'colunas_licitacoes': repr(gerar_dados.COLUNAS_LICITACOES)}
+    return config
+
+
+def obter_argumentos_dias(dias):
+    """
+    Monta os argumentos de linha de comando (datas) esperados pelo Uploader e pelo Downloader
+    :param dias: lista de datas
+    :return: argparse.Namespace
+    """
+    return argparse.Namespace(data=None, data_inicio=dias[0], data_fim=dias[-1], sobrescrever=False, profile=None)
+
+
+def executar_uploader(pasta, dias, args, medicoes):
+    """
+    Gera os dados de origem do uploader e mede, para cada dia, as etapas de consulta, validação, aninhamento, zip e upload
+    :param pasta: pasta de trabalho do benchmark
+    :param dias: lista de datas
+    :param args: argumentos de linha de comando do benchmark
+    :param medicoes: Medicoes em que as medições são registradas
+    """
+    memoria = args.filesystem == 'memoria'
+    caminho_banco = os.path.join(pasta, 'origem.db')
+    url_banco = 'sqlite:///' + caminho_banco
+    workers = 1 if memoria else args.workers
+    # A pasta de origem é criada mesmo com filesystem em memória, pois o Uploader a abre ao ser instanciado
+    pasta_editais = fs.open_fs(pasta).makedir('editais', recreate=True)
+    filesystem_arquivos = MemoryFS() if memoria else pasta_editais
+    logging.info('Gerando dados de origem do uploader')
+    totais = gerar_dados.gerar_origem_uploader(caminho_banco, filesystem_arquivos, args.licitacoes, dias, args.tamanho_anexo_kb, args.semente)
+
+    u = upload.Uploader(obter_configuracao_uploader(pasta, url_banco, workers), obter_argumentos_dias(dias))
+    if memoria:
+        # Os sistemas de arquivos em memória só existem neste objeto, por isso a compactação e o envio usam um único worker
+        u.filesystem_arquivos = filesystem_arquivos
+        u.filesystem_destino = MemoryFS()
+        filesystem_pasta_temp = MemoryFS()
+    else:
+        filesystem_pasta_temp = fs.open_fs(os.path.join(pasta, 'temp'), create=True)
+    u.dados = {}
+    u.particoes_intervalo = {}
+    tabelas = ['licitacoes', 'lotes', 'itens']
+    try:
+        for dia in dias:
+            dia_str = dia.strftime('%Y%m%d')
+            dataframes = {}
+            with medicoes.medir('consulta', dia_str) as registro:
+                for tabela in tabelas:
+                    dataframes[tabela] = u.obter_dataframe(dia, u.conexao_banco_metadados, u.config_origem_metadados, tabela, False)
+                dataframe_arquivos = u.obter_dataframe(dia, u.conexao_banco_arquivos, u.config_origem_arquivos, 'arquivos', False)
+                registro['linhas'] = sum(len(df) for df in dataframes.values()) + len(dataframe_arquivos)
+
+            with medicoes.medir('validacao', dia_str) as registro:
+                for tabela in tabelas:
+                    u.validar_dataframe(dataframes[tabela], u.config_origem_metadados, tabela)
+                registro['linhas'] = sum(len(df) for df in dataframes.values())
+
+            with medicoes.medir('aninhamento', dia_str) as registro:
+                df_licitacoes = dataframes['licitacoes']
+                for tabela in tabelas[1:]:
+                    registros_por_licitacao = {}
+                    upload.agrupar_registros(dataframes[tabela], registros_por_licitacao)
+                    df_licitacoes = upload.aninhar_registros(df_licitacoes, registros_por_licitacao, tabela)
+                registro['linhas'] = sum(len(df) for df in dataframes.values())
+
+            with medicoes.medir('zip', dia_str) as registro:
+                arquivos_zip = u.obter_arquivos_zip(filesystem_pasta_temp, u.filesystem_arquivos, dataframe_arquivos, df_licitacoes, dia)
+                registro['linhas'] = totais[dia]['arquivos']
+                registro['bytes'] = totais[dia]['bytes']
+
+            with medicoes.medir('upload', dia_str) as registro:
+                tamanho_zips = sum(filesystem_pasta_temp.getsize(arq) for arq in arquivos_zip)
+                u.upload(df_licitacoes, filesystem_pasta_temp, arquivos_zip, u.filesystem_destino, dia)
+                registro['linhas'] = len(df_licitacoes)
+                registro['bytes'] = tamanho_zips
+    finally:
+        u.baixador_http.close()
+        filesystem_pasta_temp.close()
+
+
+def executar_downloader(pasta, dias, args, medicoes):
+    """
+    Gera os resultados do Alice no repositório remoto e mede, para cada dia, as etapas de importação dos .csv no banco
+        e de cópia da pasta do dia para o repositório local
+    :param pasta: pasta de trabalho do benchmark
+    :param dias: lista de datas
+    :param args: argumentos de linha de comando do benchmark
+    :param medicoes: Medicoes em que as medições são registradas
+    """
+    memoria = args.filesystem == 'memoria'
+    caminho_banco = os.path.join(pasta, 'resultados.db')
+    gerar_dados.criar_banco_resultados(caminho_banco)
+    pasta_remota = fs.open_fs(pasta).makedir('remoto', recreate=True)
+    filesystem_remoto = MemoryFS() if memoria else pasta_remota
+    logging.info('Gerando resultados do Alice para o downloader')
+    totais = gerar_dados.gerar_resultados_downloader(filesystem_remoto, args.licitacoes, dias, args.relatorios_por_dia,
+                                                     args.tamanho_relatorio_kb, args.semente)
+    fs.open_fs(pasta).makedir('local', recreate=True)
+
+    config = obter_configuracao_downloader(pasta, 'sqlite:///' + caminho_banco, args.workers)
+    d = download.Downloader(config, obter_argumentos_dias(dias))
+    if memoria:
+        d.fs_remoto = filesystem_remoto
+        d.fs_local = MemoryFS()
+    for dia in dias:
+        dia_str = dia.strftime('%Y%m%d')
+        id_carga = d.registrar_carga(data_carga_inicio=dia_str)
+        with medicoes.medir('importacao_csv', dia_str) as registro:
+            d.import_db(d.fs_remoto.opendir('logs'), dia_str + '.csv', id_carga, True)
+            fs_remoto_dia = d.fs_remoto.opendir('resultados/' + dia_str)
+            for nome in ['alertas.csv', 'licitacoes.csv']:
+                d.import_db(fs_remoto_dia, nome, id_carga)
+                registro['bytes'] += fs_remoto_dia.getsize(nome)
+            registro['bytes'] += d.fs_remoto.getsize('logs/{}.csv'.format(dia_str))
+            registro['linhas'] = totais[dia_str]['linhas']
+        d.registrar_carga(id_carga_fim=id_carga)
+
+        with medicoes.medir('copia', dia_str) as registro:
+            d.fs_local.makedirs(dia_str, recreate=True)
+            abrir_origem = None if memoria else \
+                lambda: alice_util.obter_filesystem(config['repositorio_remoto']).opendir('resultados/' + dia_str, factory=ClosingSubFS)
+            download.copiar_arquivos(fs_remoto_dia, '', d.fs_local, dia_str, 1 if memoria else args.workers, abrir_origem)
+            registro['linhas'] = len(fs_remoto_dia.listdir('/'))
+            registro['bytes'] = totais[dia_str]['bytes']
+    d.engine.dispose()
+
+
+def imprimir_resumo(resumo):
+    """
+    Imprime o resumo das medições por etapa
+    :param resumo: lista obtida com Medicoes.resumir
+    """
+    print('{:<16}{:>12}{:>12}{:>14}{:>12}{:>10}{:>14}'.format('etapa', 'tempo (s)', 'linhas', 'linhas/s', 'MB', 'MB/s', 'pico RSS (MB)'))
+    for etapa in resumo:
+        print('{:<16}{:>12.3f}{:>12}{:>14.0f}{:>12.1f}{:>10.1f}{:>14}'.format(
+            etapa['etapa'], etapa['segundos'], etapa['linhas'], etapa['linhas_s'], etapa['mb'], etapa['mb_s'],
+            '{:.0f}'.format(etapa['pico_rss_mb']) if etapa['pico_rss_mb'] is not None else 'n/d'))
+
+
+def tratar_argumentos(args):
+    """
+    Efetua o processamento dos argumentos passados por linha de comando.
+    :return: um objeto contendo todos os argumentos tratados
+    """
+    parser = argparse.ArgumentParser(description=_DESCRICAO)
+    parser.add_argument('--licitacoes', type=int, default=1000,
+                        help='quantidade de licitações por dia (ex.: de 1000 a 200000; padrão: 1000)')
+    parser.add_argument('--dias', type=int, default=1,
+                        help='quantidade de dias da carga (padrão: 1)')
+    parser.add_argument('--ferramenta', choices=['uploader', 'downloader', 'ambas'], default='ambas',
+                        help='ferramenta medida (padrão: ambas)')
+    parser.add_argument('--filesystem', choices=['disco', 'memoria'], default='disco',
+                        help='arquivos em pasta local (padrão) ou em memória (MemoryFS, com um único worker)')
+    parser.add_argument('--workers', type=int, default=1,
+                        help='workers de compactação, envio e cópia, com filesystem em disco (padrão: 1)')
+    parser.add_argument('--tamanho-anexo-kb', type=int, default=16,
+                        help='tamanho do PDF de cada licitação, em KB (padrão: 16)')
+    parser.add_argument('--relatorios-por-dia', type=int, default=10,
+                        help='relatórios binários na pasta de resultados de cada dia (padrão: 10)')
+    parser.add_argument('--tamanho-relatorio-kb', type=int, default=256,
+                        help='tamanho de cada relatório, em KB (padrão: 256)')
+    parser.add_argument('--semente', type=int, default=0,
+                        help='semente do gerador de dados sintéticos (padrão: 0)')
+    parser.add_argument('--pasta', type=str,
+                        help='pasta de trabalho (padrão: pasta temporária, removida ao final)')
+    parser.add_argument('--saida', type=str,
+                        help='arquivo em que as medições de cada etapa e dia são gravadas, em JSON lines')
+    return parser.parse_args(args)
+
+
+def main(args):
+    """
+    Principal ponto de entrada. Permite chamadas externas.
+
+    Args:
+    args ([str]): Lista de parâmetros da linha de comando.
+    """
+    args = tratar_argumentos(args)
+    saida = os.path.abspath(args.saida) if args.saida else None
+    diretorio_original = os.getcwd()
+    pasta_temporaria = None if args.pasta else tempfile.TemporaryDirectory(prefix='alice_benchmark_')
+    pasta = os.path.abspath(args.pasta or pasta_temporaria.name)
+    os.makedirs(pasta, exist_ok=True)
+    # O uploader e o downloader gravam o log e os arquivos temporários em caminhos relativos à pasta atual
+    os.chdir(pasta)
+    alice_util.configurar_log(False, 'benchmark')
+    try:
+        dias = gerar_dados.obter_dias(datetime(2021, 3, 1), args.dias)
+        medicoes = Medicoes()
+        if args.ferramenta in ['uploader', 'ambas']:
+            executar_uploader(pasta, dias, args, medicoes)
+        if args.ferramenta in ['downloader', 'ambas']:
+            executar_downloader(pasta, dias, args, medicoes)
+    finally:
+        os.chdir(diretorio_original)
+        logging.shutdown()
+        if pasta_temporaria is not None:
+            pasta_temporaria.cleanup()
+
+    print('Benchmark: {} licitação(ões) por dia, {} dia(s), filesystem em {}'.format(args.licitacoes, args.dias, args.filesystem))
+    imprimir_resumo(medicoes.resumir())
+    if saida:
+        with open(saida, 'w', encoding='utf-8') as arquivo:
+            for registro in medicoes.registros:
+                arquivo.write(json.dumps(dict(registro, licitacoes_por_dia=args.licitacoes, filesystem=args.filesystem)) + '\n')
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
@@ -0,0 +1,248 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Geração de dados sintéticos para o benchmark do uploader e do downloader: bancos SQLite no lugar das consultas de
+origem (query_*.sql) e das tabelas do schema do Alice, e árvores de arquivos em qualquer PyFilesystem (pasta local ou
+memória) no lugar dos repositórios SFTP/WebDAV.
+
+"""
+
+import random
+import sqlite3
+from datetime import timedelta
+
+UNIDADES = ['Prefeitura Municipal de {}'.format(cidade) for cidade in
+            ['Recife', 'Olinda', 'Caruaru', 'Petrolina', 'Garanhuns', 'Natal', 'Mossoró', 'Parnamirim', 'Caicó', 'Assu']] + \
+           ['Secretaria de {} do Estado'.format(area) for area in ['Saúde', 'Educação', 'Infraestrutura', 'Administração', 'Fazenda']]
+MODALIDADES = ['Pregão Eletrônico', 'Pregão Presencial', 'Concorrência', 'Tomada de Preços', 'Convite', 'Dispensa', 'Inexigibilidade']
+TIPOLOGIAS = ['Sobrepreço', 'Restrição à competitividade', 'Fracionamento', 'Empresa recém-constituída', 'Sócio em comum']
+OBJETOS = ['Aquisição de material de expediente', 'Contratação de serviços de limpeza urbana', 'Aquisição de medicamentos',
+           'Fornecimento de merenda escolar', 'Locação de veículos', 'Reforma de unidade de saúde', 'Aquisição de combustível']
+TEXTO = 'Cláusula {} - o contratado deverá fornecer os itens conforme especificado no termo de referência.\n'
+
+# Consultas de origem do uploader sobre o banco gerado por gerar_origem_uploader, no formato das query_*.sql
+CONSULTAS_UPLOADER = {
+    'licitacoes': 'select id_licitacao, ano_licitacao, numero_licitacao, data_publicacao, objeto, codigo_unidade, nome_unidade, '
+                  'codigo_modalidade, nome_modalidade, valor_estimado, esfera from alice_licitacoes where data_dia = date(:dia)',
+    'lotes': 'select id_licitacao, id_lote, seq_lote, descricao_lote, valor_lote_estimado from alice_lotes where data_dia = date(:dia)',
+    'itens': 'select id_licitacao, id_item, id_lote, seq_item, descricao_item, qtd_item, valor_unitario_estimado '
+             'from alice_itens where data_dia = date(:dia)',
+    'arquivos': 'select id_licitacao, caminho from alice_arquivos where data_dia = date(:dia)'}
+
+# Esquemas das tabelas de metadados, no formato das opções esquema_* da seção [origem_metadados]
+ESQUEMAS_UPLOADER = {
+    'licitacoes': {
+        'id_licitacao': {'tipo': 'str', 'obrigatorio': 'S'},
+        'ano_licitacao': {'tipo': 'int', 'obrigatorio': 'S'},
+        'numero_licitacao': {'tipo': 'int', 'obrigatorio': 'S'},
+        'data_publicacao': {'tipo': 'str', 'obrigatorio': 'S'},
+        'objeto': {'tipo': 'str', 'obrigatorio': 'S'},
+        'codigo_unidade': {'tipo': 'int', 'obrigatorio': 'S'},
+        'nome_unidade': {'tipo': 'str', 'obrigatorio': 'S'},
+        'codigo_modalidade': {'tipo': 'int', 'obrigatorio': 'S', 'enum': list(range(1, len(MODALIDADES) + 1))},
+        'nome_modalidade': {'tipo': 'str', 'obrigatorio': 'S'},
+        'valor_estimado': {'tipo': 'float', 'obrigatorio': 'S'},
+        'esfera': {'tipo': 'str', 'obrigatorio': 'N', 'enum': ['E', 'F', 'M']}},
+    'lotes': {
+        'id_licitacao': {'tipo': 'str', 'obrigatorio': 'S', 'ref': 'licitacoes.id_licitacao'},
+        'id_lote': {'tipo': 'str', 'obrigatorio': 'S'},
+        'seq_lote': {'tipo': 'int', 'obrigatorio': 'S'},
+        'descricao_lote': {'tipo': 'str', 'obrigatorio': 'S'},
+        'valor_lote_estimado': {'tipo': 'float', 'obrigatorio': 'N'}},
+    'itens': {
+        'id_licitacao': {'tipo': 'str', 'obrigatorio': 'S', 'ref': 'licitacoes.id_licitacao'},
+        'id_item': {'tipo': 'str', 'obrigatorio': 'S'},
+        'id_lote': {'tipo': 'str', 'obrigatorio': 'N', 'ref': 'lotes.id_lote'},
+        'seq_item': {'tipo': 'int', 'obrigatorio': 'N'},
+        'descricao_item': {'tipo': 'str', 'obrigatorio': 'S'},
+        'qtd_item': {'tipo': 'float', 'obrigatorio': 'S'},
+        'valor_unitario_estimado': {'tipo': 'float', 'obrigatorio': 'N'}}}
+
+# Colunas dos arquivos .csv de resultados do Alice (mapeamento das opções colunas_* da seção [metadados_banco])
+COLUNAS_ALERTAS = {'tribunal': 'codigo_tc', 'data_publicacao': 'data_publicacao', 'data_carga': 'data_carga',
+                   'tipo_informe': 'tipo_informe', 'codigo_unidade': 'codigo_unidade', 'nome_unidade': 'nome_unidade',
+                   'nome_modalidade': 'nome_modalidade', 'nome_licitacao': 'nome_licitacao', 'objeto': 'objeto',
+                   'analise': 'codigo_tipologia', 'nome_analise': 'nome_tipologia', 'texto': 'alerta', 'risco': 'risco_alerta',
+                   'id_licitacao': 'id_licitacao'}
+COLUNAS_LICITACOES = {'tribunal': 'codigo_tc', 'data_carga': 'data_carga', 'tipo_informe': 'tipo_informe',
+                      'data_publicacao': 'data_publicacao', 'id_licitacao': 'id_licitacao', 'codigo_unidade': 'codigo_unidade',
+                      'nome_unidade': 'nome_unidade', 'nome_modalidade': 'nome_modalidade', 'nome_licitacao': 'nome_licitacao',
+                      'objeto': 'objeto', 'total_realizado': 'total_realizado', 'nivel_materialidade': 'nivel_materialidade',
+                      'classes_objeto': 'classes_objeto'}
+COLUNAS_LOG = {'data_carga': 'data_carga', 'data_log': 'data_log', 'id_licitacao': 'id_licitacao', 'tipo_log': 'tipo_log',
+               'descricao': 'descricao'}
+
+
+class BlocosAleatorios(object):
+    """Conjunto fixo de blocos de bytes aleatórios (incompressíveis), combinados para gerar o conteúdo dos anexos
+        binários sem o custo de sortear cada byte de cada arquivo.
+
+        Attributes:
+            gerador (random.Random): gerador de números aleatórios (com semente, para que os dados sejam reproduzíveis).
+    """
+
+    TAMANHO_BLOCO = 4096
+    QUANTIDADE_BLOCOS = 64
+
+    def __init__(self, gerador):
+        self.gerador = gerador
+        self.blocos = [gerador.getrandbits(8 * self.TAMANHO_BLOCO).to_bytes(self.TAMANHO_BLOCO, 'little')
+                       for _ in range(self.QUANTIDADE_BLOCOS)]
+
+    def obter(self, tamanho):
+        """
+        Monta um conteúdo binário pseudoaleatório
+        :param tamanho: tamanho em bytes
+        :return: bytes
+        """
+        quantidade = tamanho // self.TAMANHO_BLOCO + 1
+        return b''.join(self.gerador.choice(self.blocos) for _ in range(quantidade))[:tamanho]
+
+
+def obter_dias(dia_inicio, quantidade_dias):
+    """
+    Lista os dias de uma carga
+    :param dia_inicio: primeiro dia (datetime, como as datas de linha de comando)
+    :param quantidade_dias: quantidade de dias
+    :return: lista de datas
+    """
+    return [dia_inicio + timedelta(days=n) for n in range(quantidade_dias)]
+
+
+def gerar_origem_uploader(caminho_banco, filesystem_arquivos, licitacoes_por_dia, dias, tamanho_anexo_kb=16, semente=0):
+    """
+    Gera o banco SQLite de origem do uploader (tabelas alice_licitacoes, alice_lotes, alice_itens e alice_arquivos,
+        consultadas por CONSULTAS_UPLOADER) e os anexos das licitações: um PDF por licitação (conteúdo incompressível) e,
+        a cada cinco licitações, uma pasta de documentos de texto com subpasta
+    :param caminho_banco: caminho do arquivo SQLite (recriado)
+    :param filesystem_arquivos: sistema de arquivos em que os anexos são gravados
+    :param licitacoes_por_dia: quantidade de licitações de cada dia
+    :param dias: lista de datas
+    :param tamanho_anexo_kb: tamanho de cada PDF, em KB
+    :param semente: semente do gerador de números aleatórios
+    :return: dicionário dia -> dicionário com as quantidades de 'licitacoes', 'lotes', 'itens' e 'arquivos' e os 'bytes' dos anexos
+    """
+    gerador = random.Random(semente)
+    blocos = BlocosAleatorios(gerador)
+    conexao = sqlite3.connect(caminho_banco)
+    totais = {}
+    try:
+        for tabela in ['alice_licitacoes', 'alice_lotes', 'alice_itens', 'alice_arquivos']:
+            conexao.execute('DROP TABLE IF EXISTS ' + tabela)
+        conexao.execute('CREATE TABLE alice_licitacoes (id_licitacao TEXT, ano_licitacao INT, numero_licitacao INT, data_publicacao TEXT, '
+                        'objeto TEXT, codigo_unidade INT, nome_unidade TEXT, codigo_modalidade INT, nome_modalidade TEXT, '
+                        'valor_estimado REAL, esfera TEXT, data_dia TEXT)')
+        conexao.execute('CREATE TABLE alice_lotes (id_licitacao TEXT, id_lote TEXT, seq_lote INT, descricao_lote TEXT, '
+                        'valor_lote_estimado REAL, data_dia TEXT)')
+        conexao.execute('CREATE TABLE alice_itens (id_licitacao TEXT, id_item TEXT, id_lote TEXT, seq_item INT, descricao_item TEXT, '
+                        'qtd_item REAL, valor_unitario_estimado REAL, data_dia TEXT)')
+        conexao.execute('CREATE TABLE alice_arquivos (id_licitacao TEXT, caminho TEXT, data_dia TEXT)')
+        texto = ''.join(TEXTO.format(n) for n in range(40)).encode('utf-8')
+        for dia in dias:
+            data_dia = dia.strftime('%Y-%m-%d')
+            licitacoes, lotes, itens, arquivos = [], [], [], []
+            tamanho_anexos = 0
+            for numero in range(licitacoes_por_dia):
+                lic = '{}-{}'.format(dia.strftime('%Y%m%d'), numero)
+                unidade = gerador.randrange(len(UNIDADES))
+                modalidade = gerador.randrange(len(MODALIDADES))
+                licitacoes.append((lic, dia.year, numero, data_dia + ' 00:00:00', gerador.choice(OBJETOS) + ' - processo ' + str(numero),
+                                   unidade + 1, UNIDADES[unidade], modalidade + 1, MODALIDADES[modalidade],
+                                   round(gerador.uniform(1000, 5000000), 2), gerador.choice(['E', 'M', 'M', None]), data_dia))
+                for seq_lote in range(gerador.randint(0, 3)):
+                    id_lote = '{}L{}'.format(lic, seq_lote)
+                    lotes.append((lic, id_lote, seq_lote, 'Lote {}'.format(seq_lote + 1),
+                                  round(gerador.uniform(100, 100000), 2) if seq_lote else None, data_dia))
+                    for seq_item in range(gerador.randint(1, 5)):
+                        itens.append((lic, '{}I{}'.format(id_lote, seq_item), id_lote, seq_item, gerador.choice(OBJETOS),
+                                      gerador.randint(1, 500), round(gerador.uniform(1, 1000), 2), data_dia))
+                filesystem_arquivos.writebytes('/{}.pdf'.format(lic), blocos.obter(tamanho_anexo_kb * 1024))
+                arquivos.append((lic, lic + '.pdf', data_dia))
+                tamanho_anexos += tamanho_anexo_kb * 1024
+                if numero % 5 == 0:
+                    pasta = 'docs_' + lic
+                    filesystem_arquivos.makedirs('/{}/anexos'.format(pasta), recreate=True)
+                    filesystem_arquivos.writebytes('/{}/edital.txt'.format(pasta), texto)
+                    filesystem_arquivos.writebytes('/{}/anexos/termo_referencia.txt'.format(pasta), texto)
+                    arquivos.append((lic, pasta, data_dia))
+                    tamanho_anexos += 2 * len(texto)
+            with conexao:
+                conexao.executemany('INSERT INTO alice_licitacoes VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)', licitacoes)
+                conexao.executemany('INSERT INTO alice_lotes VALUES (?, ?, ?, ?, ?, ?)', lotes)
+                conexao.executemany('INSERT INTO alice_itens VALUES (?, ?, ?, ?, ?, ?, ?, ?)', itens)
+                conexao.executemany('INSERT INTO alice_arquivos VALUES (?, ?, ?)', arquivos)
+            totais[dia] = {'licitacoes': len(licitacoes), 'lotes': len(lotes), 'itens': len(itens), 'arquivos': len(arquivos),
+                           'bytes': tamanho_anexos}
+    finally:
+        conexao.close()
+    return totais
+
+
+def criar_banco_resultados(caminho_banco):
+    """
+    Cria o banco SQLite de destino do downloader, com as tabelas de controle de carga, log, alertas e licitações
+        (colunas de COLUNAS_* mais id_controle_carga). O schema configurado deve ser 'main'
+    :param caminho_banco: caminho do arquivo SQLite (recriado)
+    """
+    conexao = sqlite3.connect(caminho_banco)
+    try:
+        with conexao:
+            for tabela in ['controle_carga', 'log', 'alertas', 'licitacoes']:
+                conexao.execute('DROP TABLE IF EXISTS ' + tabela)
+            conexao.execute('CREATE TABLE controle_carga (id_controle_carga INTEGER PRIMARY KEY AUTOINCREMENT, data_carga TEXT NOT NULL, '
+                            'data_inicio TEXT NOT NULL, data_fim TEXT)')
+            for tabela, colunas in [('log', COLUNAS_LOG), ('alertas', COLUNAS_ALERTAS), ('licitacoes', COLUNAS_LICITACOES)]:
+                conexao.execute('CREATE TABLE {} (id_controle_carga INT NOT NULL, {})'.format(tabela, ', '.join(colunas.values())))
+    finally:
+        conexao.close()
+
+
+def gerar_resultados_downloader(filesystem_remoto, licitacoes_por_dia, dias, relatorios_por_dia=10, tamanho_relatorio_kb=256, semente=0):
+    """
+    Gera o repositório remoto de resultados do Alice lido pelo downloader: resultados/<dia>/alertas.csv (dois alertas
+        por licitação), resultados/<dia>/licitacoes.csv, relatórios binários na pasta de cada dia e logs/<dia>.csv
+    :param filesystem_remoto: sistema de arquivos do repositório remoto
+    :param licitacoes_por_dia: quantidade de licitações de cada dia
+    :param dias: lista de datas
+    :param relatorios_por_dia: quantidade de relatórios (arquivos binários) na pasta de cada dia
+    :param tamanho_relatorio_kb: tamanho de cada relatório, em KB
+    :param semente: semente do gerador de números aleatórios
+    :return: dicionário dia (AAAAMMDD) -> dicionário com as quantidades de 'linhas' dos .csv e os 'bytes' da pasta do dia
+    """
+    gerador = random.Random(semente)
+    blocos = BlocosAleatorios(gerador)
+    filesystem_remoto.makedirs('logs', recreate=True)
+    totais = {}
+    for dia in dias:
+        data_carga = dia.strftime('%Y%m%d')
+        pasta = 'resultados/' + data_carga
+        filesystem_remoto.makedirs(pasta, recreate=True)
+        alertas = [';'.join(COLUNAS_ALERTAS)]
+        licitacoes = [';'.join(COLUNAS_LICITACOES)]
+        for numero in range(licitacoes_por_dia):
+            id_licitacao = str(int(data_carga) * 1000000 + numero)
+            unidade = gerador.randrange(len(UNIDADES))
+            modalidade = gerador.choice(MODALIDADES)
+            objeto = gerador.choice(OBJETOS)
+            for _ in range(2):
+                tipologia = gerador.randrange(len(TIPOLOGIAS))
+                alertas.append(';'.join(['TCE-PE', dia.strftime('%Y-%m-%d'), data_carga, 'novo', str(unidade + 1), UNIDADES[unidade],
+                                         modalidade, 'Licitação {}'.format(numero), objeto, 'T{}'.format(tipologia + 1),
+                                         TIPOLOGIAS[tipologia], 'Indício de {}'.format(TIPOLOGIAS[tipologia].lower()),
+                                         str(gerador.randint(1, 3)), id_licitacao]))
+            licitacoes.append(';'.join(['TCE-PE', data_carga, 'novo', dia.strftime('%Y-%m-%d'), id_licitacao, str(unidade + 1),
+                                        UNIDADES[unidade], modalidade, 'Licitação {}'.format(numero), objeto,
+                                        '{:.2f}'.format(gerador.uniform(1000, 5000000)), gerador.choice(['alta', 'média', 'baixa']),
+                                        'material,serviço']))
+        log = [';'.join(COLUNAS_LOG)] + ['{};{} 10:00:00;{};erro;Falha na análise {}'.format(data_carga, dia.strftime('%Y-%m-%d'),
+                                                                                             int(data_carga) * 1000000 + numero, numero)
+                                         for numero in range(0, licitacoes_por_dia, 50)]
+        filesystem_remoto.writetext(pasta + '/alertas.csv', '\n'.join(alertas) + '\n', encoding='utf-8')
+        filesystem_remoto.writetext(pasta + '/licitacoes.csv', '\n'.join(licitacoes) + '\n', encoding='utf-8')
+        filesystem_remoto.writetext('logs/{}.csv'.format(data_carga), '\n'.join(log) + '\n', encoding='utf-8')
+        for numero in range(relatorios_por_dia):
+            filesystem_remoto.writebytes('{}/relatorio_{}.pdf'.format(pasta, numero), blocos.obter(tamanho_relatorio_kb * 1024))
+        totais[data_carga] = {'linhas': len(alertas) + len(licitacoes) + len(log) - 3,
+                              'bytes': sum(info.size for info in filesystem_remoto.scandir(pasta, namespaces=['details']))}
+    return totais
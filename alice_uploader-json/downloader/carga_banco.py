@@ -0,0 +1,184 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Carregadores em lote (bulk) dos resultados do Alice no banco de dados, escolhidos de acordo com o SGBD.
+
+"""
+
+import io
+import csv
+import logging
+
+import pandas as pd
+
+from sqlalchemy.sql import table, column
+
+
+class CarregadorBanco(object):
+    """Carregador padrão: insere o dataframe com DataFrame.to_sql, em lotes de tamanho_lote linhas.
+
+        Todos os carregadores usam a conexão (e a transação) recebida em inserir(), de modo que a carga de um arquivo
+        continua sendo confirmada ou desfeita por inteiro.
+
+        Attributes:
+            tamanho_lote (int): quantidade máxima de linhas enviadas ao banco por comando.
+    """
+
+    nome = 'to_sql'
+
+    def __init__(self, tamanho_lote=10000):
+        self.tamanho_lote = tamanho_lote
+
+    def opcoes_engine(self, url_banco):
+        """
+        Obtém as opções do create_engine necessárias ao carregador
+        :param url_banco: URL (sqlalchemy.engine.url.URL) do banco de dados
+        :return: dicionário de opções
+        """
+        return {}
+
+    def inserir(self, df, tabela, connection, schema):
+        """
+        Insere as linhas de um dataframe em uma tabela
+        :param df: dataframe com as colunas já renomeadas para os nomes da tabela
+        :param tabela: nome da tabela
+        :param connection: conexão do SQLAlchemy, com a transação da carga iniciada
+        :param schema: schema da tabela
+        :return: quantidade de linhas inseridas
+        """
+        df.to_sql(name=tabela, con=connection, schema=schema, if_exists='append', index=False, chunksize=self.tamanho_lote)
+        return len(df.index)
+
+
+class CarregadorMultiplasLinhas(CarregadorBanco):
+    """Insere várias linhas por comando (INSERT ... VALUES (...), (...)), respeitando o limite de parâmetros por
+        comando do SQL Server. Indicado para o pymssql, que não tem executemany eficiente.
+    """
+
+    nome = 'multi'
+    # O SQL Server aceita até 2100 parâmetros e 1000 linhas por INSERT ... VALUES
+    LIMITE_PARAMETROS = 2000
+    LIMITE_LINHAS = 1000
+
+    def inserir(self, df, tabela, connection, schema):
+        linhas_por_comando = min(self.tamanho_lote, self.LIMITE_LINHAS, self.LIMITE_PARAMETROS // max(len(df.columns), 1))
+        df.to_sql(name=tabela, con=connection, schema=schema, if_exists='append', index=False,
+                  chunksize=max(linhas_por_comando, 1), method='multi')
+        return len(df.index)
+
+
+class CarregadorExecutemany(CarregadorBanco):
+    """Insere os lotes com um único executemany do driver. Com o pyodbc (SQL Server), habilita o fast_executemany,
+        que envia cada lote de parâmetros de uma só vez.
+    """
+
+    nome = 'executemany'
+
+    def opcoes_engine(self, url_banco):
+        if url_banco.get_dialect().driver == 'pyodbc':
+            return {'fast_executemany': True}
+        return {}
+
+    def inserir(self, df, tabela, connection, schema):
+        objeto_tabela = table(tabela, *[column(col) for col in df.columns])
+        objeto_tabela.schema = schema
+        colunas = list(df.columns)
+        for inicio in range(0, len(df.index), self.tamanho_lote):
+            lote = df.iloc[inicio:inicio + self.tamanho_lote]
+            connection.execute(objeto_tabela.insert(), [dict(zip(colunas, linha)) for linha in obter_linhas(lote)])
+        return len(df.index)
+
+
+class CarregadorArrayOracle(CarregadorBanco):
+    """Insere os lotes por array binding do cx_Oracle (cursor.executemany com parâmetros posicionais), direto na
+        conexão DBAPI da transação em andamento.
+    """
+
+    nome = 'array'
+
+    def inserir(self, df, tabela, connection, schema):
+        preparador = connection.dialect.identifier_preparer
+        nome_tabela = preparador.quote(tabela) if not schema else preparador.quote_schema(schema) + '.' + preparador.quote(tabela)
+        comando = 'INSERT INTO {} ({}) VALUES ({})'.format(nome_tabela,
+                                                           ', '.join(preparador.quote(col) for col in df.columns),
+                                                           ', '.join(':{}'.format(i + 1) for i in range(len(df.columns))))
+        cursor = connection.connection.cursor()
+        try:
+            for inicio in range(0, len(df.index), self.tamanho_lote):
+                cursor.executemany(comando, obter_linhas(df.iloc[inicio:inicio + self.tamanho_lote]))
+        finally:
+            cursor.close()
+        return len(df.index)
+
+
+class CarregadorCopyPostgres(CarregadorBanco):
+    """Insere os lotes com COPY ... FROM STDIN (formato CSV) do psycopg2, direto na conexão DBAPI da transação em
+        andamento.
+    """
+
+    nome = 'copy'
+
+    def inserir(self, df, tabela, connection, schema):
+        preparador = connection.dialect.identifier_preparer
+        nome_tabela = preparador.quote(tabela) if not schema else preparador.quote_schema(schema) + '.' + preparador.quote(tabela)
+        comando = 'COPY {} ({}) FROM STDIN WITH (FORMAT csv)'.format(nome_tabela, ', '.join(preparador.quote(col) for col in df.columns))
+        cursor = connection.connection.cursor()
+        try:
+            for inicio in range(0, len(df.index), self.tamanho_lote):
+                buffer = io.StringIO()
+                inteiros_como_inteiros(df.iloc[inicio:inicio + self.tamanho_lote]).to_csv(buffer, index=False, header=False, quoting=csv.QUOTE_MINIMAL)
+                buffer.seek(0)
+                cursor.copy_expert(comando, buffer)
+        finally:
+            cursor.close()
+        return len(df.index)
+
+
+CARREGADORES = {carregador.nome: carregador for carregador in
+                [CarregadorBanco, CarregadorMultiplasLinhas, CarregadorExecutemany, CarregadorArrayOracle, CarregadorCopyPostgres]}
+
+
+def obter_carregador(url_banco, nome='auto', tamanho_lote=10000):
+    """
+    Obtém o carregador configurado ou, se 'auto', o mais adequado ao SGBD e ao driver da URL do banco
+    :param url_banco: URL (sqlalchemy.engine.url.URL) do banco de dados
+    :param nome: nome do carregador (auto, to_sql, multi, executemany, array ou copy)
+    :param tamanho_lote: quantidade máxima de linhas enviadas ao banco por comando
+    :return: instância de CarregadorBanco
+    """
+    if nome == 'auto':
+        dialeto = url_banco.get_dialect()
+        if dialeto.name == 'mssql':
+            nome = 'executemany' if dialeto.driver == 'pyodbc' else 'multi'
+        elif dialeto.name == 'oracle':
+            nome = 'array'
+        elif dialeto.name == 'postgresql' and dialeto.driver == 'psycopg2':
+            nome = 'copy'
+        else:
+            nome = 'to_sql'
+    if nome not in CARREGADORES:
+        raise Exception("Carregador '{}' inválido. Valores possíveis: auto, {}".format(nome, ', '.join(CARREGADORES)))
+    logging.info("Carga no banco de dados com o carregador '{}' (lotes de {} linhas)".format(nome, tamanho_lote))
+    return CARREGADORES[nome](tamanho_lote)
+
+
+def obter_linhas(df):
+    """
+    Converte as linhas de um dataframe em tuplas de tipos nativos do Python, com None no lugar dos valores nulos
+    :param df: dataframe
+    :return: lista de tuplas
+    """
+    return list(df.astype(object).where(pd.notnull(df), None).itertuples(index=False, name=None))
+
+
+def inteiros_como_inteiros(df):
+    """
+    Converte para inteiro (Int64) as colunas float que só contêm valores inteiros - o read_csv lê como float as colunas
+        inteiras com valores nulos, e o COPY não aceita '1.0' em uma coluna inteira
+    :param df: dataframe
+    :return: dataframe convertido
+    """
+    colunas = {col: 'Int64' for col in df.columns
+               if df[col].dtype.kind == 'f' and (df[col].dropna() % 1 == 0).all()}
+    return df.astype(colunas) if len(colunas) > 0 else df
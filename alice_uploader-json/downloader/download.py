@@ -6,6 +6,7 @@ Realiza Download dos resultados do Alice Nacional
 """
 
 import fs
+from fs.subfs import ClosingSubFS
 #import webdavfs as wdv
 import os
 import sys
@@ -15,15 +16,21 @@ import configparser
 import hashlib
 import argparse
 import traceback
+import threading
+import concurrent.futures
+import time
 
 import pandas as pd
 import numpy as np
 
-from sqlalchemy import create_engine, MetaData, Table, Column, select, update, insert, func, and_, or_, not_
+from sqlalchemy import create_engine, inspect, MetaData, Column, select, update, insert, func, and_, or_, not_
+from sqlalchemy.engine.url import make_url
+from sqlalchemy.pool import QueuePool
 from datetime import datetime, date, timedelta
 
 sys.path.append("..")
 import alice_util
+from carga_banco import obter_carregador
 
 __author__ = "Ilueny Santos <iluenysantos@tce.rn.gov.br>, Eduardo Lima <eduardolima@tce.rn.gov.br>, Arthur Mendonça <arthurmendonca@tce.pe.gov.br> e Patrícia Lustosa <patricialustosa@tce.pe.gov.br>"
 __copyright__ = "TCE/RN e TCE/PE"
@@ -48,10 +55,18 @@ class Downloader(object):
         self.config_certificado = config['certificado'] if 'certificado' in config else False
         self.config_email = config['email'] if 'email' in config else False
         self.config_variaveis_ambiente = config['variaveis_ambiente'] if 'variaveis_ambiente' in config else False
+        self.config_execucao = config['execucao'] if 'execucao' in config else False
         
         #Configura o log 
         alice_util.configurar_log(self.config_email, 'downloader')
 
+        # Métricas por dia e etapa (duração, linhas, arquivos e bytes), opcionais
+        try:
+            self.metricas = alice_util.obter_metricas(config['metricas'] if 'metricas' in config else False, 'downloader')
+        except Exception as e:
+            logging.error('Erro ao configurar as métricas: ' + str(e))
+            sys.exit()
+
         #Configura as variáveis de ambiente
         alice_util.configurar_variaveis_ambiente(self.config_variaveis_ambiente)
 
@@ -59,13 +74,27 @@ class Downloader(object):
         alice_util.carregar_certificado(self.config_certificado)
 
         # Inicializando configurações relativas ao banco de dados local
-        self.config_banco = self.engine = self.schema = self.metadados = self.tabelas = None
+        self.config_banco = self.engine = self.schema = self.metadados = self.tabelas = self.carregador = None
         if (config.has_section('metadados_banco')):
             self.config_banco       = config['metadados_banco']
-            self.engine             = create_engine(self.config_banco['url'])
+            url_banco               = make_url(self.config_banco['url'])
+            # Carregador em lote, escolhido de acordo com o SGBD (ou definido no arquivo de configuração)
+            self.carregador         = obter_carregador(url_banco, self.config_banco.get('carregador', 'auto'),
+                                                       self.config_banco.getint('tamanho_lote', fallback=10000))
+            opcoes_engine           = self.carregador.opcoes_engine(url_banco)
+            # Pool de conexões dimensionado para os dias carregados simultaneamente (cada dia usa até duas conexões ao mesmo tempo)
+            if issubclass(url_banco.get_dialect().get_pool_class(url_banco), QueuePool):
+                dias_simultaneos = self.config_execucao.getint('dias_simultaneos', fallback=1) if self.config_execucao else 1
+                opcoes_engine['pool_size'] = self.config_banco.getint('tamanho_pool', fallback=max(5, 2 * dias_simultaneos))
+                opcoes_engine['max_overflow'] = self.config_banco.getint('max_overflow_pool', fallback=5)
+                opcoes_engine['pool_pre_ping'] = True
+            self.engine             = create_engine(url_banco, **opcoes_engine)
             self.schema             = self.config_banco['schema']
             self.metadados = MetaData(bind=self.engine, schema=self.schema)
             self.tabelas = dict([(chave, valor) for chave, valor in self.config_banco.items() if 'tabela_' in chave])
+            # Tabelas configuradas existentes no banco, refletidas uma única vez por execução (ver carregar_metadados)
+            self.tabelas_existentes = None
+            self.trava_metadados = threading.Lock()
         
         # Obter file systems local e remoto        
         if self.config_repo_local != None:
@@ -99,6 +128,17 @@ class Downloader(object):
 
         self.sobrescrever = args.sobrescrever
 
+        # Perfil de execução de cada dia, apenas com o parâmetro --profile
+        self.perfilador = None
+        if args.profile:
+            try:
+                self.perfilador = alice_util.Perfilador(args.profile, 'downloader')
+            except Exception as e:
+                logging.error('Erro ao criar a pasta do perfil de execução: ' + str(e))
+                sys.exit()
+        self.workers_copia = self.config_repo_local.getint('workers_copia', fallback=1) if self.config_repo_local is not None else 1
+        self.sincronizacao_incremental = self.config_repo_local is not None and self.config_repo_local.get('sincronizacao_incremental', 'N') == 'S'
+
     def execute(self):
         """Realiza download e carga dos dados em banco de dados.
         
@@ -113,80 +153,180 @@ class Downloader(object):
             carregar_local = False
         try:
             conteudo_dv = self.fs_remoto.listdir('./resultados/')
-            id_carga_atual = None
-
             conteudo_logs = self.fs_remoto.listdir('./logs/')
-            fs_remoto_log = self.fs_remoto.opendir('logs/')
 
             if carregar_local:
                 self.fs_local.makedirs('logs', recreate=True)
 
-            for dia in self.periodo:
-                logging.info('Realizando a carga do dia {}'.format(dia))
-                
-                #Carregando os arquivos de log
-                csvlog = '{}.csv'.format(dia)
-                if carregar_banco:
-                    # Registrando o início da carga na tabela de controle
-                    id_carga_atual = self.registrar_carga(data_carga_inicio=dia)
-
-                    if (id_carga_atual != None):
-                        logging.info("Carregando o log do Alice do dia {} no banco de dados".format(dia))
-                        if csvlog in conteudo_logs:
-                            self.import_db(fs_remoto_log, csvlog, id_carga_atual, True)
-                        else:
-                            logging.info("Arquivo de log do Alice do dia {} não encontrado".format(dia))
-                if carregar_local:
-                    #Carregando log:
-                    logging.info("Carregando o log do dia {} no sistema de arquivos local".format(dia))
-                    if csvlog in conteudo_logs:
-                        if self.fs_local.exists('logs/' + csvlog) and self.sobrescrever:
-                            self.fs_local.remove('logs/' + csvlog)
-                        if not self.fs_local.exists('logs/' + csvlog):
-                            fs.copy.copy_file(fs_remoto_log, csvlog, self.fs_local, 'logs/' + csvlog)
-
-                #Carregando alertas e licitacoes:
-                if dia in conteudo_dv:
-                    fs_remoto_dia = self.fs_remoto.opendir('resultados/{}'.format(dia))
-                    fs_remoto_dia_conteudo = fs_remoto_dia.listdir('./')
-
-                    # Se os parâmetros de configuração do banco foram passados no arquivo, realiza a carga dos .csv no banco
-                    if (carregar_banco and id_carga_atual != None):
-                        logging.info("Iniciando carga do dia {} no banco de dados".format(dia))
-                        #Carregando conteúdo da pasta do dia    
-                        for f in fs_remoto_dia_conteudo:
-                            if f.split('.')[1] in ['csv']:
-                                logging.info("Iniciando carga do arquivo {}".format(f))
-                                self.import_db(fs_remoto_dia, f, id_carga_atual)
-                        
-                        #Registrando fim de carga com sucesso no banco de dados:
-                        self.registrar_carga(id_carga_fim=id_carga_atual)
-                         
-                    # Se os parâmetros de um sistema de arquivos local foram passados, realizar a cópia de todos os arquivos
-                    if (carregar_local):
-                        #Carregando arquivos:
-                        fs_local_conteudo = self.fs_local.listdir('./')
-                        if (dia + '.ok') not in fs_local_conteudo or self.sobrescrever:
-                            logging.info("Iniciando carga do dia {} no sistema de arquivos local".format(dia))
-                            # Removendo pasta e arquivo .ok, caso existam
-                            if self.fs_local.exists(dia):
-                                self.fs_local.removetree(dia)
-                            if self.fs_local.exists(dia + '.ok'):
-                                self.fs_local.remove(dia + '.ok')
-
-                            # Recriando pasta, carregando conteúdo a partir do Disco Virtual e registrando arquivo .ok
-                            self.fs_local.makedirs(dia, recreate=True)
-                            copiar_arquivos(fs_remoto_dia, '', self.fs_local, dia)
-                            self.fs_local.create(dia + '.ok')
-                            logging.info("Download realizado com sucesso: {}".format(dia))
-                        else:
-                            logging.warning("Alertas do dia {} já foram carregados no sistema de arquivos local".format(dia))
-                else:
-                    logging.warning('Dia {} não será carregado, a pasta não foi encontrada no Disco Virtual'.format(dia))
+            dias_simultaneos = self.config_execucao.getint('dias_simultaneos', fallback=1) if self.config_execucao else 1
+            if dias_simultaneos > 1 and self.perfilador is not None:
+                # O perfil de cada dia exige que os dias sejam carregados um por vez
+                logging.warning("Carga de dias simultâneos desativada pelo parâmetro --profile")
+                dias_simultaneos = 1
+            if dias_simultaneos > 1 and len(self.periodo) > 1:
+                self.carregar_dias_simultaneos(dias_simultaneos, conteudo_dv, conteudo_logs, carregar_banco, carregar_local)
+            else:
+                for dia in self.periodo:
+                    with alice_util.perfilar(self.perfilador, dia):
+                        self.carregar_dia(dia, conteudo_dv, conteudo_logs, carregar_banco, carregar_local, self.fs_remoto, self.fs_local)
         except Exception as e:
             logging.error("Erro: {}".format(str(e)))
             sys.exit()
 
+    def carregar_dias_simultaneos(self, dias_simultaneos, conteudo_dv, conteudo_logs, carregar_banco, carregar_local):
+        """
+        Realiza a carga de vários dias ao mesmo tempo, em um pool de threads. Cada thread usa suas próprias conexões aos
+            repositórios remoto e local, e cada dia tem seu próprio registro e suas próprias transações no banco de dados.
+            Se a carga de um dia falha, os dias ainda não iniciados são cancelados e os dias em andamento são concluídos
+        :param dias_simultaneos: quantidade máxima de dias carregados ao mesmo tempo
+        :param conteudo_dv: pastas de resultados existentes no repositório remoto
+        :param conteudo_logs: arquivos de log existentes no repositório remoto
+        :param carregar_banco: indica se os resultados devem ser carregados no banco de dados
+        :param carregar_local: indica se os resultados devem ser copiados para o repositório local
+        """
+        logging.info("Carregando até {} dias simultaneamente".format(dias_simultaneos))
+        dados_thread = threading.local()
+        filesystems = []
+        trava = threading.Lock()
+
+        def carregar(dia):
+            if not hasattr(dados_thread, 'fs_remoto'):
+                dados_thread.fs_remoto = alice_util.obter_filesystem(self.config_repo_remoto)
+                dados_thread.fs_local = alice_util.obter_filesystem(self.config_repo_local) if carregar_local else None
+                with trava:
+                    filesystems.extend([dados_thread.fs_remoto, dados_thread.fs_local])
+            self.carregar_dia(dia, conteudo_dv, conteudo_logs, carregar_banco, carregar_local, dados_thread.fs_remoto, dados_thread.fs_local)
+
+        erros = []
+        try:
+            with concurrent.futures.ThreadPoolExecutor(max_workers=dias_simultaneos) as executor:
+                futuros = {executor.submit(carregar, dia): dia for dia in self.periodo}
+                for futuro in concurrent.futures.as_completed(futuros):
+                    if futuro.cancelled():
+                        continue
+                    erro = futuro.exception()
+                    if erro is not None:
+                        erros.append("{}: {}".format(futuros[futuro], str(erro)))
+                        for pendente in futuros:
+                            pendente.cancel()
+        finally:
+            for filesystem in filesystems:
+                if filesystem is not None:
+                    filesystem.close()
+        if len(erros) > 0:
+            raise Exception("Falha na carga do(s) dia(s) {}".format('; '.join(erros)))
+
+    def carregar_dia(self, dia, conteudo_dv, conteudo_logs, carregar_banco, carregar_local, fs_remoto, fs_local):
+        """
+        Realiza a carga de um dia: registra a carga na tabela de controle, importa o log e os arquivos .csv no banco de
+            dados e copia os arquivos para o repositório local
+        :param dia: dia da carga (AAAAMMDD)
+        :param conteudo_dv: pastas de resultados existentes no repositório remoto
+        :param conteudo_logs: arquivos de log existentes no repositório remoto
+        :param carregar_banco: indica se os resultados devem ser carregados no banco de dados
+        :param carregar_local: indica se os resultados devem ser copiados para o repositório local
+        :param fs_remoto: filesystem do repositório remoto
+        :param fs_local: filesystem do repositório local
+        """
+        logging.info('Realizando a carga do dia {}'.format(dia))
+        
+        id_carga_atual = None
+        fs_remoto_log = fs_remoto.opendir('logs/')
+
+        #Carregando os arquivos de log
+        csvlog = '{}.csv'.format(dia)
+        if carregar_banco:
+            # Registrando o início da carga na tabela de controle
+            id_carga_atual = self.registrar_carga(data_carga_inicio=dia)
+
+            if (id_carga_atual != None):
+                logging.info("Carregando o log do Alice do dia {} no banco de dados".format(dia))
+                if csvlog in conteudo_logs:
+                    self.import_db(fs_remoto_log, csvlog, id_carga_atual, True, dia)
+                else:
+                    logging.info("Arquivo de log do Alice do dia {} não encontrado".format(dia))
+        if carregar_local:
+            #Carregando log:
+            logging.info("Carregando o log do dia {} no sistema de arquivos local".format(dia))
+            if csvlog in conteudo_logs:
+                if fs_local.exists('logs/' + csvlog) and self.sobrescrever:
+                    fs_local.remove('logs/' + csvlog)
+                if not fs_local.exists('logs/' + csvlog):
+                    fs.copy.copy_file(fs_remoto_log, csvlog, fs_local, 'logs/' + csvlog)
+
+        #Carregando alertas e licitacoes:
+        if dia in conteudo_dv:
+            fs_remoto_dia = fs_remoto.opendir('resultados/{}'.format(dia))
+            fs_remoto_dia_conteudo = fs_remoto_dia.listdir('./')
+
+            # Se os parâmetros de configuração do banco foram passados no arquivo, realiza a carga dos .csv no banco
+            if (carregar_banco and id_carga_atual != None):
+                logging.info("Iniciando carga do dia {} no banco de dados".format(dia))
+                #Carregando conteúdo da pasta do dia    
+                for f in fs_remoto_dia_conteudo:
+                    if f.split('.')[1] in ['csv']:
+                        logging.info("Iniciando carga do arquivo {}".format(f))
+                        self.import_db(fs_remoto_dia, f, id_carga_atual, dia=dia)
+                
+                #Registrando fim de carga com sucesso no banco de dados:
+                self.registrar_carga(id_carga_fim=id_carga_atual)
+                 
+            # Com workers_copia > 1, cada worker da cópia abre sua própria conexão à pasta remota do dia
+            abrir_remoto_dia = lambda: alice_util.obter_filesystem(self.config_repo_remoto).opendir('resultados/{}'.format(dia), factory=ClosingSubFS)
+            # Se os parâmetros de um sistema de arquivos local foram passados, realizar a cópia de todos os arquivos
+            if (carregar_local and self.sincronizacao_incremental):
+                # Copia apenas os arquivos novos ou alterados desde a última carga
+                with self.metricas.medir('sincronizar_dia', dia) as valores:
+                    valores['arquivos'], valores['bytes'] = self.sincronizar_dia(dia, fs_remoto_dia, fs_local, abrir_remoto_dia)
+            elif (carregar_local):
+                #Carregando arquivos:
+                fs_local_conteudo = fs_local.listdir('./')
+                if (dia + '.ok') not in fs_local_conteudo or self.sobrescrever:
+                    logging.info("Iniciando carga do dia {} no sistema de arquivos local".format(dia))
+                    # Removendo pasta e arquivo .ok, caso existam
+                    if fs_local.exists(dia):
+                        fs_local.removetree(dia)
+                    if fs_local.exists(dia + '.ok'):
+                        fs_local.remove(dia + '.ok')
+
+                    # Recriando pasta, carregando conteúdo a partir do Disco Virtual e registrando arquivo .ok
+                    fs_local.makedirs(dia, recreate=True)
+                    with self.metricas.medir('copiar_arquivos', dia) as valores:
+                        valores['arquivos'], valores['bytes'] = copiar_arquivos(
+                            fs_remoto_dia, '', fs_local, dia, self.workers_copia, abrir_remoto_dia)
+                    fs_local.create(dia + '.ok')
+                    logging.info("Download realizado com sucesso: {}".format(dia))
+                else:
+                    logging.warning("Alertas do dia {} já foram carregados no sistema de arquivos local".format(dia))
+        else:
+            logging.warning('Dia {} não será carregado, a pasta não foi encontrada no Disco Virtual'.format(dia))
+
+    def sincronizar_dia(self, dia, fs_remoto_dia, fs_local, abrir_remoto_dia=None):
+        """
+        Sincroniza a pasta local de um dia com a pasta remota, copiando apenas os arquivos novos ou alterados. O arquivo
+            <dia>.ok guarda o manifesto (tamanho, data de modificação e hash SHA-256) dos arquivos da última sincronização,
+            e é substituído atomicamente ao final. Com --sobrescrever, o manifesto é ignorado e todos os arquivos são copiados
+        :param dia: dia da carga (AAAAMMDD)
+        :param fs_remoto_dia: filesystem da pasta remota do dia
+        :param fs_local: filesystem do repositório local
+        :param abrir_remoto_dia: função que abre uma nova conexão à pasta remota do dia, usada por cada worker da cópia
+        :return: tupla (quantidade de arquivos copiados, bytes copiados)
+        """
+        manifesto = {}
+        if fs_local.exists(dia + '.ok') and not self.sobrescrever:
+            manifesto = ler_manifesto(fs_local, dia + '.ok')
+        fs_local.makedirs(dia, recreate=True)
+        novo_manifesto, copiados, removidos, bytes_copiados = sincronizar_arquivos(
+            fs_remoto_dia, fs_local.opendir(dia), manifesto, self.workers_copia, abrir_remoto_dia)
+        if copiados > 0 or removidos > 0 or not fs_local.exists(dia + '.ok') or novo_manifesto != manifesto:
+            # O manifesto é gravado em um arquivo temporário e movido sobre o .ok, para que este nunca fique incompleto
+            fs_local.writetext(dia + '.ok.tmp', json.dumps({'arquivos': novo_manifesto}, indent=1, sort_keys=True), encoding='utf-8')
+            fs_local.move(dia + '.ok.tmp', dia + '.ok', overwrite=True)
+            logging.info("Dia {} sincronizado no sistema de arquivos local: {} arquivo(s) copiado(s), {} removido(s)".format(dia, copiados, removidos))
+        else:
+            logging.info("Arquivos do dia {} já estão atualizados no sistema de arquivos local".format(dia))
+        return copiados, bytes_copiados
+
     def preparar_carga(self, data_carga:int):
         """
         Remove eventuais resquícios de cargas falhas anteriores e inicia um novo registro na tabela de controle
@@ -199,10 +339,10 @@ class Downloader(object):
         iniciar_carga = True
         try:
             # Se a tabela de controle de carga existe, inicia a preparação, caso contrário, levanta exceção
-            if self.engine.dialect.has_table(self.engine, self.config_banco['tabela_controle_carga'], schema = self.schema):
+            if self.existe_tabela(self.config_banco['tabela_controle_carga']):
                 logging.info("Verificando se a última carga foi completada")
                 # Carregando objeto da tabela de controle 
-                tc = Table(self.config_banco['tabela_controle_carga'], self.metadados, autoload=True)
+                tc = self.obter_tabela(self.config_banco['tabela_controle_carga'])
                 # SELECT * FROM <tabela_controle_carga> WHERE data_carga = <valor do parâmetro> ORDER BY id_controle_carga DESC
                 s = select(['*']).where(tc.c.data_carga == data_carga).order_by(tc.c.id_controle_carga.desc())
                 ultima_carga = connection.execute(s).fetchone()
@@ -216,9 +356,9 @@ class Downloader(object):
                         # Itera sobre as tabelas que recebem o carregamento de arquivos (alertas, erros, licitacoes) 
                         for nome_tabela in [valor for (chave, valor) in self.tabelas.items() if chave != 'tabela_controle_carga']:
                             # Se a tabela existe no arquivo de configuração, tenta remover os registros relativos à ultima carga
-                            if self.engine.dialect.has_table(self.engine.connect(), nome_tabela, schema = self.schema):
+                            if self.existe_tabela(nome_tabela):
                                 logging.info("Início de limpeza de tabela {}".format(nome_tabela))
-                                objeto_tabela = Table(nome_tabela, self.metadados, autoload=True)
+                                objeto_tabela = self.obter_tabela(nome_tabela)
                                 if (self.sobrescrever):
                                     query_remocao = objeto_tabela.delete().where(objeto_tabela.c.data_carga == data_carga)
                                 else:
@@ -239,70 +379,106 @@ class Downloader(object):
         finally:
             connection.close()
         
-    def import_db(self, filesystem, file_name, id_controle_carga:int, log=False): # TODO: Remover geração de chave e verificar o id_controle_carga
+    def carregar_metadados(self):
+        """
+        Reflete, uma única vez por execução, a estrutura das tabelas configuradas (controle de carga, log, alertas e
+            licitações) que existem no banco de dados. As chamadas seguintes usam os metadados em memória
+        :return: conjunto com os nomes das tabelas configuradas existentes no banco
+        """
+        with self.trava_metadados:
+            if self.tabelas_existentes is None:
+                logging.info("Obtendo os metadados das tabelas do banco de dados")
+                with self.engine.connect() as connection:
+                    nomes_banco = set(inspect(connection).get_table_names(schema=self.schema))
+                    tabelas_existentes = set(nome for nome in self.tabelas.values() if nome in nomes_banco)
+                    if len(tabelas_existentes) > 0:
+                        self.metadados.reflect(bind=connection, only=list(tabelas_existentes))
+                self.tabelas_existentes = tabelas_existentes
+            return self.tabelas_existentes
+
+    def existe_tabela(self, nome_tabela):
+        """
+        Verifica se uma tabela configurada existe no banco de dados
+        :param nome_tabela: nome da tabela
+        :return: True se a tabela existe
+        """
+        return nome_tabela in self.carregar_metadados()
+
+    def obter_tabela(self, nome_tabela):
+        """
+        Obtém o objeto Table de uma tabela do banco a partir dos metadados refletidos
+        :param nome_tabela: nome da tabela
+        :return: sqlalchemy.Table
+        """
+        if not self.existe_tabela(nome_tabela):
+            raise Exception("Tabela ""{}"" não existe no banco de dados".format(nome_tabela))
+        return self.metadados.tables[nome_tabela if not self.schema else self.schema + '.' + nome_tabela]
+
+    def import_db(self, filesystem, file_name, id_controle_carga:int, log=False, dia=None): # TODO: Remover geração de chave e verificar o id_controle_carga
         """
         Grava arquivo com resultados do Alice no Banco
 
         Args:
         :param filesystem: Objeto de sistema de arquivo que contém o arquivo a ser carregado no SGBD.
         :param file_name (str): Caminho completo do arquivo que será carregado no SGBD.
+        :param dia: dia da carga (AAAAMMDD), usado nas métricas
         Returns:
         :return qtd: Total de registros inseridos no banco (int)
         """    
-        # Conectando ao banco de dados e iniciando a transação    
-        connection = self.engine.connect() 
-        trans = connection.begin()
+        with self.metricas.medir('import_db', dia, arquivo=file_name) as valores:
+            # Conectando ao banco de dados e iniciando a transação    
+            connection = self.engine.connect() 
+            trans = connection.begin()
         
-        try:            
-            colunas = dict()
-            tabela = ''
-            result = 0
-
-            if log:
-                tabela = self.config_banco['tabela_log']
-                colunas = eval(self.config_banco['colunas_log'])
-            elif 'alertas' in file_name:
-                tabela = self.config_banco['tabela_alertas']
-                colunas = eval(self.config_banco['colunas_alertas'])
-            elif 'licitacoes' in file_name:
-                tabela = self.config_banco['tabela_licitacoes']
-                colunas = eval(self.config_banco['colunas_licitacoes'])
-            else:
-               logging.error("Arquivo não possui tabela mapeada no arquivo de configuração e não será carregado: {}".format(file_name))
+            try:            
+                colunas = dict()
+                tabela = ''
+                result = 0
+
+                if log:
+                    tabela = self.config_banco['tabela_log']
+                    colunas = eval(self.config_banco['colunas_log'])
+                elif 'alertas' in file_name:
+                    tabela = self.config_banco['tabela_alertas']
+                    colunas = eval(self.config_banco['colunas_alertas'])
+                elif 'licitacoes' in file_name:
+                    tabela = self.config_banco['tabela_licitacoes']
+                    colunas = eval(self.config_banco['colunas_licitacoes'])
+                else:
+                   logging.error("Arquivo não possui tabela mapeada no arquivo de configuração e não será carregado: {}".format(file_name))
             
-            with filesystem.open(file_name, encoding = 'utf-8') as arquivo:
-                df_result = pd.read_csv(arquivo, 
-                    #dtype=colunas,
-                    delimiter=";",
-                    skip_blank_lines=True,
-                    usecols=colunas.keys(),
-                    #names=colunas.values()
-                    ) #,encoding='latin1'
-            if not(df_result.empty):
-                # Removendo linhas em branco
-                df_result = df_result.dropna(how='all')
-                # Ordenando as colunas do dataframe de acordo com a ordem definida no mapeamento do config
-                df_result = df_result[colunas.keys()]
-                # Renomeando as colunas para o valor mapeado no config
-                df_result.columns = colunas.values()
-                # Realizando a inserção:
-                logging.info("Inserindo dados do arquivo {} na tabela {}".format(file_name, tabela))
-                # Adição da chave da tabela de controle de carga
-                df_result['id_controle_carga'] = id_controle_carga
-                df_result = df_result.astype(dtype= {"id_controle_carga":"int64"})
-                # Inserindo resultados na tabela correspondente. O Mapeamento é realizado pelo nome da coluna.
-                df_result.to_sql(name=tabela, con=connection, schema=self.schema, if_exists='append', index=False)
-                result = len(df_result.index)
-                #logging.info("Arquivo carregado: {0} - {1} linha(s) inserida(s)".format(file_name, result))
-            trans.commit()
-            connection.close()
-            logging.info("Arquivo carregado: {0} - {1} linha(s) inserida(s)".format(file_name, result))
-        except Exception as e:
-            traceback.print_exc(file=sys.stdout)
-            trans.rollback()
-            raise Exception("Erro ao importar arquivo '{0}' no banco de dados: {1}".format(file_name, str(e)))
-        finally:
-            connection.close()
+                # Com linhas_por_bloco > 0, o arquivo é lido e inserido em blocos, limitando a memória usada na carga
+                linhas_por_bloco = self.config_banco.getint('linhas_por_bloco', fallback=0)
+                with filesystem.open(file_name, encoding = 'utf-8') as arquivo:
+                    leitor = pd.read_csv(arquivo, 
+                        #dtype=colunas,
+                        delimiter=";",
+                        skip_blank_lines=True,
+                        usecols=colunas.keys(),
+                        chunksize=linhas_por_bloco if linhas_por_bloco > 0 else None
+                        #names=colunas.values()
+                        ) #,encoding='latin1'
+                    blocos = leitor if linhas_por_bloco > 0 else [leitor]
+                    for df_result in blocos:
+                        if not(df_result.empty):
+                            if result == 0:
+                                logging.info("Inserindo dados do arquivo {} na tabela {}".format(file_name, tabela))
+                            # Inserindo resultados na tabela correspondente, em lotes. O Mapeamento é realizado pelo nome da coluna.
+                            result += self.carregador.inserir(preparar_bloco(df_result, colunas, id_controle_carga), tabela, connection, self.schema)
+                            #logging.info("Arquivo carregado: {0} - {1} linha(s) inserida(s)".format(file_name, result))
+                trans.commit()
+                connection.close()
+                logging.info("Arquivo carregado: {0} - {1} linha(s) inserida(s)".format(file_name, result))
+                valores['linhas'] = result
+                valores['arquivos'] = 1
+                if self.metricas.habilitado:
+                    valores['bytes'] = filesystem.getinfo(file_name, namespaces=['details']).size
+            except Exception as e:
+                traceback.print_exc(file=sys.stdout)
+                trans.rollback()
+                raise Exception("Erro ao importar arquivo '{0}' no banco de dados: {1}".format(file_name, str(e)))
+            finally:
+                connection.close()
 
     def registrar_carga(self, data_carga_inicio=None, id_carga_fim=None):
         """
@@ -319,7 +495,7 @@ class Downloader(object):
             connection = self.engine.connect()
             trans = connection.begin()
             agora = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-            tabela_controle = Table(self.config_banco['tabela_controle_carga'], self.metadados, autoload=True)
+            tabela_controle = self.obter_tabela(self.config_banco['tabela_controle_carga'])
             if data_carga_inicio != None:
                 iniciar_carga = self.preparar_carga(data_carga_inicio)
                 if iniciar_carga:
@@ -340,21 +516,173 @@ class Downloader(object):
             connection.close()
         return id_carga_retorno
 
-def copiar_arquivos(fs_origem, dir_origem, fs_destino, dir_destino):
+def preparar_bloco(df_bloco, colunas, id_controle_carga):
     """
-    Copia todos os arquivos de um diretório para outro filesystem
+    Prepara um bloco lido do arquivo de resultados para inserção no banco
+    :param df_bloco: dataframe lido do arquivo .csv
+    :param colunas: mapeamento das colunas do arquivo para as colunas da tabela
+    :param id_controle_carga: identificador da carga na tabela de controle
+    :return: dataframe com as colunas da tabela e o id_controle_carga
+    """
+    # Removendo linhas em branco e ordenando as colunas do dataframe de acordo com a ordem definida no mapeamento do config
+    df_bloco = df_bloco.dropna(how='all')[list(colunas.keys())]
+    # Renomeando as colunas para o valor mapeado no config
+    df_bloco.columns = colunas.values()
+    # Adição da chave da tabela de controle de carga
+    df_bloco['id_controle_carga'] = np.int64(id_controle_carga)
+    return df_bloco
+
+def copiar_arquivos(fs_origem, dir_origem, fs_destino, dir_destino, workers=1, abrir_origem=None):
+    """
+    Copia todos os arquivos de um diretório para outro filesystem. O diretório de origem é listado uma única vez, já com
+        os tamanhos dos arquivos, e, com workers > 1, os arquivos são copiados em paralelo
+    :param workers: quantidade de arquivos copiados simultaneamente
+    :param abrir_origem: função que abre uma nova conexão ao filesystem de origem (equivalente a fs_origem); se
+        informada, cada worker usa sua própria conexão
+    :return: tupla (quantidade de arquivos copiados, bytes copiados)
     """    
     logging.info("Início de cópia de arquivos entre os filesystems {} e {}".format(fs_origem, fs_destino))
-    arquivos = fs_origem.listdir(dir_origem)
-    for arquivo in arquivos:
-        path_origem = dir_origem + '/' + arquivo
-        path_destino = dir_destino + '/' + arquivo
-        if (fs_origem.isfile(path_origem)):
-            fs.copy.copy_file(fs_origem, path_origem, fs_destino, path_destino)
-            logging.info("Arquivo {} copiado".format(arquivo))
-        elif (fs_origem.isdir(path_origem)):
-            raise fs.errors.FileExpected(path_origem)
-    logging.info("Fim da cópia de arquivos")
+    inicio = time.perf_counter()
+    arquivos = []
+    for info in fs_origem.scandir(dir_origem, namespaces=['details']):
+        if info.is_dir:
+            raise fs.errors.FileExpected(dir_origem + '/' + info.name)
+        arquivos.append(info)
+
+    def copiar(filesystem_origem, info):
+        # Sem o fs.copy.copy_file, que trava o destino (compartilhado pelos workers) durante toda a cópia
+        alice_util.copiar_arquivo(filesystem_origem, dir_origem + '/' + info.name, fs_destino, dir_destino + '/' + info.name)
+        logging.info("Arquivo {} copiado".format(info.name))
+
+    executar_copias(fs_origem, arquivos, copiar, workers, abrir_origem)
+
+    tempo = time.perf_counter() - inicio
+    megabytes = sum(info.size for info in arquivos) / (1024 * 1024)
+    logging.info("Fim da cópia de arquivos: {} arquivo(s), {:.1f} MB em {:.1f} s ({:.2f} MB/s)".format(
+        len(arquivos), megabytes, tempo, megabytes / tempo if tempo > 0 else 0))
+    return len(arquivos), sum(info.size for info in arquivos)
+
+
+def executar_copias(fs_origem, arquivos, copiar, workers=1, abrir_origem=None):
+    """
+    Executa a cópia de uma lista de arquivos, em paralelo com workers > 1
+    :param fs_origem: filesystem de origem
+    :param arquivos: arquivos a serem copiados (objetos Info da origem)
+    :param copiar: função (filesystem de origem, info) que copia um arquivo e retorna seu resultado
+    :param workers: quantidade de arquivos copiados simultaneamente
+    :param abrir_origem: função que abre uma nova conexão ao filesystem de origem (equivalente a fs_origem); se
+        informada, cada worker usa sua própria conexão
+    :return: lista com os resultados das cópias, na ordem dos arquivos
+    """
+    if workers <= 1 or len(arquivos) <= 1:
+        return [copiar(fs_origem, info) for info in arquivos]
+
+    dados_thread = threading.local()
+    conexoes = []
+    trava = threading.Lock()
+
+    def copiar_worker(info):
+        if abrir_origem is None:
+            return copiar(fs_origem, info)
+        if not hasattr(dados_thread, 'fs_origem'):
+            dados_thread.fs_origem = abrir_origem()
+            with trava:
+                conexoes.append(dados_thread.fs_origem)
+        return copiar(dados_thread.fs_origem, info)
+
+    try:
+        with concurrent.futures.ThreadPoolExecutor(max_workers=workers) as executor:
+            return list(executor.map(copiar_worker, arquivos))
+    finally:
+        for conexao in conexoes:
+            conexao.close()
+
+
+def ler_manifesto(filesystem, caminho):
+    """
+    Lê o manifesto de uma sincronização anterior (conteúdo do arquivo <dia>.ok)
+    :param filesystem: filesystem do repositório local
+    :param caminho: caminho do arquivo .ok
+    :return: dicionário nome do arquivo -> {'tamanho', 'modificado', 'sha256'}; vazio se o .ok não tem manifesto
+    """
+    conteudo = filesystem.readtext(caminho, encoding='utf-8')
+    try:
+        return json.loads(conteudo)['arquivos'] if conteudo.strip() else {}
+    except (ValueError, KeyError):
+        logging.warning("Manifesto {} inválido, todos os arquivos do dia serão copiados".format(caminho))
+        return {}
+
+
+def sincronizar_arquivos(fs_origem, fs_destino, manifesto, workers=1, abrir_origem=None):
+    """
+    Copia de um diretório para outro filesystem os arquivos novos ou alterados em relação ao manifesto, conferindo cada
+        cópia pelo hash SHA-256 calculado durante a transferência, e remove do destino os arquivos que não existem mais
+        na origem
+    :param fs_origem: filesystem do diretório de origem
+    :param fs_destino: filesystem do diretório de destino
+    :param manifesto: manifesto da última sincronização
+    :param workers: quantidade de arquivos copiados simultaneamente
+    :param abrir_origem: função que abre uma nova conexão ao diretório de origem (ver copiar_arquivos)
+    :return: tupla (novo manifesto, quantidade de arquivos copiados, quantidade de arquivos removidos, bytes copiados)
+    """
+    novo_manifesto = {}
+    removidos = 0
+    alterados = []
+    for info in fs_origem.scandir('', namespaces=['details']):
+        if info.is_dir:
+            raise fs.errors.FileExpected(info.name)
+        modificado = info.modified.timestamp() if info.modified is not None else None
+        anterior = manifesto.get(info.name)
+        if (anterior is not None and anterior['tamanho'] == info.size and anterior['modificado'] == modificado
+                and modificado is not None and fs_destino.exists(info.name) and fs_destino.getsize(info.name) == info.size):
+            novo_manifesto[info.name] = anterior
+        else:
+            alterados.append(info)
+
+    def copiar(filesystem_origem, info):
+        sha256 = copiar_arquivo_verificado(filesystem_origem, fs_destino, info.name)
+        logging.info("Arquivo {} copiado".format(info.name))
+        return sha256
+
+    for info, sha256 in zip(alterados, executar_copias(fs_origem, alterados, copiar, workers, abrir_origem)):
+        modificado = info.modified.timestamp() if info.modified is not None else None
+        novo_manifesto[info.name] = {'tamanho': info.size, 'modificado': modificado, 'sha256': sha256}
+    for nome in fs_destino.listdir(''):
+        if nome not in novo_manifesto and fs_destino.isfile(nome):
+            fs_destino.remove(nome)
+            removidos += 1
+            logging.info("Arquivo {} removido, pois não existe mais na origem".format(nome))
+    return novo_manifesto, len(alterados), removidos, sum(info.size for info in alterados)
+
+
+def copiar_arquivo_verificado(fs_origem, fs_destino, nome, tamanho_bloco=1024 * 1024):
+    """
+    Copia um arquivo para um nome temporário no destino, calculando seu hash durante a cópia, confere o hash do arquivo
+        gravado e o move para o nome definitivo
+    :param fs_origem: filesystem de origem
+    :param fs_destino: filesystem de destino
+    :param nome: nome do arquivo
+    :return: hash SHA-256 do conteúdo
+    """
+    temporario = nome + '.parcial'
+    sha256 = hashlib.sha256()
+    with fs_origem.openbin(nome) as origem, fs_destino.openbin(temporario, 'w') as destino:
+        bloco = origem.read(tamanho_bloco)
+        while bloco:
+            sha256.update(bloco)
+            destino.write(bloco)
+            bloco = origem.read(tamanho_bloco)
+    verificacao = hashlib.sha256()
+    with fs_destino.openbin(temporario) as gravado:
+        bloco = gravado.read(tamanho_bloco)
+        while bloco:
+            verificacao.update(bloco)
+            bloco = gravado.read(tamanho_bloco)
+    if verificacao.hexdigest() != sha256.hexdigest():
+        fs_destino.remove(temporario)
+        raise Exception("Hash do arquivo {} copiado não confere com o da origem".format(nome))
+    fs_destino.move(temporario, nome, overwrite=True)
+    return sha256.hexdigest()
 
 
 def tratar_argumentos(args) :
@@ -400,6 +728,14 @@ def tratar_argumentos(args) :
         help = 'se presente, sobrescreve as pastas e arquivos já enviados para as mesmas datas'
         )
 	parser.add_argument(
+        '--profile',
+        help="se presente, grava na pasta informada (padrão: ./log/perfil/) o perfil de execução (cProfile e tracemalloc) de cada dia. Desativa a carga de dias simultâneos",
+        nargs='?',
+        const='./log/perfil/',
+        default=None,
+        metavar="<PASTA>"
+        )
+	parser.add_argument(
         '--version',
         action='version',
         version='alice_downloader {ver}.'.format(ver=__version__)
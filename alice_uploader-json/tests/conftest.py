@@ -0,0 +1,40 @@
+import os
+import sys
+import threading
+import time
+
+import pytest
+from fs.memoryfs import MemoryFS
+
+# Os scripts importam os módulos vizinhos diretamente (ver sys.path.append("..") em upload.py e download.py)
+_RAIZ = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+for _pasta in (_RAIZ, os.path.join(_RAIZ, 'uploader'), os.path.join(_RAIZ, 'downloader')):
+    if _pasta not in sys.path:
+        sys.path.insert(0, _pasta)
+
+
+class FilesystemLento(MemoryFS):
+    """MemoryFS cuja leitura de cada arquivo demora, registrando quantas leituras ocorrem ao mesmo tempo"""
+
+    def __init__(self, espera=0.2):
+        super().__init__()
+        self.espera = espera
+        self.trava_contagem = threading.Lock()
+        self.simultaneas = self.maximo_simultaneas = 0
+
+    def openbin(self, path, mode='r', buffering=-1, **options):
+        arquivo = super().openbin(path, mode, buffering, **options)
+        if 'r' not in mode:
+            return arquivo
+        with self.trava_contagem:
+            self.simultaneas += 1
+            self.maximo_simultaneas = max(self.maximo_simultaneas, self.simultaneas)
+        time.sleep(self.espera)
+        with self.trava_contagem:
+            self.simultaneas -= 1
+        return arquivo
+
+
+@pytest.fixture
+def filesystem_lento():
+    return FilesystemLento
@@ -0,0 +1,95 @@
+import json
+
+import fs
+from fs.memoryfs import MemoryFS
+
+import alice_util
+import download
+
+
+def criar_downloader(sobrescrever=False):
+    """Downloader apenas com os atributos usados na carga local de um dia (sem banco de dados)"""
+    d = download.Downloader.__new__(download.Downloader)
+    d.sobrescrever = sobrescrever
+    d.sincronizacao_incremental = True
+    d.workers_copia = 1
+    d.metricas = alice_util.Metricas('downloader')
+    return d
+
+
+def criar_remoto(dia, arquivos):
+    fs_remoto = MemoryFS()
+    fs_remoto.makedirs('logs')
+    fs_remoto.makedirs('resultados/' + dia)
+    for nome, conteudo in arquivos.items():
+        fs_remoto.writebytes('resultados/{}/{}'.format(dia, nome), conteudo)
+    return fs_remoto
+
+
+def carregar_dia(d, dia, fs_remoto, fs_local):
+    d.carregar_dia(dia, fs_remoto.listdir('resultados'), fs_remoto.listdir('logs'), False, True, fs_remoto, fs_local)
+
+
+def test_carregar_dia_sincronizacao_incremental():
+    dia = '20210301'
+    fs_remoto = criar_remoto(dia, {'alertas.csv': b'a;b\n1;2\n', 'relatorio.pdf': b'%PDF' * 100})
+    fs_local = MemoryFS()
+    d = criar_downloader()
+
+    carregar_dia(d, dia, fs_remoto, fs_local)
+    assert sorted(fs_local.listdir(dia)) == ['alertas.csv', 'relatorio.pdf']
+    assert fs_local.readbytes(dia + '/relatorio.pdf') == b'%PDF' * 100
+    assert sorted(json.loads(fs_local.readtext(dia + '.ok'))['arquivos']) == ['alertas.csv', 'relatorio.pdf']
+
+    # Segunda carga: apenas o arquivo alterado é copiado e o arquivo removido na origem é removido no destino
+    fs_remoto.writebytes('resultados/{}/alertas.csv'.format(dia), b'a;b\n3;4\n5;6\n')
+    fs_remoto.remove('resultados/{}/relatorio.pdf'.format(dia))
+    assert d.sincronizar_dia(dia, fs_remoto.opendir('resultados/' + dia), fs_local) == (1, 12)
+    assert fs_local.listdir(dia) == ['alertas.csv']
+    assert fs_local.readbytes(dia + '/alertas.csv') == b'a;b\n3;4\n5;6\n'
+
+
+def test_carregar_dia_sincronizacao_incremental_com_metricas(tmp_path):
+    dia = '20210301'
+    fs_remoto = criar_remoto(dia, {'alertas.csv': b'a;b\n1;2\n'})
+    d = criar_downloader()
+    d.metricas = alice_util.Metricas('downloader', str(tmp_path / 'metricas.jsonl'))
+
+    carregar_dia(d, dia, fs_remoto, MemoryFS())
+    medicao = json.loads((tmp_path / 'metricas.jsonl').read_text(encoding='utf-8'))
+    assert (medicao['etapa'], medicao['arquivos'], medicao['bytes'], medicao['sucesso']) == ('sincronizar_dia', 1, 8, 1)
+
+
+def test_copiar_arquivos_paralelo_simultaneo(tmp_path, filesystem_lento):
+    fs_origem = filesystem_lento()
+    for i in range(4):
+        fs_origem.writebytes('relatorio{}.pdf'.format(i), bytes([i]) * 1000)
+    fs_destino = fs.open_fs(str(tmp_path))
+    fs_destino.makedir('20210301')
+
+    quantidade, tamanho = download.copiar_arquivos(fs_origem, '', fs_destino, '20210301', workers=4, abrir_origem=lambda: fs_origem)
+    assert (quantidade, tamanho) == (4, 4000)
+    # As cópias dos workers se sobrepõem, em vez de ocorrerem uma de cada vez
+    assert fs_origem.maximo_simultaneas > 1
+    for i in range(4):
+        assert fs_destino.readbytes('20210301/relatorio{}.pdf'.format(i)) == bytes([i]) * 1000
+
+
+def test_sincronizar_dia_paralelo_simultaneo(tmp_path, filesystem_lento):
+    dia = '20210301'
+    fs_remoto_dia = filesystem_lento()
+    for i in range(4):
+        fs_remoto_dia.writebytes('relatorio{}.pdf'.format(i), bytes([i]) * 1000)
+    fs_local = fs.open_fs(str(tmp_path))
+    d = criar_downloader()
+    d.workers_copia = 4
+
+    assert d.sincronizar_dia(dia, fs_remoto_dia, fs_local, lambda: fs_remoto_dia.opendir('/')) == (4, 4000)
+    # As cópias dos arquivos alterados também são feitas pelos workers
+    assert fs_remoto_dia.maximo_simultaneas > 1
+    manifesto = json.loads(fs_local.readtext(dia + '.ok'))['arquivos']
+    assert sorted(manifesto) == ['relatorio{}.pdf'.format(i) for i in range(4)]
+    for i in range(4):
+        assert fs_local.readbytes('{}/relatorio{}.pdf'.format(dia, i)) == bytes([i]) * 1000
+    # Sem alterações na origem, nenhum arquivo é copiado
+    assert d.sincronizar_dia(dia, fs_remoto_dia, fs_local, lambda: fs_remoto_dia.opendir('/')) == (0, 0)
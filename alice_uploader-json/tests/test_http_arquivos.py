@@ -0,0 +1,43 @@
+import concurrent.futures
+import io
+
+import pytest
+
+from http_arquivos import BaixadorHttp, ErroDownload, descartar_downloads
+
+
+@pytest.mark.parametrize('url', ['http://[::1/edital.pdf', 'http://localhost:99999/edital.pdf', 'edital.pdf'])
+def test_baixar_url_invalida(url):
+    baixador = BaixadorHttp(workers=1, tentativas=3, fator_backoff=0)
+    try:
+        with pytest.raises(ErroDownload):
+            baixador.baixar(url, 'lic1')
+        falhas = baixador.obter_falhas()
+        assert [(falha.id_licitacao, falha.url) for falha in falhas] == [('lic1', url)]
+        # O erro não se resolve com novas tentativas
+        assert falhas[0].tentativas <= 1
+    finally:
+        baixador.close()
+
+
+def test_agendar_url_invalida():
+    baixador = BaixadorHttp(workers=2, tentativas=1)
+    try:
+        futuro = baixador.agendar('http://[::1/edital.pdf', 'lic1')
+        with pytest.raises(ErroDownload):
+            futuro.result()
+    finally:
+        baixador.close()
+
+
+def test_descartar_downloads():
+    arquivo = io.BytesIO(b'conteudo')
+    concluido = concurrent.futures.Future()
+    concluido.set_result((arquivo, 8))
+    pendente = concurrent.futures.Future()
+    falho = concurrent.futures.Future()
+    falho.set_exception(ErroDownload.__new__(ErroDownload))
+
+    descartar_downloads([concluido, None, pendente, falho])
+    assert arquivo.closed
+    assert pendente.cancelled()
@@ -0,0 +1,342 @@
+import configparser
+import io
+import threading
+import time
+import zipfile
+from datetime import datetime, timedelta
+
+import fs
+import pandas as pd
+import pytest
+import sqlalchemy
+from fs.memoryfs import MemoryFS
+
+import alice_util
+import upload
+from upload import EscritorZip, PoliticaCompressao
+from checkpoint_carga import CheckpointCarga
+from delta_carga import RegistroImpressoes
+
+
+def test_enviar_arquivos_paralelo_simultaneo(tmp_path, filesystem_lento):
+    filesystem_pasta_temp = filesystem_lento()
+    arquivos_zip = ['lic{}.zip'.format(i) for i in range(4)]
+    for i, arq in enumerate(arquivos_zip):
+        filesystem_pasta_temp.writebytes(arq, bytes([i]) * 1000)
+    config = configparser.ConfigParser()
+    config['destino'] = {'url': str(tmp_path), 'diretorio': 'destino'}
+    fs.open_fs(str(tmp_path)).makedirs('destino/20210301.parcial')
+    u = upload.Uploader.__new__(upload.Uploader)
+    u.config_destino = config['destino']
+    u.checkpoint = None
+
+    u.enviar_arquivos_paralelo(filesystem_pasta_temp, arquivos_zip, '/20210301.parcial', 4, '20210301')
+    # Os envios dos workers se sobrepõem, em vez de ocorrerem um de cada vez
+    assert filesystem_pasta_temp.maximo_simultaneas > 1
+    fs_destino = fs.open_fs(str(tmp_path / 'destino' / '20210301.parcial'))
+    assert sorted(fs_destino.listdir('/')) == arquivos_zip
+    for i, arq in enumerate(arquivos_zip):
+        assert fs_destino.readbytes(arq) == bytes([i]) * 1000
+
+
+def criar_uploader_delta(tmp_path, zips_com_falha):
+    """Uploader no modo delta, com a compactação e o envio substituídos (apenas as decisões do modo delta são testadas)"""
+    u = upload.Uploader.__new__(upload.Uploader)
+    u.sobrescrever = False
+    u.checkpoint = None
+    u.impressoes = RegistroImpressoes(str(tmp_path / 'impressoes.db'))
+    u.filesystem_destino = MemoryFS()
+    u.filesystem_pasta_temp = u.filesystem_arquivos = None
+    u.registrar_falhas_download = lambda dia: None
+    u.upload = lambda *args, **kwargs: None
+
+    def obter_arquivos_zip(filesystem_pasta_temp, filesystem_arquivos, df_arquivos, df_metadados, dia=None):
+        u.zips_incompletos.update(lic + '.zip' for lic in zips_com_falha.get(dia, []))
+        return [lic + '.zip' for lic in df_metadados['id_licitacao']]
+    u.obter_arquivos_zip = obter_arquivos_zip
+    return u
+
+
+def test_enviar_dia_delta_nao_registra_zips_incompletos(tmp_path):
+    dia1, dia2 = datetime(2021, 3, 1), datetime(2021, 3, 2)
+    u = criar_uploader_delta(tmp_path, {dia1: ['L2']})
+    df_licitacoes = pd.DataFrame({'id_licitacao': ['L1', 'L2'], 'objeto': ['a', 'b']})
+    df_arquivos = pd.DataFrame({'id_licitacao': ['L1', 'L2'], 'caminho': ['L1.pdf', 'http://servidor/L2.pdf']})
+
+    u.enviar_dia(dia1, df_licitacoes, df_arquivos)
+    # A licitação com falha de download não é registrada e será considerada nova no próximo envio do dia
+    assert u.impressoes.comparar('20210301', upload.calcular_impressoes(df_licitacoes, df_arquivos))['novas'] == ['L2']
+
+    # A falha do dia anterior não afeta o dia seguinte
+    u.enviar_dia(dia2, df_licitacoes, df_arquivos)
+    assert u.zips_incompletos == set()
+    assert u.impressoes.comparar('20210302', upload.calcular_impressoes(df_licitacoes, df_arquivos))['novas'] == []
+    u.impressoes.close()
+
+
+def test_verificar_dia_delta_respeita_arquivo_ok(tmp_path):
+    u = criar_uploader_delta(tmp_path, {})
+    u.filesystem_destino.makedir('20210301')
+    assert u.verificar_dia(datetime(2021, 3, 1), u.filesystem_destino)
+    u.filesystem_destino.create('20210301.ok')
+    assert not u.verificar_dia(datetime(2021, 3, 1), u.filesystem_destino)
+    u.impressoes.close()
+
+
+def test_escritor_zip_politica_compressao():
+    texto = b''.join(b'linha %d do arquivo de texto\n' % i for i in range(5000))
+    tamanhos = {}
+    for nivel in (1, 9):
+        arquivo = io.BytesIO()
+        with EscritorZip(arquivo, politica=PoliticaCompressao(nivel_texto=nivel)) as escritor:
+            escritor.adicionar_stream(io.BytesIO(texto), 'edital.txt', len(texto))
+            escritor.adicionar_stream(io.BytesIO(texto), 'edital.pdf', len(texto))
+            escritor.adicionar_stream(io.BytesIO(texto), 'planilha.bin', len(texto))
+        with zipfile.ZipFile(arquivo) as zip_lido:
+            assert zip_lido.testzip() is None
+            assert all(zip_lido.read(nome) == texto for nome in zip_lido.namelist())
+            infos = {info.filename: info for info in zip_lido.infolist()}
+        assert infos['edital.pdf'].compress_type == zipfile.ZIP_STORED
+        assert infos['edital.txt'].compress_type == infos['planilha.bin'].compress_type == zipfile.ZIP_DEFLATED
+        tamanhos[nivel] = infos['edital.txt'].compress_size
+    # O nível de compressão dos textos é aplicado à entrada
+    assert tamanhos[9] < tamanhos[1]
+
+
+class LeituraRegistrada(io.BytesIO):
+    """BytesIO que registra o tamanho pedido em cada leitura"""
+
+    def __init__(self, conteudo):
+        super().__init__(conteudo)
+        self.leituras = []
+
+    def read(self, tamanho=-1):
+        self.leituras.append(tamanho)
+        return super().read(tamanho)
+
+
+def test_escritor_zip_grava_entrada_com_nivel_em_blocos():
+    texto = b''.join(b'linha %d do arquivo de texto\n' % i for i in range(200000))
+    origem = LeituraRegistrada(texto)
+    arquivo = io.BytesIO()
+    with EscritorZip(arquivo, politica=PoliticaCompressao(nivel_texto=9)) as escritor:
+        escritor.adicionar_stream(origem, 'edital.txt', len(texto))
+    # O arquivo é lido em vários blocos, nunca inteiro de uma vez
+    assert len(texto) > 2 * EscritorZip.TAMANHO_BLOCO
+    assert all(0 < tamanho <= EscritorZip.TAMANHO_BLOCO for tamanho in origem.leituras)
+    assert len(origem.leituras) > 2
+    with zipfile.ZipFile(arquivo) as zip_lido:
+        assert zip_lido.read('edital.txt') == texto
+        assert zip_lido.getinfo('edital.txt').compress_type == zipfile.ZIP_DEFLATED
+
+
+@pytest.mark.parametrize('dias_em_andamento', [2, 3, 4])
+def test_executar_pipeline_limita_dias_em_andamento(tmp_path, dias_em_andamento):
+    config = configparser.ConfigParser()
+    config['destino'] = {'url': str(tmp_path), 'diretorio': 'destino'}
+    (tmp_path / 'destino').mkdir()
+    u = upload.Uploader.__new__(upload.Uploader)
+    u.config_destino = config['destino']
+    u.verificar_dia = lambda dia, filesystem_destino: True
+    lock = threading.Lock()
+    em_andamento = {'atual': 0, 'maximo': 0}
+    enviados = []
+
+    def obter_metadados_dia(dia):
+        with lock:
+            em_andamento['atual'] += 1
+            em_andamento['maximo'] = max(em_andamento['maximo'], em_andamento['atual'])
+        return pd.DataFrame(), pd.DataFrame()
+
+    def enviar_dia(dia, df_licitacoes, dataframe_arquivos):
+        time.sleep(0.05)
+        enviados.append(dia)
+        with lock:
+            em_andamento['atual'] -= 1
+
+    u.obter_metadados_dia = obter_metadados_dia
+    u.enviar_dia = enviar_dia
+    dias = [datetime(2021, 3, 1) + timedelta(n) for n in range(8)]
+
+    u.executar_pipeline(dias, dias_em_andamento)
+    assert enviados == dias
+    # O dia sendo enviado conta entre os dias em andamento
+    assert em_andamento['maximo'] == dias_em_andamento
+
+
+def criar_banco_intervalo(linhas):
+    """Banco SQLite em memória com uma tabela de itens identificados por id, com o dia de cada item"""
+    engine = sqlalchemy.create_engine('sqlite://')
+    engine.execute('CREATE TABLE item (id INTEGER PRIMARY KEY, dia TEXT, descricao TEXT, valor REAL)')
+    for linha in linhas:
+        engine.execute('INSERT INTO item (id, dia, descricao, valor) VALUES (?, ?, ?, ?)', linha)
+    return engine
+
+
+def obter_dias_intervalo(engine, dias, linhas_por_bloco):
+    """Obtém os blocos de cada dia pelo modo de consulta do intervalo, comparando-os com a consulta diária"""
+    u = upload.Uploader.__new__(upload.Uploader)
+    u.data_inicio, u.data_fim = dias[0], dias[-1]
+    u.particoes_intervalo = {}
+    config = configparser.ConfigParser()
+    config['origem'] = {'coluna_dia': 'dia'}
+    consulta_intervalo = ('SELECT id, descricao, valor, dia FROM item WHERE dia BETWEEN date(:dia_inicio) AND date(:dia_fim) '
+                          'ORDER BY id')
+    consulta_dia = 'SELECT id, descricao, valor FROM item WHERE dia = date(:dia) ORDER BY id'
+    blocos_por_dia = {}
+    for dia in dias:
+        blocos = u.obter_blocos_intervalo(dia, engine, config['origem'], 'item', consulta_intervalo, linhas_por_bloco)
+        blocos_por_dia[dia] = blocos
+        # A união dos blocos do dia é igual à leitura completa da consulta diária
+        df_dia = pd.read_sql_query(consulta_dia, engine, params={'dia': dia})
+        pd.testing.assert_frame_equal(pd.concat(blocos, ignore_index=True), df_dia, check_index_type=False)
+    return blocos_por_dia
+
+
+def test_obter_blocos_intervalo_tabela_vazia():
+    dias = [datetime(2021, 3, 1), datetime(2021, 3, 2)]
+    blocos_por_dia = obter_dias_intervalo(criar_banco_intervalo([]), dias, 3)
+    for blocos in blocos_por_dia.values():
+        # Um único bloco vazio, com as colunas da consulta
+        assert len(blocos) == 1
+        assert list(blocos[0].columns) == ['id', 'descricao', 'valor']
+        assert len(blocos[0]) == 0
+
+
+def test_obter_blocos_intervalo_uma_linha():
+    dias = [datetime(2021, 3, 1), datetime(2021, 3, 2)]
+    blocos_por_dia = obter_dias_intervalo(criar_banco_intervalo([(1, '2021-03-02', 'item 1', 10.5)]), dias, 3)
+    assert [len(blocos[0]) for blocos in blocos_por_dia.values()] == [0, 1]
+
+
+@pytest.mark.parametrize('linhas_por_bloco', [0, 1, 3, 4, 100])
+def test_obter_blocos_intervalo_blocos_e_lacunas(linhas_por_bloco):
+    # 7 itens no primeiro dia (não divisível pelo tamanho do bloco), nenhum no segundo e 2 no terceiro, com lacunas nos ids
+    ids_dia1 = [1, 2, 5, 6, 10, 11, 30]
+    linhas = [(id, '2021-03-01', 'item {}'.format(id), id * 1.5) for id in ids_dia1]
+    linhas += [(40, '2021-03-03', 'item 40', None), (100, '2021-03-03', None, 2.0)]
+    # Linha fora do intervalo, ignorada
+    linhas.append((200, '2021-03-04', 'item 200', 1.0))
+    dias = [datetime(2021, 3, 1), datetime(2021, 3, 2), datetime(2021, 3, 3)]
+    blocos_por_dia = obter_dias_intervalo(criar_banco_intervalo(linhas), dias, linhas_por_bloco)
+
+    tamanhos = [len(bloco) for bloco in blocos_por_dia[dias[0]]]
+    if linhas_por_bloco in (0, 100):
+        assert tamanhos == [7]
+    else:
+        assert all(tamanho == linhas_por_bloco for tamanho in tamanhos[:-1])
+        assert 0 < tamanhos[-1] <= linhas_por_bloco and sum(tamanhos) == 7
+    assert [len(bloco) for bloco in blocos_por_dia[dias[1]]] == [0]
+    assert list(pd.concat(blocos_por_dia[dias[2]])['id']) == [40, 100]
+
+
+ESQUEMA_ITENS = {
+    'id_licitacao': {'tipo': 'int', 'obrigatorio': 'S', 'ref': 'licitacoes.id_licitacao'},
+    'numero': {'tipo': 'int', 'obrigatorio': 'S'},
+    'situacao': {'tipo': 'str', 'obrigatorio': 'N', 'enum': ['ativo', 'cancelado']},
+    'valor': {'tipo': 'float', 'obrigatorio': 'N'},
+    'observacao': {'tipo': 'str', 'obrigatorio': 'N'},
+}
+
+
+def validar_em_blocos(df, linhas_por_bloco):
+    validador = upload.ValidadorTabela('itens', ESQUEMA_ITENS)
+    indices = {'licitacoes': {'id_licitacao': pd.Index([1, 2, 3])}}
+    resultado = upload.ResultadoValidacao('itens')
+    for inicio in range(0, len(df), linhas_por_bloco):
+        validador.validar(df.iloc[inicio:inicio + linhas_por_bloco], indices, resultado)
+    return sorted(resultado.erros), sorted(resultado.obter_avisos(validador))
+
+
+@pytest.mark.parametrize('ultima_linha, erros_esperados', [
+    ({'id_licitacao': 3, 'numero': 10, 'situacao': 'ativo', 'valor': 1.0, 'observacao': 'obs'}, 0),
+    # Divergências apenas na última linha, que fica sozinha no último bloco
+    ({'id_licitacao': 9, 'numero': 10, 'situacao': 'suspenso', 'valor': 1.0, 'observacao': 'obs'}, 2),
+])
+def test_validacao_em_blocos_igual_a_validacao_completa(ultima_linha, erros_esperados):
+    linhas = [{'id_licitacao': 1 + i % 3, 'numero': i, 'situacao': 'cancelado' if i % 4 else 'ativo',
+               'valor': None if i % 5 == 0 else i * 2.5, 'observacao': None} for i in range(9)]
+    df = pd.DataFrame(linhas + [ultima_linha], columns=list(ESQUEMA_ITENS))
+    completa = validar_em_blocos(df, len(df))
+    assert len(completa[0]) == erros_esperados
+    # A coluna observacao só tem valor na última linha, então os blocos anteriores não podem inferir seu tipo
+    assert completa[1] == []
+    for linhas_por_bloco in (1, 3, 4, 9):
+        assert validar_em_blocos(df, linhas_por_bloco) == completa
+
+
+def test_upload_retomado_apos_interrupcao(tmp_path, monkeypatch):
+    dia = datetime(2021, 3, 1)
+    filesystem_pasta_temp = MemoryFS()
+    arquivos_zip = ['lic{}.zip'.format(i) for i in range(5)]
+    for i, arq in enumerate(arquivos_zip):
+        filesystem_pasta_temp.writebytes(arq, bytes([i]) * 100)
+    df_licitacoes = pd.DataFrame({'id_licitacao': list(range(5))})
+    (tmp_path / 'destino').mkdir()
+    config = configparser.ConfigParser()
+    config['destino'] = {'url': str(tmp_path), 'diretorio': 'destino'}
+    u = upload.Uploader.__new__(upload.Uploader)
+    u.config_destino = config['destino']
+    u.metricas = alice_util.Metricas('uploader')
+    u.checkpoint = CheckpointCarga(str(tmp_path / 'checkpoint.db'))
+    # Zips montados e registrados no checkpoint, como em obter_arquivos_zip
+    for arq in arquivos_zip:
+        u.checkpoint.registrar_zip('20210301', arq, filesystem_pasta_temp)
+    filesystem_destino = fs.open_fs(str(tmp_path / 'destino'))
+    enviar_arquivo = upload.enviar_arquivo
+    enviados = []
+
+    def enviar_com_falha(filesystem_origem, caminho, filesystem_destino):
+        if len(enviados) == 2:
+            raise IOError('conexão interrompida')
+        enviar_arquivo(filesystem_origem, caminho, filesystem_destino)
+        enviados.append(caminho)
+
+    # Primeira execução: interrompida no envio do terceiro zip
+    monkeypatch.setattr(upload, 'enviar_arquivo', enviar_com_falha)
+    with pytest.raises(SystemExit):
+        u.upload(df_licitacoes, filesystem_pasta_temp, arquivos_zip, filesystem_destino, dia)
+    assert sorted(filesystem_destino.listdir('/')) == ['20210301.parcial']
+    assert sorted(filesystem_destino.listdir('/20210301.parcial')) == arquivos_zip[:2]
+
+    # Nova execução: apenas os zips não registrados como enviados no checkpoint são enviados
+    enviados_retomada = []
+    monkeypatch.setattr(upload, 'enviar_arquivo', lambda origem, caminho, destino: (
+        enviados_retomada.append(caminho), enviar_arquivo(origem, caminho, destino)))
+    u.upload(df_licitacoes, filesystem_pasta_temp, arquivos_zip, filesystem_destino, dia)
+    assert enviados_retomada == arquivos_zip[2:]
+    assert sorted(filesystem_destino.listdir('/')) == ['20210301']
+    assert sorted(filesystem_destino.listdir('/20210301')) == sorted(arquivos_zip + ['licitacoes.json'])
+    for i, arq in enumerate(arquivos_zip):
+        assert filesystem_destino.readbytes('/20210301/' + arq) == bytes([i]) * 100
+    assert u.checkpoint.dia_concluido('20210301')
+    u.checkpoint.close()
+
+
+def test_compactar_licitacao_nomes_duplicados_prevalece_o_ultimo():
+    filesystem_arquivos = MemoryFS()
+    filesystem_arquivos.makedirs('a')
+    filesystem_arquivos.makedirs('b')
+    filesystem_arquivos.writebytes('a/edital.pdf', b'edital a')
+    filesystem_arquivos.writebytes('b/edital.pdf', b'edital b')
+    filesystem_arquivos.makedirs('pasta1/docs')
+    filesystem_arquivos.makedirs('pasta2/docs')
+    filesystem_arquivos.writebytes('pasta1/docs/ata.txt', b'ata 1')
+    filesystem_arquivos.writebytes('pasta1/docs/so_na_pasta1.txt', b'1')
+    filesystem_arquivos.writebytes('pasta2/docs/ata.txt', b'ata 2')
+    filesystem_arquivos.writebytes('pasta2/docs/so_na_pasta2.txt', b'2')
+    filesystem_pasta_temp = MemoryFS()
+    u = upload.Uploader.__new__(upload.Uploader)
+    u.cache_arquivos = u.politica_compressao = u.baixador_http = None
+    u.zips_incompletos = set()
+
+    arquivo_zip = u.compactar_licitacao('lic1', ['a/edital.pdf', 'pasta1/docs', 'b/edital.pdf', 'pasta2/docs'],
+                                        filesystem_pasta_temp, filesystem_arquivos)
+    with zipfile.ZipFile(io.BytesIO(filesystem_pasta_temp.readbytes(arquivo_zip))) as zip_lido:
+        nomes = zip_lido.namelist()
+        # Uma única entrada por nome, com o conteúdo do último caminho, como na cópia dos arquivos para uma pasta
+        assert len(nomes) == len(set(nomes))
+        assert sorted(nomes) == ['docs/', 'docs/ata.txt', 'docs/so_na_pasta1.txt', 'docs/so_na_pasta2.txt', 'edital.pdf']
+        assert zip_lido.read('edital.pdf') == b'edital b'
+        assert zip_lido.read('docs/ata.txt') == b'ata 2'
+        assert zip_lido.read('docs/so_na_pasta1.txt') == b'1'
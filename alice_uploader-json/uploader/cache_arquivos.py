@@ -0,0 +1,178 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Cache local, endereçado por conteúdo, dos arquivos de origem (editais) das licitações.
+
+"""
+
+import os
+import sqlite3
+import hashlib
+import threading
+import logging
+import time
+import uuid
+
+
+class CacheArquivos(object):
+    """Cache em disco dos arquivos de origem das licitações, compartilhado entre dias, licitações e execuções.
+
+        Cada referência (caminho no sistema de arquivos de origem mais tamanho e data de modificação, ou url) é associada
+        ao hash SHA-256 do seu conteúdo, e o conteúdo é armazenado uma única vez em objetos/<hash>. Quando o tamanho
+        total dos objetos ultrapassa o limite configurado, os objetos acessados há mais tempo são removidos (LRU).
+        Pode ser usado por várias threads simultaneamente.
+
+        Attributes:
+            pasta (str): pasta local em que o cache é mantido.
+            tamanho_maximo (int): tamanho máximo, em bytes, dos objetos armazenados.
+    """
+
+    TAMANHO_BLOCO = 1024 * 1024
+
+    def __init__(self, pasta, tamanho_maximo):
+        self.pasta = pasta
+        self.tamanho_maximo = tamanho_maximo
+        os.makedirs(os.path.join(pasta, 'objetos'), exist_ok=True)
+        self.trava = threading.Lock()
+        self.conexao = sqlite3.connect(os.path.join(pasta, 'indice.db'), check_same_thread=False)
+        with self.conexao:
+            self.conexao.execute('CREATE TABLE IF NOT EXISTS referencias (chave TEXT PRIMARY KEY, hash TEXT NOT NULL, etag TEXT, ultima_modificacao TEXT)')
+            self.conexao.execute('CREATE TABLE IF NOT EXISTS objetos (hash TEXT PRIMARY KEY, tamanho INTEGER NOT NULL, ultimo_acesso REAL NOT NULL)')
+        # urls revalidadas durante esta execução, que podem ser servidas sem nova requisição
+        self.urls_validadas = set()
+        logging.info('Cache de arquivos de origem em {} (limite de {} MB)'.format(pasta, self.tamanho_maximo // (1024 * 1024)))
+
+    @staticmethod
+    def chave_arquivo(caminho, tamanho, modificado):
+        """
+        Monta a chave de um arquivo do sistema de arquivos de origem
+        :param caminho: caminho do arquivo
+        :param tamanho: tamanho do arquivo em bytes
+        :param modificado: data de modificação (datetime) do arquivo
+        :return: chave do arquivo no cache
+        """
+        return 'fs:{}|{}|{}'.format(caminho, tamanho, modificado.timestamp())
+
+    @staticmethod
+    def chave_url(url):
+        """
+        Monta a chave de um arquivo obtido via http(s). A validade do conteúdo é conferida pelo ETag/Last-Modified
+            armazenados junto à chave
+        :param url: endereço do arquivo
+        :return: chave da url no cache
+        """
+        return 'url:' + url
+
+    def obter(self, chave):
+        """
+        Abre o conteúdo associado a uma chave, se presente no cache
+        :param chave: chave do arquivo
+        :return: objeto de arquivo (binário) aberto para leitura, ou None se a chave não está no cache
+        """
+        with self.trava:
+            linha = self.conexao.execute('SELECT hash FROM referencias WHERE chave = ?', (chave,)).fetchone()
+            if linha is None:
+                return None
+            try:
+                arquivo = open(self.caminho_objeto(linha[0]), 'rb')
+            except FileNotFoundError:
+                # Objeto removido da pasta do cache por fora: descarta a referência
+                with self.conexao:
+                    self.conexao.execute('DELETE FROM referencias WHERE hash = ?', (linha[0],))
+                    self.conexao.execute('DELETE FROM objetos WHERE hash = ?', (linha[0],))
+                return None
+            with self.conexao:
+                self.conexao.execute('UPDATE objetos SET ultimo_acesso = ? WHERE hash = ?', (time.time(), linha[0]))
+            return arquivo
+
+    def validadores(self, chave):
+        """
+        Obtém os validadores http (ETag e Last-Modified) registrados para uma chave
+        :param chave: chave da url
+        :return: tupla (etag, ultima_modificacao), ou None se a chave não está no cache
+        """
+        with self.trava:
+            return self.conexao.execute('SELECT etag, ultima_modificacao FROM referencias WHERE chave = ?', (chave,)).fetchone()
+
+    def armazenar(self, chave, origem, etag=None, ultima_modificacao=None):
+        """
+        Armazena o conteúdo lido de um objeto de arquivo, calculando seu hash durante a cópia
+        :param chave: chave do arquivo
+        :param origem: objeto de arquivo (binário) com o conteúdo a ser armazenado
+        :param etag: ETag retornado pelo servidor http, se houver
+        :param ultima_modificacao: cabeçalho Last-Modified retornado pelo servidor http, se houver
+        :return: objeto de arquivo (binário) aberto para leitura do conteúdo armazenado
+        """
+        caminho_temporario = os.path.join(self.pasta, 'objetos', 'tmp-' + uuid.uuid4().hex)
+        sha256 = hashlib.sha256()
+        tamanho = 0
+        try:
+            with open(caminho_temporario, 'wb') as destino:
+                bloco = origem.read(self.TAMANHO_BLOCO)
+                while bloco:
+                    sha256.update(bloco)
+                    destino.write(bloco)
+                    tamanho += len(bloco)
+                    bloco = origem.read(self.TAMANHO_BLOCO)
+            hash_conteudo = sha256.hexdigest()
+            caminho_objeto = self.caminho_objeto(hash_conteudo)
+            # O objeto é movido para o lugar com a trava adquirida, para não concorrer com a remoção do excedente
+            with self.trava:
+                # Se o mesmo conteúdo já está armazenado (outra referência), o arquivo temporário é descartado
+                if not os.path.exists(caminho_objeto):
+                    os.makedirs(os.path.dirname(caminho_objeto), exist_ok=True)
+                    os.replace(caminho_temporario, caminho_objeto)
+                return self.registrar(chave, hash_conteudo, tamanho, etag, ultima_modificacao)
+        finally:
+            if os.path.exists(caminho_temporario):
+                os.remove(caminho_temporario)
+
+    def registrar(self, chave, hash_conteudo, tamanho, etag, ultima_modificacao):
+        """
+        Registra no índice um objeto recém-armazenado e a chave que o referencia. Deve ser chamado com a trava adquirida
+        :return: objeto de arquivo (binário) aberto para leitura do objeto
+        """
+        caminho_objeto = self.caminho_objeto(hash_conteudo)
+        with self.conexao:
+            self.conexao.execute('INSERT OR REPLACE INTO objetos (hash, tamanho, ultimo_acesso) VALUES (?, ?, ?)', (hash_conteudo, tamanho, time.time()))
+            self.conexao.execute('INSERT OR REPLACE INTO referencias (chave, hash, etag, ultima_modificacao) VALUES (?, ?, ?, ?)', (chave, hash_conteudo, etag, ultima_modificacao))
+        # O arquivo é aberto antes da remoção do excedente para que o objeto recém-armazenado continue legível
+        arquivo = open(caminho_objeto, 'rb')
+        self.remover_excedente()
+        return arquivo
+
+    def remover_excedente(self):
+        """
+        Remove os objetos acessados há mais tempo até que o tamanho total do cache fique dentro do limite.
+            Deve ser chamado com a trava adquirida
+        """
+        total = self.conexao.execute('SELECT COALESCE(SUM(tamanho), 0) FROM objetos').fetchone()[0]
+        if total <= self.tamanho_maximo:
+            return
+        for hash_conteudo, tamanho in self.conexao.execute('SELECT hash, tamanho FROM objetos ORDER BY ultimo_acesso').fetchall():
+            if total <= self.tamanho_maximo:
+                break
+            try:
+                os.remove(self.caminho_objeto(hash_conteudo))
+            except FileNotFoundError:
+                pass
+            except OSError:
+                # No Windows, um objeto aberto por outra thread não pode ser removido; fica para a próxima remoção
+                continue
+            with self.conexao:
+                self.conexao.execute('DELETE FROM referencias WHERE hash = ?', (hash_conteudo,))
+                self.conexao.execute('DELETE FROM objetos WHERE hash = ?', (hash_conteudo,))
+            total -= tamanho
+            logging.info('Objeto {} removido do cache de arquivos'.format(hash_conteudo))
+
+    def caminho_objeto(self, hash_conteudo):
+        """
+        Obtém o caminho local do objeto com o hash informado
+        :param hash_conteudo: hash SHA-256 do conteúdo
+        :return: caminho do objeto na pasta do cache
+        """
+        return os.path.join(self.pasta, 'objetos', hash_conteudo[:2], hash_conteudo)
+
+    def close(self):
+        self.conexao.close()
@@ -0,0 +1,119 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Registro local do andamento da carga, que permite retomar um dia interrompido sem refazer o trabalho já concluído.
+
+"""
+
+import sqlite3
+import hashlib
+import threading
+import logging
+import time
+
+
+class CheckpointCarga(object):
+    """Registro (em SQLite) dos zips de licitações já montados na pasta temporária e já enviados ao destino, com o hash
+        de cada zip, e dos dias cuja carga foi concluída. Em uma nova execução após uma falha, os zips registrados são
+        reaproveitados (se ainda estão na pasta temporária com o mesmo conteúdo) e os já enviados não são reenviados.
+        Pode ser usado por várias threads simultaneamente.
+
+        Attributes:
+            caminho (str): caminho do arquivo SQLite.
+    """
+
+    TAMANHO_BLOCO = 1024 * 1024
+
+    def __init__(self, caminho):
+        self.caminho = caminho
+        self.trava = threading.Lock()
+        self.conexao = sqlite3.connect(caminho, check_same_thread=False)
+        with self.conexao:
+            self.conexao.execute('CREATE TABLE IF NOT EXISTS zips (dia TEXT NOT NULL, arquivo_zip TEXT NOT NULL, sha256 TEXT NOT NULL, '
+                                 'compactado REAL NOT NULL, enviado REAL, PRIMARY KEY (dia, arquivo_zip))')
+            self.conexao.execute('CREATE TABLE IF NOT EXISTS dias (dia TEXT PRIMARY KEY, concluido REAL NOT NULL)')
+        logging.info('Checkpoint da carga em {}'.format(caminho))
+
+    def obter_zip(self, dia, arquivo_zip, filesystem_pasta_temp):
+        """
+        Verifica se o zip de uma licitação foi montado em uma execução anterior e continua na pasta temporária, íntegro
+        :param dia: dia da carga (AAAAMMDD)
+        :param arquivo_zip: nome do zip na pasta temporária
+        :param filesystem_pasta_temp: sistema de arquivos da pasta temporária
+        :return: True se o zip pode ser reaproveitado
+        """
+        with self.trava:
+            linha = self.conexao.execute('SELECT sha256 FROM zips WHERE dia = ? AND arquivo_zip = ?', (dia, arquivo_zip)).fetchone()
+        if linha is None or not filesystem_pasta_temp.isfile(arquivo_zip):
+            return False
+        return hash_arquivo(filesystem_pasta_temp, arquivo_zip) == linha[0]
+
+    def registrar_zip(self, dia, arquivo_zip, filesystem_pasta_temp):
+        """
+        Registra o zip de uma licitação recém-montado na pasta temporária (e ainda não enviado)
+        :param dia: dia da carga (AAAAMMDD)
+        :param arquivo_zip: nome do zip na pasta temporária
+        :param filesystem_pasta_temp: sistema de arquivos da pasta temporária
+        """
+        sha256 = hash_arquivo(filesystem_pasta_temp, arquivo_zip)
+        with self.trava, self.conexao:
+            self.conexao.execute('INSERT OR REPLACE INTO zips (dia, arquivo_zip, sha256, compactado, enviado) VALUES (?, ?, ?, ?, NULL)',
+                                 (dia, arquivo_zip, sha256, time.time()))
+
+    def zip_enviado(self, dia, arquivo_zip):
+        """
+        Verifica se o zip registrado de uma licitação já foi enviado ao destino
+        :param dia: dia da carga (AAAAMMDD)
+        :param arquivo_zip: nome do zip
+        :return: True se o zip já foi enviado
+        """
+        with self.trava:
+            linha = self.conexao.execute('SELECT enviado FROM zips WHERE dia = ? AND arquivo_zip = ?', (dia, arquivo_zip)).fetchone()
+        return linha is not None and linha[0] is not None
+
+    def registrar_envio(self, dia, arquivo_zip):
+        """
+        Registra o envio do zip de uma licitação ao destino
+        :param dia: dia da carga (AAAAMMDD)
+        :param arquivo_zip: nome do zip
+        """
+        with self.trava, self.conexao:
+            self.conexao.execute('UPDATE zips SET enviado = ? WHERE dia = ? AND arquivo_zip = ?', (time.time(), dia, arquivo_zip))
+
+    def dia_concluido(self, dia):
+        """
+        Verifica se a carga de um dia foi concluída em uma execução anterior
+        :param dia: dia da carga (AAAAMMDD)
+        :return: True se o dia foi concluído
+        """
+        with self.trava:
+            return self.conexao.execute('SELECT 1 FROM dias WHERE dia = ?', (dia,)).fetchone() is not None
+
+    def concluir_dia(self, dia):
+        """
+        Registra a conclusão da carga de um dia e descarta os registros dos seus zips
+        :param dia: dia da carga (AAAAMMDD)
+        """
+        with self.trava, self.conexao:
+            self.conexao.execute('INSERT OR REPLACE INTO dias (dia, concluido) VALUES (?, ?)', (dia, time.time()))
+            self.conexao.execute('DELETE FROM zips WHERE dia = ?', (dia,))
+
+    def close(self):
+        self.conexao.close()
+
+
+def hash_arquivo(filesystem, caminho, tamanho_bloco=CheckpointCarga.TAMANHO_BLOCO):
+    """
+    Calcula o hash SHA-256 de um arquivo
+    :param filesystem: sistema de arquivos que contém o arquivo
+    :param caminho: caminho do arquivo
+    :return: hash em hexadecimal
+    """
+    sha256 = hashlib.sha256()
+    with filesystem.openbin(caminho) as arquivo:
+        bloco = arquivo.read(tamanho_bloco)
+        while bloco:
+            sha256.update(bloco)
+            bloco = arquivo.read(tamanho_bloco)
+    return sha256.hexdigest()
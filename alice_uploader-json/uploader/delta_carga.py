@@ -0,0 +1,81 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Impressões digitais (hashes) das licitações enviadas, usadas no modo delta para reenviar apenas as licitações novas ou
+alteradas de um dia.
+
+"""
+
+import sqlite3
+import hashlib
+import threading
+import logging
+import time
+
+
+class RegistroImpressoes(object):
+    """Registro local (em SQLite) da impressão digital de cada licitação enviada ao destino, por dia. A impressão é o
+        hash SHA-256 dos metadados aninhados da licitação (lotes, itens etc.) e da lista de arquivos associados a ela.
+
+        Attributes:
+            caminho (str): caminho do arquivo SQLite.
+    """
+
+    def __init__(self, caminho):
+        self.caminho = caminho
+        self.trava = threading.Lock()
+        self.conexao = sqlite3.connect(caminho, check_same_thread=False)
+        with self.conexao:
+            self.conexao.execute('CREATE TABLE IF NOT EXISTS impressoes (dia TEXT NOT NULL, id_licitacao TEXT NOT NULL, '
+                                 'impressao TEXT NOT NULL, atualizado REAL NOT NULL, PRIMARY KEY (dia, id_licitacao))')
+        logging.info('Impressões digitais das licitações enviadas em {}'.format(caminho))
+
+    def comparar(self, dia, impressoes):
+        """
+        Compara as impressões digitais atuais das licitações de um dia com as registradas no último envio
+        :param dia: dia da carga (AAAAMMDD)
+        :param impressoes: dicionário id_licitacao -> impressão digital atual
+        :return: dicionário com as listas de ids 'novas', 'alteradas' e 'removidas'
+        """
+        with self.trava:
+            anteriores = dict(self.conexao.execute('SELECT id_licitacao, impressao FROM impressoes WHERE dia = ?', (dia,)).fetchall())
+        return {'novas': [lic for lic in impressoes if lic not in anteriores],
+                'alteradas': [lic for lic in impressoes if lic in anteriores and anteriores[lic] != impressoes[lic]],
+                'removidas': [lic for lic in anteriores if lic not in impressoes]}
+
+    def registrar(self, dia, impressoes):
+        """
+        Substitui as impressões digitais registradas de um dia pelas do envio concluído
+        :param dia: dia da carga (AAAAMMDD)
+        :param impressoes: dicionário id_licitacao -> impressão digital
+        """
+        agora = time.time()
+        with self.trava, self.conexao:
+            self.conexao.execute('DELETE FROM impressoes WHERE dia = ?', (dia,))
+            self.conexao.executemany('INSERT INTO impressoes (dia, id_licitacao, impressao, atualizado) VALUES (?, ?, ?, ?)',
+                                     [(dia, lic, impressao, agora) for lic, impressao in impressoes.items()])
+
+    def close(self):
+        self.conexao.close()
+
+
+def calcular_impressoes(df_licitacoes, df_arquivos):
+    """
+    Calcula a impressão digital de cada licitação: hash SHA-256 da linha de metadados (já com as tabelas filhas
+        aninhadas) serializada em JSON, mais a lista ordenada dos caminhos dos arquivos associados
+    :param df_licitacoes: dataframe contendo os metadados das licitações
+    :param df_arquivos: dataframe contendo a lista de arquivos ou pastas associados às licitações
+    :return: dicionário id_licitacao -> impressão digital, na ordem de df_licitacoes
+    """
+    if len(df_licitacoes) == 0:
+        return {}
+    linhas = df_licitacoes.to_json(orient='records', lines=True, force_ascii=False, date_format='iso').splitlines()
+    caminhos = {str(lic): sorted(str(caminho) for caminho in grupo) for lic, grupo in df_arquivos.groupby('id_licitacao', sort=False)['caminho']}
+    impressoes = {}
+    for lic, linha in zip(df_licitacoes['id_licitacao'].astype(str), linhas):
+        sha256 = hashlib.sha256(linha.encode('utf-8'))
+        for caminho in caminhos.get(lic, []):
+            sha256.update(b'\0' + caminho.encode('utf-8'))
+        impressoes[lic] = sha256.hexdigest()
+    return impressoes
@@ -0,0 +1,250 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Download concorrente, via http(s), dos arquivos associados às licitações.
+
+"""
+
+import threading
+import concurrent.futures
+import collections
+import tempfile
+import logging
+import time
+import urllib.parse
+
+import requests
+import urllib3
+from requests.adapters import HTTPAdapter
+
+from cache_arquivos import CacheArquivos
+
+
+# Registro estruturado de um download que falhou após todas as tentativas
+FalhaDownload = collections.namedtuple('FalhaDownload', ['id_licitacao', 'url', 'host', 'tentativas', 'status_http', 'erro'])
+
+
+class ErroDownload(Exception):
+    """Exceção levantada quando um download falha após todas as tentativas.
+
+        Attributes:
+            falha (FalhaDownload): detalhes da falha.
+    """
+
+    def __init__(self, falha):
+        super().__init__('Erro ao realizar download de {}: {}'.format(falha.url, falha.erro))
+        self.falha = falha
+
+
+class BaixadorHttp(object):
+    """Realiza downloads via http(s) em um pool de threads, reaproveitando conexões (keep-alive) por meio de uma sessão
+        do requests. Limita o número de downloads simultâneos por host, aplica timeout e novas tentativas com espera
+        exponencial e, quando há cache, faz requisições condicionais (If-None-Match/If-Modified-Since).
+
+        Attributes:
+            workers (int): quantidade máxima de downloads simultâneos.
+            conexoes_por_host (int): quantidade máxima de downloads simultâneos para um mesmo host.
+            timeout (float): tempo máximo, em segundos, para conectar e para cada leitura da resposta.
+            tentativas (int): quantidade máxima de tentativas por arquivo.
+            fator_backoff (float): espera, em segundos, antes da segunda tentativa (dobrada a cada nova tentativa).
+            cache (CacheArquivos): cache opcional dos arquivos baixados.
+    """
+
+    TAMANHO_BLOCO = 1024 * 1024
+    # Downloads sem cache são mantidos em memória até esse tamanho antes de serem transbordados para disco
+    TAMANHO_MAXIMO_MEMORIA = 16 * 1024 * 1024
+    # Códigos de resposta que justificam uma nova tentativa
+    STATUS_TEMPORARIOS = (408, 429, 500, 502, 503, 504)
+
+    def __init__(self, workers=4, conexoes_por_host=2, timeout=60, tentativas=3, fator_backoff=1.0, cache=None):
+        self.workers = workers
+        self.conexoes_por_host = conexoes_por_host
+        self.timeout = timeout
+        self.tentativas = tentativas
+        self.fator_backoff = fator_backoff
+        self.cache = cache
+
+        self.sessao = requests.Session()
+        adaptador = HTTPAdapter(pool_connections=workers, pool_maxsize=workers)
+        self.sessao.mount('http://', adaptador)
+        self.sessao.mount('https://', adaptador)
+        self.executor = concurrent.futures.ThreadPoolExecutor(max_workers=workers)
+
+        self.trava = threading.Lock()
+        self.semaforos = {}
+        self.falhas = []
+
+    def agendar(self, url, id_licitacao=None):
+        """
+        Agenda o download de uma url no pool de threads
+        :param url: endereço do arquivo
+        :param id_licitacao: id da licitação a que o arquivo pertence (usado no registro de falhas)
+        :return: Future cujo resultado é o mesmo de baixar()
+        """
+        return self.executor.submit(self.baixar, url, id_licitacao)
+
+    def baixar(self, url, id_licitacao=None):
+        """
+        Faz o download de uma url, com novas tentativas em caso de erro de rede ou erro temporário do servidor
+        :param url: endereço do arquivo
+        :param id_licitacao: id da licitação a que o arquivo pertence (usado no registro de falhas)
+        :return: tupla (objeto de arquivo binário aberto para leitura, tamanho em bytes)
+        :raises ErroDownload: se o download falha, por qualquer motivo, após as tentativas
+        """
+        if self.cache is not None and url in self.cache.urls_validadas:
+            origem = self.cache.obter(CacheArquivos.chave_url(url))
+            if origem is not None:
+                return origem, tamanho_arquivo(origem)
+
+        try:
+            host = urllib.parse.urlsplit(url).netloc
+        except ValueError as e:
+            # Url malformada: nenhuma tentativa é feita
+            self.registrar_falha(FalhaDownload(id_licitacao, url, None, 0, None, '{}: {}'.format(type(e).__name__, str(e))))
+        status_http = erro = None
+        for tentativa in range(1, self.tentativas + 1):
+            if tentativa > 1:
+                time.sleep(self.fator_backoff * 2 ** (tentativa - 2))
+            try:
+                with self.semaforo(host):
+                    return self.requisitar(url)
+            except requests.HTTPError as e:
+                status_http = e.response.status_code
+                erro = str(e)
+                if status_http not in self.STATUS_TEMPORARIOS:
+                    break
+            except (requests.ConnectionError, requests.Timeout, requests.exceptions.ChunkedEncodingError, urllib3.exceptions.HTTPError) as e:
+                # Erros de rede, inclusive os da leitura direta da resposta (resposta.raw) ao gravar no cache
+                status_http = None
+                erro = str(e)
+            except (requests.RequestException, ValueError, OSError) as e:
+                # Erros que não se resolvem com novas tentativas: url inválida, excesso de redirecionamentos, conteúdo
+                # que não pode ser decodificado, erro ao gravar no cache etc.
+                status_http = None
+                erro = '{}: {}'.format(type(e).__name__, str(e))
+                break
+            logging.info('Tentativa {} de download de {} falhou: {}'.format(tentativa, url, erro))
+
+        self.registrar_falha(FalhaDownload(id_licitacao, url, host, tentativa, status_http, erro))
+
+    def registrar_falha(self, falha):
+        """
+        Registra a falha de um download e levanta a exceção correspondente
+        :param falha: FalhaDownload
+        :raises ErroDownload: sempre
+        """
+        with self.trava:
+            self.falhas.append(falha)
+        raise ErroDownload(falha)
+
+    def requisitar(self, url):
+        """
+        Faz uma requisição GET (condicional, se a url está no cache) e grava a resposta no cache ou em um arquivo temporário
+        :param url: endereço do arquivo
+        :return: tupla (objeto de arquivo binário aberto para leitura, tamanho em bytes)
+        """
+        chave = CacheArquivos.chave_url(url)
+        cabecalhos = {}
+        if self.cache is not None:
+            validadores = self.cache.validadores(chave)
+            if validadores is not None:
+                etag, ultima_modificacao = validadores
+                if etag:
+                    cabecalhos['If-None-Match'] = etag
+                if ultima_modificacao:
+                    cabecalhos['If-Modified-Since'] = ultima_modificacao
+
+        with self.sessao.get(url, headers=cabecalhos, stream=True, timeout=self.timeout) as resposta:
+            if resposta.status_code == 304:
+                origem = self.cache.obter(chave)
+                if origem is not None:
+                    self.cache.urls_validadas.add(url)
+                    return origem, tamanho_arquivo(origem)
+                # O objeto foi removido do cache: repete a requisição sem validadores
+                self.cache.urls_validadas.discard(url)
+                with self.sessao.get(url, stream=True, timeout=self.timeout) as resposta_completa:
+                    return self.gravar_resposta(url, resposta_completa)
+            return self.gravar_resposta(url, resposta)
+
+    def gravar_resposta(self, url, resposta):
+        """
+        Grava o corpo de uma resposta no cache (se houver) ou em um arquivo temporário
+        :param url: endereço do arquivo
+        :param resposta: resposta do requests, obtida com stream=True
+        :return: tupla (objeto de arquivo binário aberto para leitura, tamanho em bytes)
+        """
+        resposta.raise_for_status()
+        resposta.raw.decode_content = True
+        if self.cache is not None:
+            origem = self.cache.armazenar(CacheArquivos.chave_url(url), resposta.raw,
+                                          resposta.headers.get('ETag'), resposta.headers.get('Last-Modified'))
+            self.cache.urls_validadas.add(url)
+            return origem, tamanho_arquivo(origem)
+        temporario = tempfile.SpooledTemporaryFile(max_size=self.TAMANHO_MAXIMO_MEMORIA)
+        try:
+            for bloco in resposta.iter_content(self.TAMANHO_BLOCO):
+                temporario.write(bloco)
+        except Exception:
+            temporario.close()
+            raise
+        tamanho = temporario.tell()
+        temporario.seek(0)
+        return temporario, tamanho
+
+    def semaforo(self, host):
+        """
+        Obtém o semáforo que limita os downloads simultâneos de um host
+        :param host: host (e porta) da url
+        :return: threading.BoundedSemaphore
+        """
+        with self.trava:
+            if host not in self.semaforos:
+                self.semaforos[host] = threading.BoundedSemaphore(self.conexoes_por_host)
+            return self.semaforos[host]
+
+    def obter_falhas(self):
+        """
+        Retorna e descarta as falhas de download registradas desde a última chamada
+        :return: lista de FalhaDownload
+        """
+        with self.trava:
+            falhas, self.falhas = self.falhas, []
+        return falhas
+
+    def close(self):
+        self.executor.shutdown(wait=True)
+        self.sessao.close()
+
+
+def descartar_downloads(futuros):
+    """
+    Descarta downloads agendados cujo resultado não será usado: cancela os que ainda não começaram e fecha o arquivo
+        dos que já terminaram (ou assim que terminarem)
+    :param futuros: Futures obtidos com BaixadorHttp.agendar (os None são ignorados)
+    """
+    for futuro in futuros:
+        if futuro is not None and not futuro.cancel():
+            futuro.add_done_callback(fechar_download)
+
+
+def fechar_download(futuro):
+    """
+    Fecha o arquivo baixado por um download concluído com sucesso
+    :param futuro: Future obtido com BaixadorHttp.agendar
+    """
+    if not futuro.cancelled() and futuro.exception() is None:
+        futuro.result()[0].close()
+
+
+def tamanho_arquivo(arquivo):
+    """
+    Obtém o tamanho de um arquivo aberto, sem alterar a posição de leitura
+    :param arquivo: objeto de arquivo aberto
+    :return: tamanho em bytes
+    """
+    posicao = arquivo.tell()
+    arquivo.seek(0, 2)
+    tamanho = arquivo.tell()
+    arquivo.seek(posicao)
+    return tamanho
@@ -3,7 +3,6 @@
 
 from abc import abstractmethod
 import fs
-from fs import compress
 import os
 import configparser
 import sqlalchemy
@@ -17,12 +16,23 @@ import logging.handlers
 import datetime
 import numpy
 from datetime import datetime, date, timedelta, time
+from time import perf_counter
 import traceback
-import urllib.request
+import zipfile
+import json
+import gzip
+import io
+import threading
+import queue
+import concurrent.futures
 import ast
 
 sys.path.append("..")
 import alice_util
+from cache_arquivos import CacheArquivos
+from http_arquivos import BaixadorHttp, ErroDownload, descartar_downloads
+from checkpoint_carga import CheckpointCarga
+from delta_carga import RegistroImpressoes, calcular_impressoes
 
 __author__ = 'edansfs@tcu.gov.br, arthurmendonca@tce.pe.gov.br e patricialustosa@tce.pe.gov.br'
 
@@ -52,10 +62,18 @@ class Uploader(object):
         self.config_certificado = config['certificado'] if 'certificado' in config else False
         self.config_email = config['email'] if 'email' in config else False
         self.config_variaveis_ambiente = config['variaveis_ambiente'] if 'variaveis_ambiente' in config else False
+        self.config_execucao = config['execucao'] if 'execucao' in config else False
 
         #Configura o log 
         alice_util.configurar_log(self.config_email, 'uploader')
 
+        # Métricas por dia e etapa (duração, linhas, arquivos e bytes), opcionais
+        try:
+            self.metricas = alice_util.obter_metricas(config['metricas'] if 'metricas' in config else False, 'uploader')
+        except Exception as e:
+            logging.error('Erro ao configurar as métricas: ' + str(e))
+            sys.exit()
+
         #Configura as variáveis de ambiente
         alice_util.configurar_variaveis_ambiente(self.config_variaveis_ambiente)
 
@@ -74,6 +92,15 @@ class Uploader(object):
         
         self.sobrescrever = args.sobrescrever
 
+        # Perfil de execução de cada dia, apenas com o parâmetro --profile
+        self.perfilador = None
+        if args.profile:
+            try:
+                self.perfilador = alice_util.Perfilador(args.profile, 'uploader')
+            except Exception as e:
+                logging.error('Erro ao criar a pasta do perfil de execução: ' + str(e))
+                sys.exit()
+
         # Obtém uma conexão ao banco de dados com os metadados por meio da biblioteca sqlalchemy
         try:
             self.conexao_banco_metadados = sqlalchemy.create_engine(self.config_origem_metadados['banco'])
@@ -99,6 +126,63 @@ class Uploader(object):
         except Exception as e:
             logging.error('Erro ao ler pasta com arquivos de destino: ' + str(e))
             sys.exit()
+
+        # Compila os esquemas das tabelas de metadados em validadores
+        try:
+            self.validadores = compilar_validadores(self.config_origem_metadados)
+            self.colunas_referenciadas = obter_colunas_referenciadas(self.validadores)
+        except Exception as e:
+            logging.error('Erro ao ler os esquemas das tabelas de metadados: ' + str(e))
+            sys.exit()
+
+        # Plano de tipos compactos dos dataframes de metadados, opcional
+        self.planos_tipos = {}
+        if self.config_origem_metadados.get('tipos_compactos', 'N') == 'S':
+            self.planos_tipos = compilar_planos_tipos(self.validadores, self.colunas_referenciadas)
+
+        # Cache local dos arquivos de origem, opcional
+        self.cache_arquivos = None
+        if 'pasta_cache' in self.config_origem_arquivos:
+            try:
+                tamanho_maximo = self.config_origem_arquivos.getint('tamanho_cache_mb', fallback=2048) * 1024 * 1024
+                self.cache_arquivos = CacheArquivos(self.config_origem_arquivos['pasta_cache'], tamanho_maximo)
+            except Exception as e:
+                logging.error('Erro ao abrir o cache de arquivos de origem: ' + str(e))
+                sys.exit()
+
+        # Política de compressão dos zips das licitações, opcional
+        try:
+            self.politica_compressao = obter_politica_compressao(self.config_origem_arquivos)
+        except Exception as e:
+            logging.error('Erro ao ler a política de compressão dos zips: ' + str(e))
+            sys.exit()
+
+        # Downloads dos arquivos disponibilizados via http(s)
+        self.baixador_http = BaixadorHttp(workers=self.config_origem_arquivos.getint('workers_http', fallback=4),
+                                          conexoes_por_host=self.config_origem_arquivos.getint('conexoes_por_host', fallback=2),
+                                          timeout=self.config_origem_arquivos.getfloat('timeout_http', fallback=60),
+                                          tentativas=self.config_origem_arquivos.getint('tentativas_http', fallback=3),
+                                          cache=self.cache_arquivos)
+
+        # Checkpoint da carga, opcional: permite retomar um dia interrompido sem refazer os zips já montados e enviados
+        self.checkpoint = None
+        if self.config_execucao and self.config_execucao.get('checkpoint', 'N') == 'S':
+            try:
+                self.checkpoint = CheckpointCarga(self.config_execucao.get('arquivo_checkpoint', './checkpoint.db'))
+            except Exception as e:
+                logging.error('Erro ao abrir o checkpoint da carga: ' + str(e))
+                sys.exit()
+        # Modo delta, opcional: reenvia apenas as licitações novas ou alteradas de cada dia
+        self.impressoes = None
+        if self.config_execucao and self.config_execucao.get('modo_delta', 'N') == 'S':
+            try:
+                self.impressoes = RegistroImpressoes(self.config_execucao.get('arquivo_impressoes', './impressoes.db'))
+            except Exception as e:
+                logging.error('Erro ao abrir o registro de impressões digitais das licitações: ' + str(e))
+                sys.exit()
+        # Zips montados sem algum arquivo cujo download falhou, que não são registrados no checkpoint nem no registro de
+        # impressões do modo delta (reiniciados a cada dia, ver enviar_dia)
+        self.zips_incompletos = set()
         
 
     def execute(self):
@@ -108,82 +192,251 @@ class Uploader(object):
         self.filesystem_pasta_temp = fs.open_fs('./temp/')
 
         self.dados = {}
+        self.particoes_intervalo = {}
 
         #print('Carga de {} a {}'.format(args.data_inicio, args.data_fim))
         # Executa o upload dos metadados e dos arquivos zip para cada dia do intervalo determinado
-        for dia in (self.data_inicio + timedelta(n) for n in range(int((self.data_fim - self.data_inicio).days) + 1)):
-            diaString = dia.strftime("%d/%m/%Y")
-            diaStringInvertido = dia.strftime("%Y%m%d")
+        dias = [self.data_inicio + timedelta(n) for n in range(int((self.data_fim - self.data_inicio).days) + 1)]
+        dias_em_andamento = self.config_execucao.getint('dias_em_andamento', fallback=1) if self.config_execucao else 1
+        if dias_em_andamento > 1 and self.perfilador is not None:
+            # O perfil de cada dia exige que seus metadados sejam obtidos e enviados na mesma thread, um dia por vez
+            logging.warning("Carga em pipeline desativada pelo parâmetro --profile")
+            dias_em_andamento = 1
+        if dias_em_andamento > 1 and len(dias) > 1:
+            self.executar_pipeline(dias, dias_em_andamento)
+        else:
+            for dia in dias:
+                if self.verificar_dia(dia, self.filesystem_destino):
+                    with alice_util.perfilar(self.perfilador, dia):
+                        df_licitacoes, dataframe_arquivos = self.obter_metadados_dia(dia)
+                        self.enviar_dia(dia, df_licitacoes, dataframe_arquivos)
+        shutil.rmtree('./temp/')
+        self.baixador_http.close()
+        if self.checkpoint is not None:
+            self.checkpoint.close()
+        if self.impressoes is not None:
+            self.impressoes.close()
+
+
+    def executar_pipeline(self, dias, dias_em_andamento):
+        """
+        Executa a carga dos dias em pipeline: enquanto os arquivos de um dia são compactados e enviados (nesta thread),
+            uma thread auxiliar verifica os dias seguintes no destino e obtém e valida seus metadados. Os envios
+            continuam ocorrendo um dia por vez, na ordem do intervalo
+        :param dias: lista dos dias a serem carregados, em ordem
+        :param dias_em_andamento: quantidade máxima de dias em andamento (o dia sendo enviado mais os dias com
+            metadados já obtidos, aguardando envio)
+        """
+        logging.info("Carga em pipeline, com até {} dias em andamento".format(dias_em_andamento))
+        fila = queue.Queue()
+        # Cada dia ocupa uma vaga desde a obtenção de seus metadados até o fim de seu envio; o limite não pode ser
+        # imposto pelo tamanho da fila, que não conta o dia sendo enviado nem o dia já obtido aguardando espaço nela
+        vagas = threading.BoundedSemaphore(dias_em_andamento)
+        encerrar = threading.Event()
+
+        def reservar_vaga():
+            # Aguarda uma vaga, desistindo se a thread principal encerrou a carga
+            while not encerrar.is_set():
+                if vagas.acquire(timeout=1):
+                    return True
+            return False
+
+        def preparar_dias():
+            # A thread auxiliar usa sua própria conexão ao destino para as verificações de <dia>.ok
+            filesystem_destino = None
+            try:
+                filesystem_destino = alice_util.obter_filesystem(self.config_destino, criar_diretorio=False)
+                for dia in dias:
+                    if encerrar.is_set():
+                        return
+                    if self.verificar_dia(dia, filesystem_destino):
+                        if not reservar_vaga():
+                            return
+                        fila.put((dia, self.obter_metadados_dia(dia), None))
+            except BaseException as e:
+                # Inclui o SystemExit dos tratamentos de erro, que de outra forma encerraria apenas esta thread
+                fila.put((None, None, e))
+            finally:
+                if filesystem_destino is not None:
+                    filesystem_destino.close()
+                fila.put(None)
+
+        preparador = threading.Thread(target=preparar_dias, name='preparador_dias', daemon=True)
+        preparador.start()
+        try:
+            for item in iter(fila.get, None):
+                dia, metadados, erro = item
+                if erro is not None:
+                    raise erro
+                df_licitacoes, dataframe_arquivos = metadados
+                # Libera as referências aos metadados do dia antes de liberar sua vaga
+                del item, metadados
+                self.enviar_dia(dia, df_licitacoes, dataframe_arquivos)
+                del df_licitacoes, dataframe_arquivos
+                vagas.release()
+        finally:
+            encerrar.set()
+            preparador.join()
+
+
+    def verificar_dia(self, dia, filesystem_destino):
+        """
+        Verifica no destino se o dia deve ser carregado. Sem o parâmetro --sobrescrever, o dia é ignorado se já existe
+            o arquivo <dia>.ok ou a pasta do dia com o arquivo licitacoes.csv; com o parâmetro, o arquivo <dia>.ok e a
+            pasta do dia são removidos
+        :param dia: dia da carga
+        :param filesystem_destino: sistema de arquivos de destino
+        :return: True se o dia deve ser carregado
+        """
+        diaString = dia.strftime("%d/%m/%Y")
+        diaStringInvertido = dia.strftime("%Y%m%d")
+
+        caminho_pasta_dia = '/' + diaStringInvertido
+        caminho_arquivo_ok = caminho_pasta_dia + '.ok'
+        caminho_arquivo_csv = caminho_pasta_dia + '/licitacoes.csv'
+
+        # No modo delta, sem o parâmetro de sobrescrever, o dia é verificado mesmo se a pasta já existe ou se o checkpoint
+        # indica que sua carga foi concluída: as licitações novas ou alteradas são reenviadas para a pasta já existente
+        # (ver enviar_dia). Os dias com <dia>.ok, já processados pelo TCU, continuam sendo ignorados
+        if (not self.sobrescrever and self.impressoes is not None):
+            if filesystem_destino.isfile(caminho_arquivo_ok):
+                logging.info("Pasta do dia {} não enviada pois existe arquivo {}.ok na pasta de destino".format(diaString, diaStringInvertido))
+                return False
+            return True
+        # Verificando se o parâmetro de sobrescrever foi passado. 
+        # Caso não tenha sido, confere se a pasta ou o arquivo <dia>.ok já existe.
+        if (not self.sobrescrever):
+            # Verificando se a carga do dia foi concluída em uma execução anterior, de acordo com o checkpoint
+            if self.checkpoint is not None and self.checkpoint.dia_concluido(diaStringInvertido):
+                logging.info("Pasta do dia {} não enviada pois sua carga já foi concluída, de acordo com o checkpoint".format(diaString))
+                return False
+            # Verificando se existe arquivo <dia>.ok. 
+            # Caso exista, a pasta não é reenviada, pois o dia já foi processado pelo TCU. 
+            if filesystem_destino.isfile(caminho_arquivo_ok):
+                logging.info("Pasta do dia {} não enviada pois existe arquivo {}.ok na pasta de destino".format(diaString, diaStringInvertido))
+                return False
+            # Verificando se existe arquivo licitacoes.csv na pasta do dia. 
+            # Caso exista, a pasta não é reenviada, pois o dia já foi enviado ao TCU. 
+            if filesystem_destino.isfile(caminho_arquivo_csv):
+                logging.info("Pasta do dia {} não enviada pois pasta com as licitações do dia já existe no filesystem de destino".format(diaString))
+                return False
+        else:
+            logging.info("Carga do dia {} será sobrescrita".format(diaString))
+            # Caso esteja sobrescrevendo, remover arquivo data <dia>.ok e a pasta do dia.
+            if filesystem_destino.isfile(caminho_arquivo_ok):
+                filesystem_destino.remove(caminho_arquivo_ok)
+                logging.info("Arquivo {}.ok removido".format(diaStringInvertido))
+            if filesystem_destino.isdir(caminho_pasta_dia):
+                remover_pasta(filesystem_destino, caminho_pasta_dia)
+                logging.info("Pasta {} removida".format(diaStringInvertido))
+        return True
+
+
+    def obter_metadados_dia(self, dia):
+        """
+        Obtém e valida os metadados das licitações do dia, aninhando as demais tabelas configuradas, e a lista de
+            arquivos associados às licitações
+        :param dia: dia da carga
+        :return: tupla (dataframe das licitações, dataframe dos arquivos)
+        """
+        diaString = dia.strftime("%d/%m/%Y")
+        logging.info("Início de carga do dia {}".format(diaString))
+        # Obtendo dataframe de metadados das licitações:
+        try:
+            logging.info("Iniciando a obtenção dos metadados das licitações")
+            df_licitacoes = self.obter_dataframe(dia, self.conexao_banco_metadados, self.config_origem_metadados, 'licitacoes', True)
+            logging.info("Licitações obtidas")
+        except Exception as e:
+            logging.error("Erro ao carregar os metadados das licitações do dia {}: {}".format(diaString, str(e)))
+            sys.exit()
         
-            caminho_pasta_dia = '/' + diaStringInvertido
-            caminho_arquivo_ok = caminho_pasta_dia + '.ok'
-            caminho_arquivo_csv = caminho_pasta_dia + '/licitacoes.csv'
-            
-            # Verificando se o parâmetro de sobrescrever foi passado. 
-            # Caso não tenha sido, confere se a pasta ou o arquivo <dia>.ok já existe.
-            if (not self.sobrescrever):
-                # Verificando se existe arquivo <dia>.ok. 
-                # Caso exista, a pasta não é reenviada, pois o dia já foi processado pelo TCU. 
-                if self.filesystem_destino.isfile(caminho_arquivo_ok):
-                    logging.info("Pasta do dia {} não enviada pois existe arquivo {}.ok na pasta de destino".format(diaString, diaStringInvertido))
-                    continue
-                # Verificando se existe arquivo licitacoes.csv na pasta do dia. 
-                # Caso exista, a pasta não é reenviada, pois o dia já foi enviado ao TCU. 
-                if self.filesystem_destino.isfile(caminho_arquivo_csv):
-                    logging.info("Pasta do dia {} não enviada pois pasta com as licitações do dia já existe no filesystem de destino".format(diaString))
-                    continue
+        # Obtendo os outros metadados definidos no arquivo de configuração
+        for t in ast.literal_eval(self.config_origem_metadados['tabelas']): #TODO: Verificar se precisa do eval ou se o configparser já lê o dict/array
+            if t != 'licitacoes':
+                logging.info("Obtendo os dados da tabela {}".format(t))
+                try:
+                    # Os registros são agrupados por licitação bloco a bloco, sem montar o dataframe inteiro da tabela
+                    registros_por_licitacao = {}
+                    for df_tabela in self.obter_blocos_dataframe(dia, self.conexao_banco_metadados, self.config_origem_metadados, t, True): #TODO: Corrigir problemas na importação
+                        if t in self.planos_tipos:
+                            # Os registros de valores repetidos passam a compartilhar o mesmo objeto texto
+                            df_tabela = self.planos_tipos[t].aplicar(df_tabela)
+                        agrupar_registros(df_tabela, registros_por_licitacao)
+                    df_licitacoes = aninhar_registros(df_licitacoes, registros_por_licitacao, t)
+                    logging.info("Tabela {} aninhada às licitações: {} registro(s)".format(t, sum(len(registros) for registros in registros_por_licitacao.values())))
+                except Exception as e:
+                    logging.error("Erro ao carregar metadados da tabela {} na carga do dia {}:{}".format(t,diaString,str(e)))
+                    sys.exit()
+        # Obtendo lista de arquivos a serem enviados:
+        try:
+            logging.info("Iniciando a obtenção da lista de arquivos a serem compactados")
+            dataframe_arquivos = self.obter_dataframe(dia, self.conexao_banco_arquivos, self.config_origem_arquivos, 'arquivos', False)
+        except Exception as e:
+            logging.error("Erro ao obter a lista de arquivos de origem do dia {}: {}".format(diaString, str(e)))
+            sys.exit()
+        return df_licitacoes, dataframe_arquivos
+
+
+    def enviar_dia(self, dia, df_licitacoes, dataframe_arquivos):
+        """
+        Compacta os arquivos das licitações do dia e faz o upload dos zips e dos metadados para o destino
+        :param dia: dia da carga
+        :param df_licitacoes: dataframe contendo os metadados das licitações
+        :param dataframe_arquivos: dataframe contendo a lista de arquivos ou pastas associados às licitações
+        """
+        diaString = dia.strftime("%d/%m/%Y")
+        alteracoes = None
+        df_licitacoes_zip, dataframe_arquivos_zip = df_licitacoes, dataframe_arquivos
+        # Os zips incompletos são registrados por dia
+        self.zips_incompletos = set()
+        if self.impressoes is not None:
+            # Modo delta: apenas as licitações novas ou alteradas desde o último envio do dia são compactadas e enviadas
+            impressoes = calcular_impressoes(df_licitacoes, dataframe_arquivos)
+            alteracoes = self.impressoes.comparar(dia.strftime('%Y%m%d'), impressoes)
+            if self.filesystem_destino.isdir('/' + dia.strftime('%Y%m%d')) and not self.sobrescrever:
+                if sum(len(ids) for ids in alteracoes.values()) == 0:
+                    logging.info("Nenhuma licitação nova, alterada ou removida no dia {} - dia não reenviado".format(diaString))
+                    return
+                logging.info("Dia {}: {} licitação(ões) nova(s), {} alterada(s) e {} removida(s)".format(
+                    diaString, len(alteracoes['novas']), len(alteracoes['alteradas']), len(alteracoes['removidas'])))
+                reenviar = set(alteracoes['novas'] + alteracoes['alteradas'])
+                df_licitacoes_zip = df_licitacoes[df_licitacoes['id_licitacao'].astype(str).isin(reenviar)]
+                dataframe_arquivos_zip = dataframe_arquivos[dataframe_arquivos['id_licitacao'].astype(str).isin(reenviar)]
             else:
-                logging.info("Carga do dia {} será sobrescrita".format(diaString))
-                # Caso esteja sobrescrevendo, remover arquivo data <dia>.ok e a pasta do dia.
-                if self.filesystem_destino.isfile(caminho_arquivo_ok):
-                    self.filesystem_destino.remove(caminho_arquivo_ok)
-                    logging.info("Arquivo {}.ok removido".format(diaStringInvertido))
-                if self.filesystem_destino.isdir(caminho_pasta_dia):
-                    remover_pasta(self.filesystem_destino, caminho_pasta_dia)
-                    logging.info("Pasta {} removida".format(diaStringInvertido))
-
-            logging.info("Início de carga do dia {}".format(diaString))
-            # Obtendo dataframe de metadados das licitações:
-            try:
-                logging.info("Iniciando a obtenção dos metadados das licitações")
-                df_licitacoes = self.obter_dataframe(dia, self.conexao_banco_metadados, self.config_origem_metadados, 'licitacoes', True)
-                logging.info("Licitações obtidas")
-            except Exception as e:
-                logging.error("Erro ao carregar os metadados das licitações do dia {}: {}".format(diaString, str(e)))
-                sys.exit()
-            
-            # Obtendo os outros metadados definidos no arquivo de configuração
-            for t in ast.literal_eval(self.config_origem_metadados['tabelas']): #TODO: Verificar se precisa do eval ou se o configparser já lê o dict/array
-                if t != 'licitacoes':
-                    logging.info("Obtendo os dados da tabela {}".format(t))
-                    try:
-                        df_tabela = self.obter_dataframe(dia, self.conexao_banco_metadados, self.config_origem_metadados, t, True) #TODO: Corrigir problemas na importação
-                        lista_elementos = []
-                        for id in df_tabela['id_licitacao'].unique():
-                            df = df_tabela[df_tabela['id_licitacao']==id]
-                            df = df.drop(columns='id_licitacao')
-                            lista_elementos.append((id,df))
-                        df_tabela = pd.DataFrame(lista_elementos, columns =['id_licitacao', t])
-                        df_licitacoes = df_licitacoes.join(df_tabela.set_index('id_licitacao'), on='id_licitacao')
-                        print(df_licitacoes)
-                    except Exception as e:
-                        logging.error("Erro ao carregar metadados da tabela {} na carga do dia {}:{}".format(t,diaString,str(e)))
-                        sys.exit()
-            # Obtendo lista de arquivos a serem enviados:
-            try:
-                logging.info("Iniciando a obtenção da lista de arquivos a serem compactados")
-                dataframe_arquivos = self.obter_dataframe(dia, self.conexao_banco_arquivos, self.config_origem_arquivos, 'arquivos', False)
-                arquivos_zip = self.obter_arquivos_zip(self.filesystem_pasta_temp, self.filesystem_arquivos, dataframe_arquivos, df_licitacoes)
-                logging.info("Fim da obtenção dos arquivos")
-            except Exception as e:
-                logging.error("Erro ao obter a lista de arquivos de origem do dia {}: {}".format(diaString, str(e)))
-                sys.exit()
-            # Realizando o upload:
-            self.upload(df_licitacoes, self.filesystem_pasta_temp, arquivos_zip, self.filesystem_destino, dia)
-            logging.info("Fim de carga do dia {} - {} arquivos carregados".format(diaString, len(arquivos_zip)))
-        shutil.rmtree('./temp/')
+                # Primeiro envio do dia (ou envio sobrescrito): todas as licitações são enviadas
+                alteracoes = {'novas': list(impressoes), 'alteradas': [], 'removidas': []}
+        try:
+            arquivos_zip = self.obter_arquivos_zip(self.filesystem_pasta_temp, self.filesystem_arquivos, dataframe_arquivos_zip, df_licitacoes_zip, dia)
+            self.registrar_falhas_download(dia)
+            logging.info("Fim da obtenção dos arquivos")
+        except Exception as e:
+            logging.error("Erro ao obter a lista de arquivos de origem do dia {}: {}".format(diaString, str(e)))
+            sys.exit()
+        # Realizando o upload:
+        self.upload(df_licitacoes, self.filesystem_pasta_temp, arquivos_zip, self.filesystem_destino, dia, alteracoes)
+        if self.impressoes is not None:
+            # As licitações cujo zip ficou incompleto (falha de download) não são registradas, de modo que a próxima
+            # execução as considere novas e tente enviá-las novamente
+            incompletas = set(arq[:-len('.zip')] for arq in self.zips_incompletos)
+            self.impressoes.registrar(dia.strftime('%Y%m%d'), {lic: impressao for lic, impressao in impressoes.items() if lic not in incompletas})
+        logging.info("Fim de carga do dia {} - {} arquivos carregados".format(diaString, len(arquivos_zip)))
 
 
+    def registrar_falhas_download(self, dia):
+        """
+        Registra as falhas de download http do dia no log e, de forma estruturada (uma linha JSON por falha), no
+            arquivo log/falhas_download.jsonl
+        :param dia: dia da carga
+        """
+        falhas = self.baixador_http.obter_falhas()
+        if len(falhas) == 0:
+            return
+        logging.warning("{} arquivo(s) não puderam ser baixados na carga do dia {} - ver log/falhas_download.jsonl".format(len(falhas), dia.strftime("%d/%m/%Y")))
+        with open('./log/falhas_download.jsonl', mode='a', encoding='utf-8') as arquivo_falhas:
+            for falha in falhas:
+                registro = dict(falha._asdict(), dia=dia.strftime("%Y%m%d"), registrado_em=datetime.now().isoformat())
+                arquivo_falhas.write(json.dumps(registro, ensure_ascii=False) + '\n')
+
 
     def obter_dataframe(self, dia, conexao_banco, config_origem, tabela, validar=False): #TODO: Colocar aqui arquivos/metadados. Tem que mudar a lógica.
         """
@@ -194,98 +447,145 @@ class Uploader(object):
         :param tipo: tipo do dataframe - se for "Metadados", realiza a validação da estrutura do dataframe antes de retorná-lo
         :return: dataframe do Pandas
         """
+        blocos = list(self.obter_blocos_dataframe(dia, conexao_banco, config_origem, tabela, validar))
+        df_obtido = blocos[0] if len(blocos) == 1 else pd.concat(blocos, ignore_index=True)
+        if tabela in self.planos_tipos:
+            # Compacta o dataframe completo, e não cada bloco (a concatenação de categóricas diferentes resulta em object)
+            df_obtido = self.planos_tipos[tabela].aplicar(df_obtido)
+        return df_obtido
+
+
+    def obter_blocos_dataframe(self, dia, conexao_banco, config_origem, tabela, validar=False):
+        """
+        Obtém o resultado da consulta de uma tabela como uma sequência de dataframes (blocos). Com o parâmetro
+            'linhas_por_bloco' na seção de configuração, as linhas são lidas por meio de um cursor no servidor, em blocos
+            do tamanho informado; sem ele, é retornado um único bloco com todo o resultado. Cada bloco é validado
+            separadamente, e apenas as colunas referenciadas por chaves estrangeiras de outras tabelas ('ref') são
+            mantidas em self.dados, na forma de índices (pd.Index) dos valores distintos, para as validações das
+            tabelas seguintes
+        :param dia: dia da carga
+        :param conexao_banco: engine de conexão ao banco de dados do sqlalchemy
+        :param config_origem: contém a configuração referente à consulta sql a ser executada
+        :param tabela: nome da tabela
+        :param validar: se True, valida os blocos de acordo com o esquema da tabela; as divergências de todos os blocos
+            são reunidas e informadas ao final da leitura da tabela
+        :return: gerador de dataframes do Pandas
+        """
         try:
             # Obtém o script SQL para obter os metadados das licitações
             script_sql = self.obter_script_sql(config_origem, tabela)
+            linhas_por_bloco = config_origem.getint('linhas_por_bloco', fallback=0)
+            # Métricas: apenas o tempo gasto na leitura dos blocos e na validação, sem o processamento de quem consome os blocos
+            inicio = perf_counter()
             # Executa o script SQL na conexão obtida
-            df_obtido = pd.read_sql_query(script_sql, conexao_banco, params={'dia': dia})
-            if validar and len(df_obtido) > 0:
-                self.validar_dataframe(df_obtido, config_origem, tabela)
-            self.dados[tabela] = df_obtido
+            if config_origem.get('consulta_intervalo', 'N') == 'S':
+                blocos = self.obter_blocos_intervalo(dia, conexao_banco, config_origem, tabela, script_sql, linhas_por_bloco)
+            elif linhas_por_bloco > 0:
+                blocos = consultar_em_blocos(script_sql, conexao_banco, {'dia': dia}, linhas_por_bloco)
+            else:
+                blocos = [pd.read_sql_query(script_sql, conexao_banco, params={'dia': dia})]
+            colunas_chave = self.colunas_referenciadas.get(tabela, [])
+            chaves = {col: [] for col in colunas_chave}
+            resultado_validacao = ResultadoValidacao(tabela) if validar else None
+            linhas = 0
+            tempo_consulta = perf_counter() - inicio
+            tempo_validacao = 0.0
+            iterador_blocos = iter(blocos)
+            while True:
+                inicio = perf_counter()
+                df_obtido = next(iterador_blocos, None)
+                tempo_consulta += perf_counter() - inicio
+                if df_obtido is None:
+                    break
+                linhas += len(df_obtido)
+                if validar and len(df_obtido) > 0:
+                    inicio = perf_counter()
+                    self.validadores[tabela].validar(df_obtido, self.dados, resultado_validacao)
+                    tempo_validacao += perf_counter() - inicio
+                for col in colunas_chave:
+                    if col in df_obtido.columns:
+                        chaves[col].append(df_obtido[col].dropna().unique())
+                yield df_obtido
+            self.metricas.registrar('obter_dataframe', dia, tempo_consulta, {'linhas': linhas}, tabela=tabela)
+            if validar:
+                self.metricas.registrar('validar_dataframe', dia, tempo_validacao, {'linhas': linhas},
+                                        len(resultado_validacao.erros) == 0, tabela=tabela)
+                self.concluir_validacao(resultado_validacao)
+            self.dados[tabela] = {col: pd.Index(pd.unique(numpy.concatenate(valores))) if len(valores) > 0 else pd.Index([])
+                                  for col, valores in chaves.items()}
         except Exception as e:
             logging.error('Erro ao consultar banco de dados para obter dataframe: ' + str(e))
             sys.exit()
-        return df_obtido
-    
+
+
+    def obter_blocos_intervalo(self, dia, conexao_banco, config_origem, tabela, script_sql, linhas_por_bloco=0):
+        """
+        Obtém os dataframes de um dia a partir de uma única consulta para todo o intervalo da carga (modo
+            'consulta_intervalo=S'). Na primeira chamada para a tabela, a consulta é executada com os parâmetros
+            :dia_inicio e :dia_fim e as linhas são separadas por dia de acordo com a coluna 'coluna_dia' (padrão: dia).
+            Os dataframes de cada dia são montados apenas com as linhas desse dia, da mesma forma que o pandas monta o
+            resultado de uma consulta, de modo que os tipos inferidos sejam os mesmos da consulta diária
+        :param dia: dia da carga
+        :param conexao_banco: engine de conexão ao banco de dados do sqlalchemy
+        :param config_origem: seção do arquivo de configuração da consulta
+        :param tabela: nome da tabela
+        :param script_sql: consulta sql da tabela, com os parâmetros :dia_inicio e :dia_fim
+        :param linhas_por_bloco: quantidade de linhas de cada dataframe (0 para um único dataframe com todas as linhas do dia)
+        :return: lista de dataframes do Pandas com as linhas do dia, sem a coluna do dia
+        """
+        if tabela not in self.particoes_intervalo:
+            coluna_dia = config_origem.get('coluna_dia', 'dia')
+            logging.info("Consultando a tabela {} para todo o intervalo de {} a {}".format(tabela, self.data_inicio.strftime("%d/%m/%Y"), self.data_fim.strftime("%d/%m/%Y")))
+            resultado = conexao_banco.execute(script_sql, {'dia_inicio': self.data_inicio, 'dia_fim': self.data_fim})
+            colunas = list(resultado.keys())
+            if coluna_dia not in colunas:
+                resultado.close()
+                raise Exception("A consulta da tabela {} não retorna a coluna \"{}\", necessária para separar os resultados por dia".format(tabela, coluna_dia))
+            posicao = colunas.index(coluna_dia)
+            linhas_por_dia = {}
+            for linha in resultado:
+                linhas_por_dia.setdefault(pd.Timestamp(linha[posicao]).normalize(), []).append(tuple(linha))
+            resultado.close()
+            self.particoes_intervalo[tabela] = (colunas, coluna_dia, linhas_por_dia)
+        colunas, coluna_dia, linhas_por_dia = self.particoes_intervalo[tabela]
+        # Cada dia é lido uma única vez, então suas linhas são descartadas após a montagem dos dataframes
+        linhas = linhas_por_dia.pop(pd.Timestamp(dia).normalize(), [])
+        tamanho_bloco = linhas_por_bloco if linhas_por_bloco > 0 else max(len(linhas), 1)
+        return [pd.DataFrame.from_records(linhas[inicio:inicio + tamanho_bloco], columns=colunas, coerce_float=True).drop(columns=coluna_dia)
+                for inicio in range(0, max(len(linhas), 1), tamanho_bloco)]
+
 
     def validar_dataframe(self, df_validar, config_origem, tabela):
         """
         Realiza uma verificação mínima da qualidade dos dados retornados no dataframe (ex. Campos obrigatórios,
-            tipos de dados, etc) de acordo com os parâmetros de configuração
+            tipos de dados, etc) de acordo com o validador compilado a partir do esquema da tabela
         :param df_licitacoes: dataframe a ser validado
         :param config_origem: seção do arquivo de configuração contendo as regras de validação
         return: dataframe do Pandas
         """
-        colunas_erro = []
+        resultado_validacao = ResultadoValidacao(tabela)
         try:
-            #Avalia parâmetros de configuração da tabela - esquema e lista de campos obrigatórios
-            logging.info("Validando os dados obtidos da tabela \"{}\"".format(tabela))
-            config_esquema = ast.literal_eval(config_origem['esquema_' + tabela])
-            
-            config_obrigatorios = {key:value for (key,value) in config_esquema.items() if value['obrigatorio'] == 'S'}
-            config_obrigatorios = config_obrigatorios.keys()
-
-            #Substituindo strings vazias do dataframe por NaN para usar na verificação de campos nulos.        
-            df_tabela = df_validar.replace('', numpy.nan)            
-            if not(all(elem in df_validar.columns for elem in config_obrigatorios)): #set(config_obrigatorios).issubset(set(df_validar.columns))):
-                #print('validando colunas ausentes na tabela ', tabela)
-                colunas_ausentes = set(config_obrigatorios) - set(df_validar.columns)
-                colunas_erro.append("O(s) campo(s) \"{}\" são obrigatórios e não estão presentes no conjunto de metadados da tabela \"{}\"".format(",".join(colunas_ausentes), tabela))
-            else:
-                for col in df_validar.columns:
-                    print("validando coluna ", col)
-                    if col not in config_esquema.keys():
-                        colunas_erro.append("O campo \"{}\" é retornado pela consulta da tabela \"{}\" mas não faz parte da configuração do esquema".format(col, tabela))
-                    elif (df_validar[col].isnull().any() and col in config_obrigatorios):
-                        #print("validando presenca de nulos em ", col)
-                        colunas_erro.append("O campo \"{}\" da tabela \"{}\" é obrigatório, mas há um ou mais registros com valores nulos".format(col, tabela))
-                    # Confere se o campo só contém valores nulos, caso em que é impossível realizar a inferência de tipo
-                    elif df_validar[col].isnull().all():
-                        #print("validando presenca de todos nulos em ", col) 
-                        logging.warning("O tipo do campo \"{}\" não pôde ser inferido, pois este só contém valores nulos".format(col))
-                    # Confronta tipo da coluna de acordo com definição do esquema
-                    else:
-                        idx = df_validar.columns.get_loc(col)
-                        tipo_col = config_esquema[col]['tipo']
-                        tipo_lido = str(df_validar.dtypes[idx])
-                        if(tipo_lido in ['int', 'int64'] and tipo_col in ['float','float64']):
-                            logging.warning("O campo \"{}\" é do tipo int, mas no modelo de dados consta como float - os dados serão carregados mesmo assim".format(col))
-                        elif(tipo_lido=='float64' and tipo_col=='int'):
-                            logging.warning("O campo \"{}\" é do tipo float, mas no modelo de dados consta como int - os dados poderão ser truncados no upload para o Alice".format(col))
-                        elif(traduz_tipos_pandas(tipo_lido) != tipo_col):
-                            colunas_erro.append("O campo \"{}\" é do tipo {}, quando deveria ser do tipo {}".format(col, tipo_lido, tipo_col))  
-
-                    #Confronta os valores válidos da coluna de acordo com definição de valores possíveis do esquema
-                    if('enum' in config_esquema[col]): 
-                        valoresValidos = config_esquema[col]['enum']
-                        if(col not in config_obrigatorios):
-                            valoresValidos.append(numpy.nan)
-                            df_validar[col].replace([None], numpy.nan, inplace=True)
-
-                        if (not df_validar[col].isin(valoresValidos).all()):
-                            colunas_erro.append("Há linhas do campo \"{}\" fora dos valores permitidos para esse campo.".format(col))  
-
-                    #Confronta os valores válidos da coluna de acordo com a chave estrangeira definida no esquema
-                    if('ref' in config_esquema[col]):
-                        tab = config_esquema[col]['ref'].split('.')[0]
-                        campo = config_esquema[col]['ref'].split('.')[1]
-
-                        valoresValidos = self.dados[tab][campo]
-                        
-                        #if(col not in config_obrigatorios):
-                        #    valoresValidos = valoresValidos.append(pd.Series([numpy.NaN]))
-                        #    df_validar[col].replace([None], numpy.nan, inplace=True)
-                        if (not df_validar.dropna()[col].isin(valoresValidos).all()): 
-                            colunas_erro.append("Há linhas do campo \"{}\" com valor não correspondente de chave estrangeira.".format(col))  
-
+            with self.metricas.medir('validar_dataframe', tabela=tabela) as valores:
+                valores['linhas'] = len(df_validar)
+                self.validadores[tabela].validar(df_validar, self.dados, resultado_validacao)
         except Exception as e:
             logging.error('Erro ao validar dataframe: ' + str(e))
             sys.exit()
-        if(len(colunas_erro) > 0):
+        self.concluir_validacao(resultado_validacao)
+        return df_validar
+
+
+    def concluir_validacao(self, resultado_validacao):
+        """
+        Registra no log os avisos da validação de uma tabela e encerra a execução se houve divergências
+        :param resultado_validacao: ResultadoValidacao com as divergências de todos os blocos da tabela
+        """
+        for aviso in resultado_validacao.obter_avisos(self.validadores[resultado_validacao.tabela]):
+            logging.warning(aviso)
+        if(len(resultado_validacao.erros) > 0):
             # Se houve divergências 
-            logging.error('Validação do dataframe de metadados finalizada com erro: \n' + "\n".join(colunas_erro))
+            logging.error('Validação do dataframe de metadados finalizada com erro: \n' + "\n".join(resultado_validacao.erros))
             sys.exit()
-        return df_validar
 
 
     def obter_script_sql(self, config_banco, tabela):
@@ -310,66 +610,154 @@ class Uploader(object):
         return script
 
 
-    def obter_arquivos_zip(self, filesystem_pasta_temp, filesystem_arquivos, df_arquivos, df_metadados):
+    def obter_arquivos_zip(self, filesystem_pasta_temp, filesystem_arquivos, df_arquivos, df_metadados, dia=None):
         """
-        Retorna uma lista com os arquivos zips de cada licitação que serão copiados para o destino
+        Retorna uma lista com os arquivos zips de cada licitação que serão copiados para o destino. Os zips das
+            licitações são montados em paralelo por um conjunto limitado de workers (parâmetro 'workers_zip' da seção
+            [origem_arquivos]); cada worker utiliza sua própria conexão ao sistema de arquivos de origem
         :param filesystem_pasta_temp: sistema de arquivos da pasta temporária em que os arquivos serão copiados e compactados
         :param filesystem_arquivos: sistema de arquivos onde os arquivos de origem estarão
         :param df_arquivos: dataframe contendo a lista de arquivos ou pastas associados às licitações
         :param df_metadados: dataframe contendo os metadados das licitações
-        :return: lista contendo o nome dos arquivos zips a serem futuramente copiados para o filesystem de destino
+        :param dia: dia da carga, usado no checkpoint (se habilitado)
+        :return: lista contendo o nome dos arquivos zips a serem futuramente copiados para o filesystem de destino, na
+            mesma ordem das licitações em df_metadados
         """
         try:
-            arquivos_zip = []
-            # Primeiro se obtém a lista das licitações cujos metadados foram retornados
-            lista_licitacoes = list(df_metadados['id_licitacao'])
-            # Itera sobre os ids de licitação, procurando no dataframe de arquivos quais os arquivos correspondentes a cada uma
-            for lic in lista_licitacoes:
-                # Cria uma pasta com o nome da licitação, em que serão colocados os arquivos a serem zipados
-                # Para cada licitação, gera lista com os caminhos dos arquivos associados dentro do diretório do filesystem.
-                paths = list(df_arquivos.loc[df_arquivos['id_licitacao'] == lic]['caminho'])
-                if len(paths) > 0:
-                    filesystem_pasta_licitacao = filesystem_pasta_temp.makedirs(lic, recreate = True)
-                    #print("filesystem_pasta_licitacao:", filesystem_pasta_licitacao)
-                    # Iterando sobre os arquivos e pastas retornados na consulta, escreve todos na pasta de saída para posteriormente ziar
-                    for path in paths:
-                        if (path.startswith('http://') or path.startswith('https://')):
-                            caminho_origem = path
-                        else:
-                            caminho_origem = '/' + path
-                        nome_arquivo_pasta = get_nome_arquivo_pasta(caminho_origem) #Puxa somente o fim do caminho (nome do arquivo ou pasta)
-                        if (caminho_origem.startswith('http://') or caminho_origem.startswith('https://')):
-                            #destino = filesystem_pasta_licitacao.getsyspath('.') + '/' + nome_arquivo_pasta
-                            #print('download de arquivo via http: ',caminho_origem, ' ; destino: ',destino)
-                            try:
-                                urllib.request.urlretrieve(caminho_origem, filesystem_pasta_licitacao.getsyspath('.') + '/' + nome_arquivo_pasta)
-                            except:
-                                print("Erro ao realizar download: ", caminho_origem)
-                                #logging.warning("Erro ao realizar download: ", caminho_origem)
-                        elif filesystem_arquivos.isfile(caminho_origem):
-                            filesystem_pasta_licitacao.create(nome_arquivo_pasta)
-                            fs.copy.copy_file(filesystem_arquivos, caminho_origem, filesystem_pasta_licitacao, nome_arquivo_pasta)
-                        elif filesystem_arquivos.isdir(caminho_origem):
-                            filesystem_pasta_licitacao.makedirs(nome_arquivo_pasta, recreate = True)
-                            fs.copy.copy_dir(filesystem_arquivos, caminho_origem , filesystem_pasta_licitacao, nome_arquivo_pasta)         
-                        
-                        else:
-                            pass
-                    with filesystem_pasta_temp.open(lic + '.zip', mode='wb') as arquivo_zip:
-                        fs.compress.write_zip(filesystem_pasta_licitacao, arquivo_zip)
-                    filesystem_pasta_temp.removetree(lic)
-                    arquivos_zip.append(lic + '.zip')
+            with self.metricas.medir('obter_arquivos_zip', dia) as valores:
+                # Primeiro se obtém a lista das licitações cujos metadados foram retornados
+                lista_licitacoes = list(df_metadados['id_licitacao'])
+                # Agrupa os caminhos dos arquivos e pastas associados a cada licitação em uma única passada
+                paths_por_licitacao = {lic: list(paths) for lic, paths in df_arquivos.groupby('id_licitacao', sort=False)['caminho']}
+                # Com workers_zip=auto, um worker por núcleo: o zlib libera o GIL durante a compressão, de modo que as
+                # threads dividem o trabalho de CPU entre os núcleos
+                if self.config_origem_arquivos.get('workers_zip', '1').strip() == 'auto':
+                    workers = os.cpu_count() or 1
+                else:
+                    workers = self.config_origem_arquivos.getint('workers_zip', fallback=1)
+                if workers <= 1:
+                    resultados = [self.obter_zip_licitacao(lic, paths_por_licitacao.get(lic, []), filesystem_pasta_temp, filesystem_arquivos, dia)
+                                  for lic in lista_licitacoes]
                 else:
-                    logging.info('Nenhum arquivo obtido para a licitação de id {}'.format(lic))
-            print(arquivos_zip)
-            return arquivos_zip
+                    resultados = self.compactar_licitacoes_paralelo(lista_licitacoes, paths_por_licitacao, filesystem_pasta_temp, workers, dia)
+                arquivos_zip = [arq for arq in resultados if arq is not None]
+                logging.info('{} zip(s) montados para {} licitação(ões)'.format(len(arquivos_zip), len(lista_licitacoes)))
+                valores['linhas'] = len(lista_licitacoes)
+                valores['arquivos'] = len(arquivos_zip)
+                if self.metricas.habilitado:
+                    valores['bytes'] = sum(filesystem_pasta_temp.getsize(arq) for arq in arquivos_zip)
+                return arquivos_zip
         except Exception as e:
             logging.error('Erro ao compactar arquivos: {}'.format(str(e)))
             traceback.print_exc(file=sys.stdout)
             sys.exit()
 
 
-    def upload(self, df_licitacoes, filesystem_pasta_temp, arquivos_zip, filesystem_destino, dia):
+    def compactar_licitacoes_paralelo(self, lista_licitacoes, paths_por_licitacao, filesystem_pasta_temp, workers, dia=None):
+        """
+        Monta os zips das licitações em um pool de threads. Cada thread abre (uma única vez) sua própria conexão ao
+            sistema de arquivos de origem, já que as conexões SFTP/WebDAV não devem ser compartilhadas entre threads
+        :param lista_licitacoes: ids das licitações, na ordem em que os zips devem ser retornados
+        :param paths_por_licitacao: dicionário com os caminhos de origem associados a cada licitação
+        :param filesystem_pasta_temp: sistema de arquivos da pasta temporária
+        :param workers: quantidade máxima de licitações compactadas simultaneamente
+        :param dia: dia da carga, usado no checkpoint (se habilitado)
+        :return: lista com o nome do zip de cada licitação (ou None, se a licitação não tem arquivos), na ordem de lista_licitacoes
+        """
+        conexoes = threading.local()
+        filesystems_abertos = []
+        trava = threading.Lock()
+
+        def compactar(lic):
+            if not hasattr(conexoes, 'filesystem_arquivos'):
+                conexoes.filesystem_arquivos = alice_util.obter_filesystem(self.config_origem_arquivos, criar_diretorio=False)
+                with trava:
+                    filesystems_abertos.append(conexoes.filesystem_arquivos)
+            return self.obter_zip_licitacao(lic, paths_por_licitacao.get(lic, []), filesystem_pasta_temp, conexoes.filesystem_arquivos, dia)
+
+        logging.info('Compactando {} licitações com {} workers'.format(len(lista_licitacoes), workers))
+        try:
+            with concurrent.futures.ThreadPoolExecutor(max_workers=workers) as executor:
+                futuros = [executor.submit(compactar, lic) for lic in lista_licitacoes]
+                try:
+                    # Os resultados são lidos na ordem de submissão, o que torna a lista retornada determinística
+                    return [futuro.result() for futuro in futuros]
+                except Exception:
+                    for futuro in futuros:
+                        futuro.cancel()
+                    raise
+        finally:
+            for filesystem in filesystems_abertos:
+                filesystem.close()
+
+
+    def obter_zip_licitacao(self, lic, paths, filesystem_pasta_temp, filesystem_arquivos, dia=None):
+        """
+        Obtém o zip de uma licitação: reaproveita o zip registrado no checkpoint por uma execução interrompida, se ainda
+            íntegro na pasta temporária, ou o monta e o registra no checkpoint
+        :param dia: dia da carga (sem checkpoint habilitado, o zip é sempre montado)
+        :return: nome do arquivo zip, ou None se não há arquivos associados à licitação
+        """
+        if self.checkpoint is None or dia is None or len(paths) == 0:
+            return self.compactar_licitacao(lic, paths, filesystem_pasta_temp, filesystem_arquivos)
+        dia_str = dia.strftime('%Y%m%d')
+        if self.checkpoint.obter_zip(dia_str, lic + '.zip', filesystem_pasta_temp):
+            logging.info('Zip da licitação de id {} reaproveitado do checkpoint'.format(lic))
+            return lic + '.zip'
+        arquivo_zip = self.compactar_licitacao(lic, paths, filesystem_pasta_temp, filesystem_arquivos)
+        if arquivo_zip not in self.zips_incompletos:
+            self.checkpoint.registrar_zip(dia_str, arquivo_zip, filesystem_pasta_temp)
+        return arquivo_zip
+
+
+    def compactar_licitacao(self, lic, paths, filesystem_pasta_temp, filesystem_arquivos):
+        """
+        Gera o zip de uma licitação, lendo cada arquivo de origem diretamente para a entrada correspondente do zip
+            (sem cópia intermediária para a pasta temporária)
+        :param lic: id da licitação
+        :param paths: lista com os caminhos dos arquivos ou pastas associados à licitação
+        :param filesystem_pasta_temp: sistema de arquivos da pasta temporária em que o zip será escrito
+        :param filesystem_arquivos: sistema de arquivos onde os arquivos de origem estarão
+        :return: nome do arquivo zip gerado, ou None se não há arquivos associados à licitação
+        """
+        if len(paths) == 0:
+            logging.info('Nenhum arquivo obtido para a licitação de id {}'.format(lic))
+            return None
+        # Os downloads http da licitação são agendados antes, para que ocorram em paralelo à leitura dos demais arquivos
+        downloads = [self.baixador_http.agendar(path, lic) if (path.startswith('http://') or path.startswith('https://')) else None
+                     for path in paths]
+        try:
+            with filesystem_pasta_temp.open(lic + '.zip', mode='wb') as arquivo_zip, EscritorZip(arquivo_zip, cache=self.cache_arquivos, politica=self.politica_compressao) as escritor:
+                # Iterando sobre os arquivos e pastas retornados na consulta, escreve todos no zip da licitação. Os caminhos
+                # são gravados do último para o primeiro: o EscritorZip mantém a primeira entrada de cada nome, de modo que,
+                # como na cópia para uma pasta, prevalece o último caminho (inclusive nos arquivos de pastas mescladas)
+                for posicao, path in reversed(list(enumerate(paths))):
+                    download, downloads[posicao] = downloads[posicao], None
+                    if (path.startswith('http://') or path.startswith('https://')):
+                        caminho_origem = path
+                    else:
+                        caminho_origem = '/' + path
+                    nome_arquivo_pasta = get_nome_arquivo_pasta(caminho_origem) #Puxa somente o fim do caminho (nome do arquivo ou pasta)
+                    if (caminho_origem.startswith('http://') or caminho_origem.startswith('https://')):
+                        try:
+                            origem, tamanho = download.result()
+                        except ErroDownload as e:
+                            logging.warning(str(e))
+                            self.zips_incompletos.add(lic + '.zip')
+                            continue
+                        with origem:
+                            escritor.adicionar_stream(origem, nome_arquivo_pasta, tamanho)
+                    elif filesystem_arquivos.isfile(caminho_origem):
+                        escritor.adicionar_arquivo(filesystem_arquivos, caminho_origem, nome_arquivo_pasta)
+                    elif filesystem_arquivos.isdir(caminho_origem):
+                        escritor.adicionar_pasta(filesystem_arquivos, caminho_origem, nome_arquivo_pasta)
+        finally:
+            # Se a montagem do zip foi interrompida por um erro, os downloads restantes da licitação são descartados
+            descartar_downloads(downloads)
+        return lic + '.zip'
+
+
+    def upload(self, df_licitacoes, filesystem_pasta_temp, arquivos_zip, filesystem_destino, dia, alteracoes=None):
         """
         Faz o upload dos metadados e dos arquivos zip das licitações para o sistema de arquivos de destino
         :param df_licitacoes: dataframe contendo os metadados das licitações
@@ -377,25 +765,370 @@ class Uploader(object):
         :param arquivos_zip: lista dos arquivos zip que serão enviados no lote
         :param filesystem_destino: sistema de arquivos em que os arquivos compactados serão colocados
         :param dia: a data de publicação das licitações do lote que está sendo enviado 
+        :param alteracoes: no modo delta, dicionário com os ids das licitações 'novas', 'alteradas' e 'removidas' desde
+            o último envio do dia; é gravado no manifesto alteracoes.json, e os zips das removidas são apagados do destino
         """
         diaString = dia.strftime('%d/%m/%Y')
         logging.info('Início de upload dos arquivos do dia {}'.format(diaString))
         try: 
-            # Arquivos PDF:
-            data_str = dia.strftime('%Y%m%d')
-            fs_batch = filesystem_destino.makedirs('/' + data_str, recreate=True)
-            for arq in arquivos_zip:
-                fs.copy.copy_file(filesystem_pasta_temp, arq, fs_batch, arq)
-            # Metadados:
-            df_licitacoes = df_licitacoes.replace(r'\n',' ', regex=True) 
-            with fs_batch.open('licitacoes.json', mode='w', encoding='utf-8') as arq_meta:
-                df_licitacoes.to_json(arq_meta, orient='records', indent=4, double_precision=2,date_format='iso', force_ascii=False)
-                #fs_batch.upload('licitacoes.json', arq_meta)
-            logging.info('Fim de upload dos arquivos do dia {}'.format(diaString))
+            with self.metricas.medir('upload', dia) as valores:
+                # Os arquivos são enviados para a pasta <dia>.parcial, renomeada para <dia> depois que todos foram gravados
+                data_str = dia.strftime('%Y%m%d')
+                pasta_dia = '/' + data_str
+                pasta_parcial = pasta_dia + '.parcial'
+                if filesystem_destino.exists(pasta_parcial) and self.checkpoint is None:
+                    # Resquício de um envio interrompido
+                    filesystem_destino.removetree(pasta_parcial)
+                fs_batch = filesystem_destino.makedirs(pasta_parcial, recreate=True)
+                # Arquivos PDF:
+                pendentes = arquivos_zip
+                if self.checkpoint is not None:
+                    # Com checkpoint, mantém na pasta provisória apenas os zips do dia já enviados (e registrados) por uma execução interrompida
+                    enviados = set(arq for arq in arquivos_zip if self.checkpoint.zip_enviado(data_str, arq))
+                    for nome in fs_batch.listdir('/'):
+                        if nome not in enviados:
+                            fs_batch.remove(nome)
+                    pendentes = [arq for arq in arquivos_zip if arq not in enviados or not fs_batch.isfile(arq)]
+                    if len(pendentes) < len(arquivos_zip):
+                        logging.info('{} zip(s) do dia {} já enviados, de acordo com o checkpoint'.format(len(arquivos_zip) - len(pendentes), diaString))
+                valores['linhas'] = len(df_licitacoes)
+                valores['arquivos'] = len(pendentes)
+                if self.metricas.habilitado:
+                    valores['bytes'] = sum(filesystem_pasta_temp.getsize(arq) for arq in pendentes)
+                workers = self.config_destino.getint('workers_upload', fallback=1)
+                if workers > 1 and len(pendentes) > 1:
+                    self.enviar_arquivos_paralelo(filesystem_pasta_temp, pendentes, pasta_parcial, workers, data_str)
+                else:
+                    for arq in pendentes:
+                        self.enviar_zip(filesystem_pasta_temp, arq, fs_batch, data_str)
+                # Metadados:
+                indentar = self.config_destino.get('formato_json', 'indentado') != 'compacto'
+                if self.config_destino.get('compressao_json', '') == 'gzip':
+                    with fs_batch.openbin('licitacoes.json.gz.parcial', mode='w') as arq_bin, \
+                            gzip.GzipFile(filename='licitacoes.json', fileobj=arq_bin, mode='wb') as arq_gzip, \
+                            io.TextIOWrapper(arq_gzip, encoding='utf-8') as arq_meta:
+                        escrever_json_licitacoes(df_licitacoes, arq_meta, indentar)
+                    fs_batch.move('licitacoes.json.gz.parcial', 'licitacoes.json.gz', overwrite=True)
+                    nome_metadados = 'licitacoes.json.gz'
+                else:
+                    with fs_batch.open('licitacoes.json.parcial', mode='w', encoding='utf-8') as arq_meta:
+                        escrever_json_licitacoes(df_licitacoes, arq_meta, indentar)
+                    fs_batch.move('licitacoes.json.parcial', 'licitacoes.json', overwrite=True)
+                    nome_metadados = 'licitacoes.json'
+                if self.metricas.habilitado:
+                    valores['bytes'] += fs_batch.getsize(nome_metadados)
+                valores['arquivos'] += 1
+                if alteracoes is not None:
+                    # Manifesto das alterações do envio
+                    manifesto = dict(alteracoes, dia=data_str, gerado_em=datetime.now().isoformat(timespec='seconds'))
+                    fs_batch.writetext('alteracoes.json', json.dumps(manifesto, ensure_ascii=False, indent=4), encoding='utf-8')
+                publicar_pasta(filesystem_destino, pasta_parcial, pasta_dia)
+                for lic in (alteracoes or {}).get('removidas', []):
+                    if filesystem_destino.isfile(pasta_dia + '/' + lic + '.zip'):
+                        filesystem_destino.remove(pasta_dia + '/' + lic + '.zip')
+                if self.checkpoint is not None:
+                    self.checkpoint.concluir_dia(data_str)
+                logging.info('Fim de upload dos arquivos do dia {}'.format(diaString))
         except Exception as e:
             logging.error('Erro ao fazer upload de arquivos: {}'.format(str(e)))
             sys.exit()
 
+    def enviar_zip(self, filesystem_pasta_temp, arquivo_zip, fs_batch, dia_str):
+        """
+        Envia um zip para a pasta provisória do dia no destino e registra o envio no checkpoint (se habilitado)
+        :param dia_str: dia da carga (AAAAMMDD)
+        """
+        enviar_arquivo(filesystem_pasta_temp, arquivo_zip, fs_batch)
+        if self.checkpoint is not None:
+            self.checkpoint.registrar_envio(dia_str, arquivo_zip)
+
+    def enviar_arquivos_paralelo(self, filesystem_pasta_temp, arquivos_zip, pasta_destino, workers, dia_str=None):
+        """
+        Envia os arquivos zip para o destino em paralelo, cada worker com sua própria conexão ao sistema de arquivos de destino
+        :param filesystem_pasta_temp: sistema de arquivos da pasta temporária que contém os arquivos compactados
+        :param arquivos_zip: lista dos arquivos zip que serão enviados
+        :param pasta_destino: pasta do sistema de arquivos de destino que receberá os arquivos
+        :param workers: quantidade de arquivos enviados simultaneamente
+        :param dia_str: dia da carga (AAAAMMDD), usado no checkpoint (se habilitado)
+        """
+        conexoes = threading.local()
+        filesystems = []
+        trava = threading.Lock()
+
+        def enviar(arq):
+            if not hasattr(conexoes, 'filesystem_destino'):
+                conexoes.filesystem_destino = alice_util.obter_filesystem(self.config_destino, criar_diretorio=False)
+                conexoes.fs_batch = conexoes.filesystem_destino.opendir(pasta_destino)
+                with trava:
+                    filesystems.append(conexoes.filesystem_destino)
+            self.enviar_zip(filesystem_pasta_temp, arq, conexoes.fs_batch, dia_str)
+
+        try:
+            with concurrent.futures.ThreadPoolExecutor(max_workers=workers) as executor:
+                list(executor.map(enviar, arquivos_zip))
+        finally:
+            for filesystem in filesystems:
+                filesystem.close()
+
+class PoliticaCompressao(object):
+    """Escolhe, pela extensão do arquivo, o método e o nível de compressão de cada entrada do zip de uma licitação:
+        formatos já compactados (PDF, imagens, zips, documentos do Office em formato OOXML etc.) são armazenados sem
+        recompressão, e os demais são comprimidos com deflate, com nível próprio para textos e documentos do Office
+        em formato binário, que se beneficiam de uma compressão mais forte.
+
+        Attributes:
+            extensoes_armazenadas (frozenset): extensões (minúsculas, sem ponto) armazenadas sem compressão.
+            extensoes_texto (frozenset): extensões comprimidas com nivel_texto.
+            nivel_texto (int): nível do deflate (0 a 9) dos arquivos de texto e documentos.
+            nivel_padrao (int): nível do deflate dos demais arquivos (None para o padrão do zlib).
+    """
+
+    EXTENSOES_ARMAZENADAS = ('pdf,jpg,jpeg,png,gif,tif,tiff,webp,zip,rar,7z,gz,tgz,bz2,xz,'
+                             'docx,xlsx,pptx,odt,ods,odp,mp3,mp4,avi')
+    EXTENSOES_TEXTO = 'txt,csv,xml,json,html,htm,rtf,doc,xls,ppt,sql,log'
+
+    def __init__(self, extensoes_armazenadas=EXTENSOES_ARMAZENADAS, extensoes_texto=EXTENSOES_TEXTO, nivel_texto=9, nivel_padrao=None):
+        self.extensoes_armazenadas = obter_extensoes(extensoes_armazenadas)
+        self.extensoes_texto = obter_extensoes(extensoes_texto)
+        self.nivel_texto = nivel_texto
+        self.nivel_padrao = nivel_padrao
+
+    def obter(self, nome):
+        """
+        Obtém o método e o nível de compressão de um arquivo
+        :param nome: nome (ou caminho) do arquivo
+        :return: tupla (método de compressão do módulo zipfile, nível de compressão ou None)
+        """
+        extensao = os.path.splitext(nome)[1][1:].lower()
+        if extensao in self.extensoes_armazenadas:
+            return zipfile.ZIP_STORED, None
+        if extensao in self.extensoes_texto:
+            return zipfile.ZIP_DEFLATED, self.nivel_texto
+        return zipfile.ZIP_DEFLATED, self.nivel_padrao
+
+def obter_extensoes(extensoes):
+    """
+    Converte uma lista de extensões separadas por vírgula (com ou sem ponto) em um conjunto de extensões minúsculas
+    :param extensoes: texto com as extensões, ex.: 'pdf, .JPG, zip'
+    :return: frozenset de extensões sem ponto
+    """
+    return frozenset(ext.strip().lstrip('.').lower() for ext in extensoes.split(',') if ext.strip().lstrip('.'))
+
+def obter_politica_compressao(config_secao):
+    """
+    Obtém a política de compressão dos zips configurada na seção [origem_arquivos] (parâmetro politica_compressao=S)
+    :param config_secao: seção do arquivo de configuração
+    :return: PoliticaCompressao, ou None se a política não está habilitada (todos os arquivos comprimidos com deflate)
+    """
+    if config_secao.get('politica_compressao', 'N') != 'S':
+        return None
+    nivel_padrao = config_secao.getint('nivel_compressao', fallback=None)
+    nivel_texto = config_secao.getint('nivel_compressao_texto', fallback=9)
+    for nivel in (nivel_padrao, nivel_texto):
+        if nivel is not None and not 0 <= nivel <= 9:
+            raise Exception('Nível de compressão {} inválido. Valores possíveis: 0 a 9'.format(nivel))
+    return PoliticaCompressao(config_secao.get('extensoes_sem_compressao', PoliticaCompressao.EXTENSOES_ARMAZENADAS),
+                              config_secao.get('extensoes_texto', PoliticaCompressao.EXTENSOES_TEXTO),
+                              nivel_texto, nivel_padrao)
+
+class EscritorZip(object):
+    """Escreve um arquivo zip em modo streaming: o conteúdo de cada arquivo de origem é lido em blocos e gravado
+        diretamente na entrada correspondente do zip, sem cópia intermediária em disco.
+
+        Attributes:
+            arquivo: objeto de arquivo (binário, gravável) em que o zip será escrito.
+            compressao: método de compressão do módulo zipfile.
+            cache: CacheArquivos opcional, consultado antes de ler os arquivos da origem.
+            politica: PoliticaCompressao opcional; se informada, define a compressão de cada entrada pelo nome do
+                arquivo, no lugar de compressao.
+    """
+
+    TAMANHO_BLOCO = 1024 * 1024
+
+    def __init__(self, arquivo, compressao=zipfile.ZIP_DEFLATED, cache=None, politica=None):
+        self.compressao = compressao
+        self.cache = cache
+        self.politica = politica
+        self.zip = zipfile.ZipFile(arquivo, mode='w', compression=compressao, allowZip64=True)
+        self.nomes = set()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, tipo, valor, tb):
+        self.close()
+
+    def close(self):
+        self.zip.close()
+
+    def adicionar_stream(self, origem, nome_zip, tamanho=None, modificado=None):
+        """
+        Grava o conteúdo de um objeto de arquivo em uma nova entrada do zip. Se já existe uma entrada com o mesmo nome,
+            o conteúdo não é gravado (uma entrada não pode ser substituída sem reescrever o zip)
+        :param origem: objeto de arquivo (binário, legível) com o conteúdo a ser gravado
+        :param nome_zip: nome da entrada no zip
+        :param tamanho: tamanho do conteúdo, se conhecido (usado para decidir o uso de ZIP64)
+        :param modificado: data de modificação (datetime) a ser registrada na entrada
+        """
+        if nome_zip in self.nomes:
+            logging.warning('Entrada {} duplicada no zip, apenas a primeira ocorrência gravada será mantida'.format(nome_zip))
+            return
+        self.nomes.add(nome_zip)
+        zip_info = zipfile.ZipInfo(nome_zip, data_zip(modificado))
+        zip_info.compress_type = self.compressao
+        zip_info.external_attr = 0o644 << 16
+        if self.politica is not None:
+            zip_info.compress_type, nivel = self.politica.obter(nome_zip)
+            definir_nivel_compressao(zip_info, nivel)
+        if tamanho is not None:
+            zip_info.file_size = tamanho
+        # Sem tamanho conhecido, a entrada é gravada já com os campos ZIP64, caso ultrapasse 4 GiB
+        with self.zip.open(zip_info, mode='w', force_zip64=tamanho is None) as destino:
+            shutil.copyfileobj(origem, destino, self.TAMANHO_BLOCO)
+
+    def adicionar_diretorio(self, nome_zip, modificado=None):
+        """
+        Registra uma entrada de diretório no zip (preserva pastas vazias)
+        :param nome_zip: nome do diretório no zip
+        :param modificado: data de modificação (datetime) a ser registrada na entrada
+        """
+        nome_zip = nome_zip.rstrip('/') + '/'
+        if nome_zip in self.nomes:
+            return
+        self.nomes.add(nome_zip)
+        zip_info = zipfile.ZipInfo(nome_zip, data_zip(modificado))
+        zip_info.external_attr = (0o40755 << 16) | 0x10
+        self.zip.writestr(zip_info, b'')
+
+    def adicionar_arquivo(self, filesystem, caminho, nome_zip):
+        """
+        Grava um arquivo de um PyFilesystem no zip
+        :param filesystem: sistema de arquivos de origem
+        :param caminho: caminho do arquivo no sistema de arquivos de origem
+        :param nome_zip: nome da entrada no zip
+        """
+        info = filesystem.getinfo(caminho, namespaces=['details'])
+        self.gravar_arquivo(filesystem, caminho, info, nome_zip)
+
+    def adicionar_pasta(self, filesystem, caminho, nome_zip):
+        """
+        Grava recursivamente o conteúdo de uma pasta de um PyFilesystem no zip, sob o diretório nome_zip
+        :param filesystem: sistema de arquivos de origem
+        :param caminho: caminho da pasta no sistema de arquivos de origem
+        :param nome_zip: nome do diretório no zip
+        """
+        base = fs.path.abspath(fs.path.normpath(caminho))
+        self.adicionar_diretorio(nome_zip, filesystem.getinfo(base, namespaces=['details']).modified)
+        for path, info in filesystem.walk.info(base, namespaces=['details']):
+            nome_entrada = fs.path.join(nome_zip, fs.path.relpath(fs.path.frombase(base, path)))
+            if info.is_dir:
+                self.adicionar_diretorio(nome_entrada, info.modified)
+            else:
+                self.gravar_arquivo(filesystem, path, info, nome_entrada)
+
+    def gravar_arquivo(self, filesystem, caminho, info, nome_zip):
+        """
+        Grava um arquivo de um PyFilesystem no zip, servindo-o a partir do cache quando possível. Arquivos sem data
+            de modificação conhecida não são armazenados no cache, pois não há como detectar alterações na origem
+        :param filesystem: sistema de arquivos de origem
+        :param caminho: caminho do arquivo no sistema de arquivos de origem
+        :param info: objeto Info do arquivo, com o namespace 'details'
+        :param nome_zip: nome da entrada no zip
+        """
+        if self.cache is None or info.modified is None:
+            with filesystem.openbin(caminho) as origem:
+                self.adicionar_stream(origem, nome_zip, info.size, info.modified)
+            return
+        chave = CacheArquivos.chave_arquivo(caminho, info.size, info.modified)
+        origem = self.cache.obter(chave)
+        if origem is None:
+            with filesystem.openbin(caminho) as origem_remota:
+                origem = self.cache.armazenar(chave, origem_remota)
+        with origem:
+            self.adicionar_stream(origem, nome_zip, info.size, info.modified)
+
+def definir_nivel_compressao(zip_info, nivel):
+    """
+    Define o nível de compressão de uma entrada do zip, mantendo a gravação em blocos pelo ZipFile.open (o writestr,
+        única forma pública de informar o nível de uma entrada antes do Python 3.13, exige o conteúdo inteiro em memória)
+    :param zip_info: ZipInfo da entrada
+    :param nivel: nível de compressão, ou None para o padrão do método de compressão
+    """
+    if hasattr(zip_info, 'compress_level'):
+        # Python 3.13+
+        zip_info.compress_level = nivel
+    else:
+        zip_info._compresslevel = nivel
+
+def data_zip(data):
+    """
+    Converte uma data de modificação para o formato de data das entradas de um zip (hora local, a partir de 1980)
+    :param data: datetime (ou None, para a data atual)
+    :return: tupla (ano, mês, dia, hora, minuto, segundo)
+    """
+    data_local = (data or datetime.now()).astimezone()
+    return max(data_local.timetuple()[0:6], (1980, 1, 1, 0, 0, 0))
+
+def escrever_json_licitacoes(df_licitacoes, arquivo, indentar=True, linhas_por_bloco=1000):
+    """
+    Escreve os metadados das licitações em JSON (lista de registros), em blocos de linhas, sem montar o documento
+        inteiro em memória. Quebras de linha em campos texto são substituídas por espaço. A saída é a mesma de um
+        único to_json(orient='records') sobre o dataframe inteiro
+    :param df_licitacoes: dataframe contendo os metadados das licitações
+    :param arquivo: objeto de arquivo texto em que o JSON será escrito
+    :param indentar: se True, escreve o JSON indentado (4 espaços); se False, em formato compacto
+    :param linhas_por_bloco: quantidade de licitações serializadas por vez
+    """
+    indentacao = 4 if indentar else 0
+    if len(df_licitacoes) == 0:
+        arquivo.write(df_licitacoes.to_json(orient='records', indent=indentacao, double_precision=2, date_format='iso', force_ascii=False))
+        return
+    # Cada bloco é serializado como uma lista; os colchetes são removidos e os blocos, concatenados com vírgula.
+    # No formato indentado, a lista termina com "\n]"; no compacto, com "]"
+    fim_lista = '\n]' if indentar else ']'
+    arquivo.write('[')
+    separador = ''
+    for inicio in range(0, len(df_licitacoes), linhas_por_bloco):
+        bloco = df_licitacoes.iloc[inicio:inicio + linhas_por_bloco].copy()
+        # Nas colunas categóricas (ver PlanoTipos), a substituição é feita uma única vez por valor distinto
+        for col in bloco.select_dtypes(include=[object, 'category']).columns:
+            bloco[col] = bloco[col].map(lambda valor: valor.replace('\n', ' ') if isinstance(valor, str) else valor)
+        json_bloco = bloco.to_json(orient='records', indent=indentacao, double_precision=2, date_format='iso', force_ascii=False)
+        arquivo.write(separador + json_bloco[1:-len(fim_lista)])
+        separador = ','
+    arquivo.write(fim_lista)
+
+def enviar_arquivo(filesystem_origem, caminho, filesystem_destino):
+    """
+    Copia um arquivo para o destino com um nome provisório (<nome>.parcial) e o renomeia ao final da cópia. A cópia não
+        trava os sistemas de arquivos (ver alice_util.copiar_arquivo), pois a pasta temporária de origem é compartilhada
+        pelos workers de envio
+    :param filesystem_origem: sistema de arquivos de origem
+    :param caminho: caminho do arquivo, igual na origem e no destino
+    :param filesystem_destino: sistema de arquivos de destino
+    """
+    alice_util.copiar_arquivo(filesystem_origem, caminho, filesystem_destino, caminho + '.parcial')
+    filesystem_destino.move(caminho + '.parcial', caminho, overwrite=True)
+
+def publicar_pasta(filesystem, pasta_parcial, pasta_dia):
+    """
+    Torna visível a pasta de um dia, renomeando a pasta provisória em que os arquivos foram gravados. Se a pasta do dia
+        já existe, os arquivos são movidos para ela, com os metadados por último
+    :param filesystem: sistema de arquivos de destino
+    :param pasta_parcial: pasta provisória
+    :param pasta_dia: pasta definitiva do dia
+    """
+    if filesystem.exists(pasta_dia):
+        for nome in sorted(filesystem.listdir(pasta_parcial), key=lambda nome: nome.startswith('licitacoes.json')):
+            filesystem.move(pasta_parcial + '/' + nome, pasta_dia + '/' + nome, overwrite=True)
+        filesystem.removedir(pasta_parcial)
+    elif filesystem.hassyspath(pasta_parcial):
+        os.rename(filesystem.getsyspath(pasta_parcial), filesystem.getsyspath(pasta_dia))
+        # A renomeação é feita fora do PyFilesystem; makedirs sobre a pasta já existente apenas descarta listagens em cache
+        filesystem.makedirs(pasta_dia, recreate=True)
+    else:
+        filesystem.movedir(pasta_parcial, pasta_dia, create=True)
+
 def remover_pasta(filesystem, dir_path):
         logging.info("Removendo o diretório {}".format(dir_path))
         with filesystem._lock:
@@ -418,6 +1151,214 @@ def remover_pasta(filesystem, dir_path):
                 filesystem.removedir(dir_path)
                 logging.info('Pasta {} removida'.format(dir_path))
 
+def agrupar_registros(df_tabela, registros_por_licitacao):
+    """
+    Acrescenta os registros de (um bloco de) uma tabela filha (lotes, itens, participantes etc.) às listas de registros
+        de cada licitação. A tabela é particionada por id_licitacao em uma única passada (groupby), preservando a
+        ordem em que as linhas foram retornadas pela consulta
+    :param df_tabela: dataframe (ou bloco) da tabela filha, contendo a coluna id_licitacao
+    :param registros_por_licitacao: dicionário id_licitacao -> lista de registros (sem a coluna id_licitacao), atualizado
+    """
+    colunas = [col for col in df_tabela.columns if col != 'id_licitacao']
+    registros = df_tabela[colunas].to_dict('records')
+    # indices: posições das linhas de cada id_licitacao, preservando a ordem original dentro do grupo
+    for id, posicoes in df_tabela.groupby('id_licitacao', sort=False).indices.items():
+        registros_por_licitacao.setdefault(id, []).extend(registros[i] for i in posicoes)
+
+def aninhar_registros(df_licitacoes, registros_por_licitacao, tabela):
+    """
+    Aninha no dataframe de licitações os registros agrupados de uma tabela filha: cada licitação recebe, na coluna de
+        mesmo nome da tabela, a lista de seus registros. Licitações sem registros na tabela filha recebem nulo.
+    :param df_licitacoes: dataframe contendo os metadados das licitações
+    :param registros_por_licitacao: dicionário id_licitacao -> lista de registros, obtido com agrupar_registros
+    :param tabela: nome da tabela filha, usado como nome da nova coluna
+    :return: cópia do dataframe de licitações acrescida da coluna aninhada
+    """
+    df_licitacoes = df_licitacoes.copy()
+    df_licitacoes[tabela] = df_licitacoes['id_licitacao'].map(registros_por_licitacao)
+    return df_licitacoes
+
+def consultar_em_blocos(script_sql, conexao_banco, parametros, linhas_por_bloco):
+    """
+    Executa uma consulta lendo o resultado em blocos por meio de um cursor no servidor (stream_results), de modo que
+        o resultado completo não seja carregado de uma só vez na memória
+    :param script_sql: consulta sql
+    :param conexao_banco: engine de conexão ao banco de dados do sqlalchemy
+    :param parametros: parâmetros da consulta
+    :param linhas_por_bloco: quantidade de linhas de cada bloco
+    :return: gerador de dataframes do Pandas
+    """
+    with conexao_banco.connect() as conexao:
+        conexao = conexao.execution_options(stream_results=True)
+        for bloco in pd.read_sql_query(script_sql, conexao, params=parametros, chunksize=linhas_por_bloco):
+            yield bloco
+
+def compilar_validadores(config_origem):
+    """
+    Compila os esquemas (esquema_<tabela>) das tabelas listadas no arquivo de configuração em validadores
+    :param config_origem: seção do arquivo de configuração com a lista de tabelas e seus esquemas
+    :return: dicionário tabela -> ValidadorTabela
+    """
+    return {tabela: ValidadorTabela(tabela, ast.literal_eval(config_origem['esquema_' + tabela]))
+            for tabela in ast.literal_eval(config_origem['tabelas'])}
+
+def compilar_planos_tipos(validadores, colunas_referenciadas):
+    """
+    Compila, a partir dos esquemas das tabelas de metadados, os planos de tipos compactos dos dataframes
+    :param validadores: dicionário tabela -> ValidadorTabela
+    :param colunas_referenciadas: dicionário tabela -> lista de colunas referenciadas por chaves estrangeiras
+    :return: dicionário tabela -> PlanoTipos
+    """
+    return {tabela: PlanoTipos(tabela, validador.esquema, colunas_referenciadas.get(tabela, []))
+            for tabela, validador in validadores.items()}
+
+def obter_colunas_referenciadas(validadores):
+    """
+    Obtém, a partir dos validadores das tabelas, as colunas de cada tabela referenciadas por chaves estrangeiras ('ref')
+    :param validadores: dicionário tabela -> ValidadorTabela
+    :return: dicionário tabela -> lista de colunas referenciadas
+    """
+    colunas_referenciadas = {}
+    for validador in validadores.values():
+        for tabela_ref, campo_ref in validador.referencias.values():
+            if campo_ref not in colunas_referenciadas.setdefault(tabela_ref, []):
+                colunas_referenciadas[tabela_ref].append(campo_ref)
+    return colunas_referenciadas
+
+class ValidadorTabela(object):
+    """Validador dos dados de uma tabela, compilado uma única vez a partir do esquema definido no arquivo de
+        configuração. Os valores permitidos ('enum') ficam em conjuntos e as chaves estrangeiras ('ref') são conferidas
+        contra índices (pd.Index) dos valores da tabela referenciada; cada coluna é verificada com operações vetorizadas,
+        em uma única passada por bloco.
+
+        Attributes:
+            tabela (str): nome da tabela.
+            esquema (dict): esquema da tabela, no formato {coluna: {'tipo': ..., 'obrigatorio': 'S'/'N', ['enum': [...]], ['ref': 'tabela.coluna']}}.
+    """
+
+    def __init__(self, tabela, esquema):
+        self.tabela = tabela
+        self.esquema = esquema
+        self.obrigatorios = [col for col, definicao in esquema.items() if definicao['obrigatorio'] == 'S']
+        self.tipos = {col: definicao['tipo'] for col, definicao in esquema.items()}
+        self.valores_validos = {col: frozenset(definicao['enum']) for col, definicao in esquema.items() if 'enum' in definicao}
+        self.referencias = {col: tuple(definicao['ref'].split('.')) for col, definicao in esquema.items() if 'ref' in definicao}
+
+    def validar(self, df_validar, indices_chaves, resultado):
+        """
+        Valida um dataframe (ou um bloco da tabela), acumulando as divergências encontradas
+        :param df_validar: dataframe a ser validado
+        :param indices_chaves: dicionário tabela -> {coluna: pd.Index dos valores}, das tabelas referenciadas
+        :param resultado: ResultadoValidacao em que as divergências são acumuladas
+        """
+        colunas_ausentes = [col for col in self.obrigatorios if col not in df_validar.columns]
+        if len(colunas_ausentes) > 0:
+            resultado.adicionar_erro("O(s) campo(s) \"{}\" são obrigatórios e não estão presentes no conjunto de metadados da tabela \"{}\"".format(",".join(colunas_ausentes), self.tabela))
+            return
+        nulos = df_validar.isnull()
+        quantidade_nulos = nulos.sum()
+        # A conferência de chaves estrangeiras considera apenas as linhas sem nenhum campo nulo
+        linhas_completas = ~nulos.any(axis=1)
+        for col in df_validar.columns:
+            if col not in self.esquema:
+                resultado.adicionar_erro("O campo \"{}\" é retornado pela consulta da tabela \"{}\" mas não faz parte da configuração do esquema".format(col, self.tabela))
+                continue
+            resultado.colunas_lidas.add(col)
+            if quantidade_nulos[col] < len(df_validar):
+                resultado.colunas_com_valores.add(col)
+            if quantidade_nulos[col] > 0 and col in self.obrigatorios:
+                resultado.adicionar_erro("O campo \"{}\" da tabela \"{}\" é obrigatório, mas há um ou mais registros com valores nulos".format(col, self.tabela))
+            # Se o campo só contém valores nulos, é impossível realizar a inferência de tipo
+            elif quantidade_nulos[col] < len(df_validar):
+                # Confronta tipo da coluna de acordo com definição do esquema
+                tipo_col = self.tipos[col]
+                tipo_lido = str(df_validar[col].dtype)
+                if(tipo_lido in ['int', 'int64'] and tipo_col in ['float','float64']):
+                    resultado.adicionar_aviso("O campo \"{}\" é do tipo int, mas no modelo de dados consta como float - os dados serão carregados mesmo assim".format(col))
+                elif(tipo_lido=='float64' and tipo_col=='int'):
+                    resultado.adicionar_aviso("O campo \"{}\" é do tipo float, mas no modelo de dados consta como int - os dados poderão ser truncados no upload para o Alice".format(col))
+                elif(traduz_tipos_pandas(tipo_lido) != tipo_col):
+                    resultado.adicionar_erro("O campo \"{}\" é do tipo {}, quando deveria ser do tipo {}".format(col, tipo_lido, tipo_col))
+
+            #Confronta os valores válidos da coluna de acordo com definição de valores possíveis do esquema
+            if col in self.valores_validos:
+                validos = df_validar[col].isin(self.valores_validos[col])
+                if col not in self.obrigatorios:
+                    validos |= nulos[col]
+                if not validos.all():
+                    resultado.adicionar_erro("Há linhas do campo \"{}\" fora dos valores permitidos para esse campo.".format(col))
+
+            #Confronta os valores válidos da coluna de acordo com a chave estrangeira definida no esquema
+            if col in self.referencias:
+                tabela_ref, campo_ref = self.referencias[col]
+                indice = indices_chaves[tabela_ref][campo_ref]
+                if (indice.get_indexer(df_validar[col][linhas_completas]) == -1).any():
+                    resultado.adicionar_erro("Há linhas do campo \"{}\" com valor não correspondente de chave estrangeira.".format(col))
+
+class ResultadoValidacao(object):
+    """Divergências acumuladas na validação dos blocos de uma tabela. Mensagens repetidas em mais de um bloco são
+        registradas uma única vez.
+
+        Attributes:
+            tabela (str): nome da tabela validada.
+    """
+
+    def __init__(self, tabela):
+        self.tabela = tabela
+        self.erros = []
+        self.avisos = []
+        self.colunas_lidas = set()
+        self.colunas_com_valores = set()
+
+    def adicionar_erro(self, mensagem):
+        if mensagem not in self.erros:
+            self.erros.append(mensagem)
+
+    def adicionar_aviso(self, mensagem):
+        if mensagem not in self.avisos:
+            self.avisos.append(mensagem)
+
+    def obter_avisos(self, validador):
+        """
+        Obtém os avisos da validação, incluindo os campos opcionais que só contêm valores nulos em toda a tabela
+        :param validador: ValidadorTabela da tabela
+        :return: lista de mensagens
+        """
+        avisos = list(self.avisos)
+        for col in validador.esquema:
+            if col in self.colunas_lidas and col not in self.colunas_com_valores and col not in validador.obrigatorios:
+                avisos.append("O tipo do campo \"{}\" não pôde ser inferido, pois este só contém valores nulos".format(col))
+        return avisos
+
+class PlanoTipos(object):
+    """Plano de tipos compactos do dataframe de uma tabela de metadados, definido pelo esquema da tabela: as colunas
+        'str' com muitos valores repetidos (ex.: nome_unidade, nome_modalidade) passam a categóricas e as colunas 'int'
+        passam ao menor tipo inteiro que comporta seus valores (ver alice_util.compactar_tipos). As colunas 'float' são
+        mantidas em float64, pois o float32 alteraria os valores, e as colunas 'datetime' já chegam convertidas pelo
+        driver do banco. O id_licitacao e as colunas de chaves estrangeiras ('ref') ou referenciadas por outras tabelas
+        não são convertidos, pois são usados nos agrupamentos e nas conferências de chaves. O plano é aplicado depois da
+        validação, que confere os tipos lidos do banco; o JSON gerado é o mesmo.
+
+        Attributes:
+            tabela (str): nome da tabela.
+            colunas_categoricas (list): colunas candidatas a categóricas.
+            colunas_inteiras (list): colunas inteiras.
+    """
+
+    def __init__(self, tabela, esquema, colunas_chave=()):
+        self.tabela = tabela
+        self.colunas_categoricas = [col for col, definicao in esquema.items() if definicao['tipo'] == 'str' and 'ref' not in definicao
+                                    and col != 'id_licitacao' and col not in colunas_chave]
+        self.colunas_inteiras = [col for col, definicao in esquema.items() if definicao['tipo'] == 'int']
+
+    def aplicar(self, df):
+        """
+        Converte as colunas do dataframe para os tipos compactos do plano
+        :param df: dataframe (ou bloco) da tabela, já validado
+        :return: dataframe compactado
+        """
+        return alice_util.compactar_tipos(df, self.colunas_categoricas, self.colunas_inteiras)
+
 def traduz_tipos_pandas(tipo_pandas):
     """
     Faz a correspondência entre os nomes dos tipos de dados do pandas e os tipos a serem passados como restrições no 
@@ -465,6 +1406,9 @@ def tratar_argumentos(args):
                         help='processa objetos até uma data de fim')
     parser.add_argument('--sobrescrever', action='store_true', 
                         help = 'se presente, sobrescreve as pastas e arquivos já enviados para as mesmas datas')
+    parser.add_argument('--profile', metavar="<PASTA>", nargs='?', const='./log/perfil/', default=None,
+                        help='se presente, grava na pasta informada (padrão: ./log/perfil/) o perfil de execução (cProfile\n'
+                             'e tracemalloc) de cada dia. Desativa a carga em pipeline')
     args = parser.parse_args(args)
 
     return args